@@ -0,0 +1,314 @@
+# Retention: old leads move from the hot table into gzip CSV files, one per month.
+import argparse
+import asyncio
+import csv
+import glob
+import gzip
+import io
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from db import connect
+from leads import normalize_phone
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS lead_archive_batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    first_id INTEGER NOT NULL,
+    last_id INTEGER NOT NULL,
+    row_count INTEGER NOT NULL,
+    files TEXT NOT NULL,  -- JSON {path: size before this batch}, to undo a half-written batch
+    done INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+)
+'''
+
+# Pages handed back to the OS per incremental_vacuum step.
+VACUUM_STEP = 2000
+
+
+def archive_path(directory: str, table: str, month: str) -> str:
+    return os.path.join(directory, f"{table}-{month}.csv.gz")
+
+
+class Archiver:
+    """Moves rows of ``table`` older than ``keep_days`` into monthly archives.
+
+    Each batch of ``batch_size`` rows (oldest ids first) is appended to
+    ``<directory>/<table>-<YYYY-MM>.csv.gz`` as a new gzip member, fsynced,
+    and only then deleted from the table in one short transaction. The sizes
+    of the files before the append are recorded first, so a batch cut short
+    by a crash is truncated away and redone; no row is lost or archived
+    twice. Freed pages are returned with ``PRAGMA incremental_vacuum`` in
+    small steps (the DB must be in incremental auto-vacuum mode, see
+    :meth:`enable_incremental_vacuum`).
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        table: str,
+        directory: str = "archive",
+        keep_days: float = 365,
+        batch_size: int = 1000,
+        pause: float = 0.05,
+        interval: float = 24 * 3600,
+    ):
+        self.db_path = db_path
+        self.table = table
+        self.directory = directory
+        self.keep_days = keep_days
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def _open(self) -> sqlite3.Connection:
+        conn = connect(self.db_path)
+        conn.isolation_level = None
+        conn.execute(ARCHIVE_SCHEMA)
+        return conn
+
+    def _recover(self, conn: sqlite3.Connection):
+        """Cut off what an interrupted batch appended; its rows are still in the table."""
+        for batch_id, files in conn.execute(
+            "SELECT id, files FROM lead_archive_batches WHERE table_name = ? AND done = 0", (self.table,)
+        ).fetchall():
+            for path, size in json.loads(files).items():
+                if os.path.exists(path) and os.path.getsize(path) > size:
+                    logger.warning("Truncating %s to %s bytes (unfinished batch #%s)", path, size, batch_id)
+                    with open(path, "r+b") as f:
+                        f.truncate(size)
+            conn.execute("DELETE FROM lead_archive_batches WHERE id = ?", (batch_id,))
+
+    def _append(self, columns: List[str], months: Dict[str, list]):
+        for month, rows in months.items():
+            path = archive_path(self.directory, self.table, month)
+            new = not os.path.exists(path) or os.path.getsize(path) == 0
+            with open(path, "ab") as f:
+                with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+                    text = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+                    writer = csv.writer(text)
+                    if new:
+                        writer.writerow(columns)
+                    writer.writerows(rows)
+                    text.flush()
+                    text.detach()
+                f.flush()
+                os.fsync(f.fileno())
+
+    def run(self, cutoff: Optional[datetime] = None) -> int:
+        """Archive everything older than the cutoff; returns how many rows were moved."""
+        cutoff = cutoff or datetime.utcnow() - timedelta(days=self.keep_days)
+        cutoff_text = cutoff.isoformat()
+        os.makedirs(self.directory, exist_ok=True)
+        conn = self._open()
+        moved = 0
+        try:
+            self._recover(conn)
+            columns = [r[1] for r in conn.execute(f"PRAGMA table_info({self.table})")]
+            created = columns.index("created_at")
+            while True:
+                rows = conn.execute(
+                    f"SELECT * FROM {self.table} WHERE created_at < ? ORDER BY id LIMIT ?",
+                    (cutoff_text, self.batch_size),
+                ).fetchall()
+                if not rows:
+                    break
+                months: Dict[str, list] = {}
+                for row in rows:
+                    months.setdefault(str(row[created])[:7], []).append(row)
+                first_id, last_id = rows[0][0], rows[-1][0]
+                sizes = {}
+                for month in months:
+                    path = archive_path(self.directory, self.table, month)
+                    sizes[path] = os.path.getsize(path) if os.path.exists(path) else 0
+                batch_id = conn.execute(
+                    "INSERT INTO lead_archive_batches (table_name, first_id, last_id, row_count, files, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.table, first_id, last_id, len(rows), json.dumps(sizes), datetime.utcnow().isoformat() + "Z"),
+                ).lastrowid
+                self._append(columns, months)
+                # The batch is exactly the rows in [first_id, last_id] older than the cutoff.
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute(
+                        f"DELETE FROM {self.table} WHERE id BETWEEN ? AND ? AND created_at < ?",
+                        (first_id, last_id, cutoff_text),
+                    )
+                    conn.execute("UPDATE lead_archive_batches SET done = 1 WHERE id = ?", (batch_id,))
+                    conn.execute("COMMIT")
+                except BaseException:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    raise
+                moved += len(rows)
+                if self.pause:
+                    time.sleep(self.pause)
+            if moved:
+                logger.info("Archived %s rows of %s older than %s", moved, self.table, cutoff_text)
+                self.vacuum(conn)
+            return moved
+        finally:
+            conn.close()
+
+    def vacuum(self, conn: Optional[sqlite3.Connection] = None):
+        """Return free pages to the OS, ``VACUUM_STEP`` pages per short write."""
+        own = conn is None
+        conn = conn or self._open()
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                logger.info("%s is not in incremental auto-vacuum mode; run `archive.py --enable-vacuum` once", self.db_path)
+                return
+            while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+                conn.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP})").fetchall()
+                if self.pause:
+                    time.sleep(self.pause)
+        finally:
+            if own:
+                conn.close()
+
+    def enable_incremental_vacuum(self):
+        """Switch an existing DB to incremental auto-vacuum (one full VACUUM; do it off-hours)."""
+        conn = self._open()
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.run)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lead archiving failed")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        if self.keep_days <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def _matches(lead: dict, phone: Optional[str], name: Optional[str], tg_user_id: Optional[int]) -> bool:
+    if phone and (normalize_phone(str(lead.get("phone") or "")) or lead.get("phone")) != phone:
+        return False
+    if name and name not in str(lead.get("name") or "").lower():
+        return False
+    if tg_user_id is not None and str(lead.get("tg_user_id") or "") != str(tg_user_id):
+        return False
+    return True
+
+
+def search(
+    db_path: str,
+    table: str,
+    directory: str = "archive",
+    phone: Optional[str] = None,
+    name: Optional[str] = None,
+    tg_user_id: Optional[int] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    archived: bool = True,
+) -> Iterator[dict]:
+    """Leads matching all given filters, archived months first, then the hot table.
+
+    ``since``/``until`` are ISO dates or timestamps (``until`` exclusive) and
+    also decide which monthly files are opened at all. ``name`` matches a
+    substring, case-insensitively. Archived values come back as strings.
+    """
+    phone = (normalize_phone(phone) or phone) if phone else None
+    name = name.lower() if name else None
+    if archived:
+        for path in sorted(glob.glob(archive_path(directory, table, "*"))):
+            month = os.path.basename(path)[len(table) + 1:-len(".csv.gz")]
+            if (since and month < since[:7]) or (until and month > until[:7]):
+                continue
+            with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+                for lead in csv.DictReader(f):
+                    created = lead.get("created_at") or ""
+                    if (since and created < since) or (until and created >= until):
+                        continue
+                    if _matches(lead, phone, name, tg_user_id):
+                        yield lead
+
+    where, params = ["1"], []
+    if since:
+        where.append("created_at >= ?")
+        params.append(since)
+    if until:
+        where.append("created_at < ?")
+        params.append(until)
+    if tg_user_id is not None:
+        where.append("tg_user_id = ?")
+        params.append(tg_user_id)
+    if phone:
+        # Hot rows are stored normalized; this uses the phone index.
+        where.append("phone = ?")
+        params.append(phone)
+    conn = connect(db_path)
+    try:
+        cur = conn.execute(f"SELECT * FROM {table} WHERE {' AND '.join(where)} ORDER BY id", params)
+        columns = [d[0] for d in cur.description]
+        for row in cur:
+            lead = dict(zip(columns, row))
+            if _matches(lead, None, name, None):
+                yield lead
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old leads into monthly gzip CSV files, or search them.")
+    parser.add_argument("db_path")
+    parser.add_argument("table", choices=["guest_visits", "guest_requests"])
+    parser.add_argument("--dir", default="archive", help="archive directory")
+    parser.add_argument("--keep-days", type=float, default=365, help="rows older than this are archived")
+    parser.add_argument("--batch", type=int, default=1000, help="rows per delete transaction")
+    parser.add_argument("--enable-vacuum", action="store_true", help="switch the DB to incremental auto-vacuum (one full VACUUM)")
+    parser.add_argument("--search", action="store_true", help="search hot and archived leads instead of archiving")
+    parser.add_argument("--phone")
+    parser.add_argument("--name")
+    parser.add_argument("--tg-user-id", type=int)
+    parser.add_argument("--since")
+    parser.add_argument("--until")
+    opts = parser.parse_args(argv)
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+
+    if opts.search:
+        writer = None
+        for lead in search(opts.db_path, opts.table, opts.dir, opts.phone, opts.name, opts.tg_user_id, opts.since, opts.until):
+            if writer is None:
+                writer = csv.DictWriter(sys.stdout, fieldnames=list(lead))
+                writer.writeheader()
+            writer.writerow(lead)
+        return
+    archiver = Archiver(opts.db_path, opts.table, opts.dir, opts.keep_days, opts.batch)
+    if opts.enable_vacuum:
+        archiver.enable_incremental_vacuum()
+    print(f"archived {archiver.run()} rows into {opts.dir}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# Load-test harness: N concurrent synthetic users driven through a bot's Application, fully offline.
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+from fake_telegram import FakeBotApi, build_bot_app, load_bot, message_update
+
+GUEST_SCRIPT = ["/start", "📆 Расписание", "🧑‍🏫 Тренеры", "📞 Контакты", "🎟️ Гостевой визит", "Бенчмарк Тестович", "{phone}"]
+
+
+class StubRequest(BaseRequest):
+    """In-process Bot transport: answers like the fake Bot API without any sockets."""
+
+    def __init__(self, api: Optional[FakeBotApi] = None, latency: float = 0.0):
+        self.api = api or FakeBotApi()
+        self.latency = latency
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: RequestData = None, *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.api.record(api_method, params)
+        # Always yield like real I/O would, otherwise one user's updates hog the loop.
+        await asyncio.sleep(self.latency)
+        return 200, json.dumps({"ok": True, "result": self.api.result(api_method, params)}).encode("utf-8")
+
+
+class FakeSmtpServer:
+    """Minimal SMTP stand-in (EHLO, AUTH, MAIL/RCPT/DATA) that counts delivered messages."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.messages: List[bytes] = []
+        self.connections = 0
+        self._server: Optional[asyncio.base_events.Server] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        writer.write(b"220 fake-smtp ready\r\n")
+        data: Optional[List[bytes]] = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if data is not None:
+                    if line == b".\r\n":
+                        self.messages.append(b"".join(data))
+                        data = None
+                        writer.write(b"250 queued\r\n")
+                    else:
+                        data.append(line)
+                    continue
+                cmd = line[:4].upper()
+                if cmd == b"EHLO":
+                    writer.write(b"250-fake-smtp\r\n250 AUTH PLAIN LOGIN\r\n")
+                elif cmd == b"AUTH":
+                    parts = line.split()
+                    if len(parts) > 2:
+                        base64.b64decode(parts[2])
+                    writer.write(b"235 authenticated\r\n")
+                elif cmd == b"DATA":
+                    data = []
+                    writer.write(b"354 go ahead\r\n")
+                elif cmd == b"QUIT":
+                    writer.write(b"221 bye\r\n")
+                    break
+                else:
+                    writer.write(b"250 ok\r\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class LoopStallMonitor:
+    """Samples event-loop lag: how late a ``tick``-second sleep wakes up."""
+
+    def __init__(self, tick: float = 0.005, stall_threshold: float = 0.02):
+        self.tick = tick
+        self.stall_threshold = stall_threshold
+        self.lags: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.tick)
+            self.lags.append(max(0.0, time.perf_counter() - start - self.tick))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def report(self) -> dict:
+        stalls = [lag for lag in self.lags if lag >= self.stall_threshold]
+        return {
+            "lag_max_ms": max(self.lags, default=0.0) * 1000,
+            "lag_p99_ms": _quantile(self.lags, 99) * 1000,
+            "stall_count": len(stalls),
+            "stall_total_ms": sum(stalls) * 1000,
+        }
+
+
+def _quantile(values: List[float], q: int) -> float:
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def latency_report(latencies: List[float]) -> dict:
+    return {
+        "count": len(latencies),
+        "p50_ms": _quantile(latencies, 50) * 1000,
+        "p95_ms": _quantile(latencies, 95) * 1000,
+        "p99_ms": _quantile(latencies, 99) * 1000,
+        "max_ms": max(latencies, default=0.0) * 1000,
+    }
+
+
+async def run_bench(bot_path: str, users: int, rounds: int = 1, latency: float = 0.0) -> dict:
+    smtp = FakeSmtpServer()
+    await smtp.start()
+    workdir = tempfile.mkdtemp(prefix="xfit_bench_")
+    os.environ.update(
+        TG_BOT_TOKEN="1:bench",
+        BOT_MODE="polling",
+        DB_PATH=os.path.join(workdir, "bench.sqlite3"),
+        SMTP_HOST=smtp.host,
+        SMTP_PORT=str(smtp.port),
+        SMTP_USER="bench@example.com",
+        SMTP_PASS="bench",
+        SMTP_PASSWORD="bench",
+        SMTP_SECURITY="none",
+        # The harness measures handlers, not the anti-spam policy: every round's lead is new.
+        LEAD_THROTTLE_BURST="1000",
+        LEAD_DEDUPE_HOURS="0",
+    )
+    module = load_bot(bot_path)
+    stub = StubRequest(latency=latency)
+    app = build_bot_app(module)
+    # Swap the transport before initialize(): no sockets towards Telegram at all.
+    app.bot._request = (stub, stub)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+
+    per_text: Dict[str, List[float]] = {}
+    latencies: List[float] = []
+    errors = 0
+
+    async def user(uid: int):
+        nonlocal errors
+        for _ in range(rounds):
+            for step in GUEST_SCRIPT:
+                text = step.format(phone=f"+99290{uid:07d}")
+                update = Update.de_json(message_update(uid, text), app.bot)
+                start = time.perf_counter()
+                try:
+                    await app.process_update(update)
+                except Exception:
+                    errors += 1
+                elapsed = time.perf_counter() - start
+                latencies.append(elapsed)
+                per_text.setdefault(step, []).append(elapsed)
+
+    monitor = LoopStallMonitor()
+    monitor.start()
+    wall = time.perf_counter()
+    await asyncio.gather(*(user(200000 + i) for i in range(users)))
+    wall = time.perf_counter() - wall
+
+    # Let the outbox drain so the e-mail path is part of the run.
+    drain_start = time.perf_counter()
+    expected = users * rounds
+    while len(smtp.messages) < expected and time.perf_counter() - drain_start < 30:
+        await asyncio.sleep(0.01)
+    drain = time.perf_counter() - drain_start
+    await monitor.stop()
+
+    if app.running:
+        await app.stop()
+    await app.shutdown()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+    await smtp.stop()
+
+    return {
+        "bot": os.path.basename(bot_path),
+        "users": users,
+        "rounds": rounds,
+        "api_latency_ms": latency * 1000,
+        "updates": len(latencies),
+        "errors": errors,
+        "wall_s": wall,
+        "throughput_updates_per_s": len(latencies) / wall if wall else 0.0,
+        "handler_latency": latency_report(latencies),
+        "per_step": {step: latency_report(values) for step, values in per_text.items()},
+        "event_loop": monitor.report(),
+        "email": {
+            "delivered": len(smtp.messages),
+            "expected": expected,
+            "smtp_connections": smtp.connections,
+            "drain_after_load_s": drain,
+        },
+        "api_calls": len(stub.api.calls),
+        "python": platform.python_version(),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+    }
+
+
+def compare(current: dict, baseline: dict) -> List[str]:
+    lines = []
+    for section, key in [("handler_latency", "p50_ms"), ("handler_latency", "p95_ms"), ("handler_latency", "p99_ms"),
+                         ("event_loop", "stall_total_ms"), (None, "throughput_updates_per_s")]:
+        old = baseline[section][key] if section else baseline[key]
+        new = current[section][key] if section else current[key]
+        change = (new - old) / old * 100 if old else 0.0
+        lines.append(f"{(section + '.') if section else ''}{key}: {old:.2f} -> {new:.2f} ({change:+.1f}%)")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark a bot's handlers with N concurrent synthetic users.")
+    parser.add_argument("bot", help="path to bot.py or bot-2.py")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=1, help="times each user walks the script")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated Bot API round trip, seconds")
+    parser.add_argument("-o", "--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    opts = parser.parse_args(argv)
+
+    report = asyncio.run(run_bench(opts.bot, opts.users, opts.rounds, opts.latency))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if opts.output:
+        with open(opts.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    email = report["email"]
+    if email["delivered"] != email["expected"]:
+        # Missing leads mean the run measured something else (and waited out the drain timeout).
+        parser.exit(1, f"bench: {email['delivered']} of {email['expected']} lead e-mails delivered\n")
+    if opts.baseline:
+        with open(opts.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print("\n".join(compare(report, baseline)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,48 @@
 
 # requirements: python-telegram-bot==20.0
-from telegram import Update, ReplyKeyboardMarkup
+from telegram import (
+    Update,
+    ReplyKeyboardMarkup,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+)
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     ConversationHandler,
     ContextTypes,
+    InlineQueryHandler,
     filters,
 )
+import asyncio
+import logging
 import os
 import re
-import sqlite3
+import sys
 from datetime import datetime
-import smtplib
-from email.message import EmailMessage
+from zoneinfo import ZoneInfo
+
+import logpipe
+import shared
+from archive import Archiver
+from branches import DEFAULT_PATH as DEFAULT_BRANCHES_PATH, Branch, BranchRegistry, format_distance
+from broadcast import AlreadyRunning, Broadcaster
+from db import Database
+from digest import LeadDigest
+from leads import LeadGuard, TokenBucketThrottle, normalize_phone
+from media import Asset, MediaCache
+from menu import DEFAULT_PATH as DEFAULT_MENU_PATH, MenuRegistry
+from metrics import Metrics
+from outbox import Outbox
+from persistence import SQLitePersistence
+from schedule import ScheduleCache, ScheduleSource, format_day_header, format_lesson
+from scheduler import ScheduledApplication
+from snapshot import Snapshot
+from stats import LeadStats
+from webhook import InlineReplyRequest, run_webhook
 
 TOKEN = os.getenv("TG_BOT_TOKEN")
 CLUB_NAME = os.getenv("CLUB_NAME", "X-fit Premium Dushanbe")
@@ -25,10 +53,105 @@ SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD") or os.getenv("SMTP_PASS")
 EMAIL_FROM = os.getenv("EMAIL_FROM") or SMTP_USER
-EMAIL_TO = "sales@x-fit.tj"
+EMAIL_TO = os.getenv("EMAIL_TO", "sales@x-fit.tj")
+# "starttls", "ssl" or "none" (plain SMTP, e.g. a local test server)
+SMTP_SECURITY = os.getenv("SMTP_SECURITY", "starttls")
 
 # --- DB settings ---
 DB_PATH = os.getenv("DB_PATH", "guest_visits.db")
+ADMIN_TG_ID = int(os.getenv("ADMIN_TG_ID", "0") or 0)
+
+# --- Duplicate-lead window and per-user submission throttle
+LEAD_DEDUPE_HOURS = float(os.getenv("LEAD_DEDUPE_HOURS", "24"))
+LEAD_THROTTLE_BURST = int(os.getenv("LEAD_THROTTLE_BURST", "3"))
+LEAD_THROTTLE_PER_MIN = float(os.getenv("LEAD_THROTTLE_PER_MIN", "1"))
+
+# --- Schedule (published Google Sheets CSV or a local file) ---
+SCHEDULE_CSV_URL = os.getenv("SCHEDULE_CSV_URL", "")
+SCHEDULE_TTL = float(os.getenv("SCHEDULE_TTL", "300"))
+# Week schedule as an HTML document ("0" = a text message, as /today)
+SCHEDULE_DOCUMENT = os.getenv("SCHEDULE_DOCUMENT", "1") == "1"
+# Inline search ("@bot бокс завтра"): how long Telegram may cache an answer, in seconds
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+TIMEZONE = ZoneInfo(os.getenv("TIMEZONE", "Asia/Dushanbe"))
+
+# --- Serving mode: "polling" (default) or "webhook" ---
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # public https URL Telegram posts updates to
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+TG_API_BASE_URL = os.getenv("TG_API_BASE_URL", "")  # e.g. a local fake Bot API
+
+# --- Sales e-mail: one digest per DIGEST_INTERVAL_MIN (0 = a message per lead); leads
+# containing one of DIGEST_PRIORITY_WORDS are still e-mailed right away ---
+DIGEST_INTERVAL_MIN = float(os.getenv("DIGEST_INTERVAL_MIN", "0"))
+DIGEST_PRIORITY_WORDS = os.getenv("DIGEST_PRIORITY_WORDS", "срочно").split(",")
+
+# --- Exports read a copy of the DB, built and caught up on /export; SNAPSHOT_INTERVAL_MIN > 0
+# also refreshes it in the background every that many minutes ---
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH") or None
+SNAPSHOT_INTERVAL_MIN = float(os.getenv("SNAPSHOT_INTERVAL_MIN", "0"))
+
+# --- Retention: leads older than ARCHIVE_AFTER_DAYS (0 = keep forever) move to monthly
+# gzip CSV files in ARCHIVE_DIR once a day ---
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+# --- Nearest branch for a shared location: BRANCHES_CONFIG (see branches.example.json),
+# or just this club at CLUB_LAT/CLUB_LON when there is no such file ---
+BRANCHES_CONFIG = os.getenv("BRANCHES_CONFIG", DEFAULT_BRANCHES_PATH)
+BRANCHES_NEAREST = int(os.getenv("BRANCHES_NEAREST", "3"))
+CLUB_ADDRESS = os.getenv("CLUB_ADDRESS", "Душанбе, ул. Мухаммадиева, 24/2")
+CLUB_PHONE = os.getenv("CLUB_PHONE", "+992 48 8888 555")
+CLUB_LAT = os.getenv("CLUB_LAT", "")
+CLUB_LON = os.getenv("CLUB_LON", "")
+
+# --- Prometheus /metrics endpoint (0 = off; /stats works either way) ---
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+
+# --- Logging: JSON lines ("text" = classic lines) written by a background thread;
+# LOG_SAMPLE keeps a share of noisy INFO records, e.g. "httpx=0.01,updates=0.1" ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+
+# --- Update processing: chats in parallel (each one in order), bounded backlog ---
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+UPDATE_QUEUE_MAX = int(os.getenv("UPDATE_QUEUE_MAX", "1000"))
+
+logpipe.setup(LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE)
+logger = logging.getLogger(__name__)
+
+METRICS = Metrics()
+DB = Database(DB_PATH, writer=shared.db_writer())
+OUTBOX = Outbox(
+    DB,
+    shared.smtp_pool(SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_SECURITY),
+    sender=EMAIL_FROM or "",
+    metrics=METRICS,
+)
+# Conversation state and user_data survive restarts; written behind every PERSISTENCE_INTERVAL s
+PERSISTENCE = SQLitePersistence(DB, update_interval=float(os.getenv("PERSISTENCE_INTERVAL", "5")))
+LEADS = LeadGuard(DB, "guest_requests", window=LEAD_DEDUPE_HOURS * 3600)
+THROTTLE = TokenBucketThrottle(rate=LEAD_THROTTLE_PER_MIN / 60, burst=LEAD_THROTTLE_BURST)
+BROADCASTER = Broadcaster(DB, "guest_requests", rate=float(os.getenv("BROADCAST_RATE", "25")))
+DIGEST = LeadDigest(
+    DB, OUTBOX, "guest_requests", EMAIL_TO,
+    interval=DIGEST_INTERVAL_MIN * 60, priority_words=DIGEST_PRIORITY_WORDS, club_name=CLUB_NAME,
+)
+SNAPSHOT = Snapshot(DB_PATH, SNAPSHOT_PATH, ["guest_requests"], interval=SNAPSHOT_INTERVAL_MIN * 60)
+ARCHIVER = Archiver(DB_PATH, "guest_requests", ARCHIVE_DIR, keep_days=ARCHIVE_AFTER_DAYS)
+BRANCHES = BranchRegistry(
+    BRANCHES_CONFIG,
+    fallback=[Branch(CLUB_NAME, CLUB_ADDRESS, float(CLUB_LAT), float(CLUB_LON))] if CLUB_LAT and CLUB_LON else [],
+)
+# Lead counts per day/week, kept up to date by a trigger; read by /stats
+LEAD_STATS = LeadStats(DB, "guest_requests", TIMEZONE)
+SCHEDULE = ScheduleCache(ScheduleSource(SCHEDULE_CSV_URL) if SCHEDULE_CSV_URL else None, ttl=SCHEDULE_TTL)
+# Schedule document, price list and map: uploaded once, then re-sent by file_id
+MEDIA = MediaCache(DB)
 
 # --- States for conversation ---
 ASK_NAME, ASK_PHONE = range(2)
@@ -42,21 +165,20 @@ FEEDBACK_FORM_URL = os.getenv(
     "https://docs.google.com/forms/d/e/1FAIpQLSdg9cKHTec26MQhBa13T5nefHNKaUnaXxEOiCaAnzPoeZwO4g/viewform?usp=header/viewform",
 )
 
+CONTACTS_TEXT = f"📞 Контакты:\n📍 {CLUB_ADDRESS}\n📱 {CLUB_PHONE}"
+
+# Menu layout and section texts live in menu.json (shared with bot.py) and reload on change
+MENU = MenuRegistry(
+    os.getenv("MENU_CONFIG", DEFAULT_MENU_PATH),
+    variables={"club_name": CLUB_NAME, "feedback_url": FEEDBACK_FORM_URL, "contacts": CONTACTS_TEXT},
+)
+
 def main_menu() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        [
-            ["📆 Расписание", "🧑‍🏫 Тренеры"],
-            ["💳 Абонементы", "📞 Контакты"],
-            ["🎟️ Гостевой визит", "✍ Жалобы и предложения"],
-        ],
-        resize_keyboard=True,
-    )
+    return MENU.keyboard
 
 # --------------- DB ---------------
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
+    DB.executescript(
         '''
         CREATE TABLE IF NOT EXISTS guest_requests (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -64,42 +186,69 @@ def init_db():
             name TEXT NOT NULL,
             phone TEXT NOT NULL,
             created_at TEXT NOT NULL
-        )
+        );
+        CREATE INDEX IF NOT EXISTS idx_guest_requests_tg_user_id ON guest_requests (tg_user_id);
+        CREATE INDEX IF NOT EXISTS idx_guest_requests_phone ON guest_requests (phone);
+        CREATE INDEX IF NOT EXISTS idx_guest_requests_created_at ON guest_requests (created_at);
         '''
     )
-    conn.commit()
-    conn.close()
+    LEAD_STATS.init_db()
+    MEDIA.init_db()
 
-def insert_request(tg_user_id: int, name: str, phone: str) -> int:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
+@METRICS.timed("insert_request")
+async def insert_request(tg_user_id: int, name: str, phone: str) -> int:
+    req_id = await DB.execute(
         "INSERT INTO guest_requests (tg_user_id, name, phone, created_at) VALUES (?, ?, ?, ?)",
         (tg_user_id, name, phone, datetime.utcnow().isoformat() + "Z"),
     )
-    conn.commit()
-    req_id = cur.lastrowid  # sequential unique number
-    conn.close()
-    return req_id
+    return req_id  # sequential unique number
 
 # --------------- EMAIL ---------------
-def send_email(subject: str, body: str) -> None:
+@METRICS.timed("send_email")
+async def send_email(subject: str, body: str) -> None:
     if not (SMTP_HOST and SMTP_PORT and EMAIL_FROM and EMAIL_TO):
-        print("[EMAIL] SMTP env is not fully configured. Subject:", subject)
-        print("[EMAIL] Body:\n", body)
+        logger.warning("SMTP env is not fully configured; e-mail not sent. Subject: %s\n%s", subject, body)
         return
 
-    msg = EmailMessage()
-    msg["From"] = EMAIL_FROM
-    msg["To"] = EMAIL_TO
-    msg["Subject"] = subject
-    msg.set_content(body)
-
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-        server.starttls()
-        if SMTP_USER and SMTP_PASSWORD:
-            server.login(SMTP_USER, SMTP_PASSWORD)
-        server.send_message(msg)
+    # Persisted to email_outbox; the background worker delivers it over a pooled connection.
+    await OUTBOX.enqueue(EMAIL_TO, subject, body)
+
+async def _post_init(app: Application):
+    await OUTBOX.start()
+    await DIGEST.start()
+    await SNAPSHOT.start()
+    await ARCHIVER.start()
+    await LEADS.warm()
+    await MEDIA.warm()
+    await asyncio.to_thread(BROADCASTER.init_db)
+    # Broadcasts interrupted by a restart continue where they stopped.
+    for broadcast_id in await asyncio.to_thread(BROADCASTER.unfinished):
+        app.create_task(_run_broadcast(app.bot, ADMIN_TG_ID, broadcast_id))
+    await SCHEDULE.start()
+    await MENU.start()
+    await BRANCHES.start()
+    await METRICS.start(METRICS_LISTEN, METRICS_PORT)
+
+async def _post_shutdown(app: Application):
+    await METRICS.stop()
+    await BRANCHES.stop()
+    await MENU.stop()
+    await SCHEDULE.stop()
+    await ARCHIVER.stop()
+    await SNAPSHOT.stop()
+    await DIGEST.stop()
+    await OUTBOX.stop()
+    DB.close()
+
+# --------------- SCHEDULE ---------------
+def schedule_text(week: bool = True) -> str:
+    # Memory only: the snapshot is refreshed in the background by SCHEDULE.
+    if not SCHEDULE.snapshot:
+        return "📆 Расписание:\nПн–Пт: 6:00–23:00\nСб–Вс: 7:00–22:00"
+    today = datetime.now(TIMEZONE).date()
+    if week:
+        return "📆 Расписание на неделю:\n\n" + (SCHEDULE.week(today) or "Занятий нет")
+    return "📆 Расписание на сегодня:\n\n" + SCHEDULE.today(today)
 
 # --------------- HANDLERS ---------------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -110,15 +259,149 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Меню:", reply_markup=main_menu())
 
+async def schedule_today(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(schedule_text(week=False), reply_markup=main_menu())
+
+async def schedule_week(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if SCHEDULE_DOCUMENT and SCHEDULE.snapshot:
+        # Rendered once per schedule version and day, uploaded once per content.
+        today = datetime.now(TIMEZONE).date()
+        doc = SCHEDULE.snapshot.render_html(today, 7, f"{CLUB_NAME}: расписание")
+        await MEDIA.reply(
+            update.message,
+            Asset.make("document", f"raspisanie-{today:%Y-%m-%d}.html", doc),
+            f"📆 Расписание на неделю с {today:%d.%m}",
+            reply_markup=main_menu(),
+        )
+        return
+    await update.message.reply_text(schedule_text(), reply_markup=main_menu())
+
 async def feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         f"✍ Оставьте жалобу/предложение по ссылке:\n{FEEDBACK_FORM_URL}",
         reply_markup=main_menu(),
     )
 
+async def export_leads(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not ADMIN_TG_ID or not update.effective_user or update.effective_user.id != ADMIN_TG_ID:
+        await update.message.reply_text("Команда доступна только администратору.")
+        return
+    import export  # admin-only and rare: loaded on first use, not at startup
+
+    try:
+        since, compress = export.parse_args(context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(f"{e}\nФормат: /export [since=<№|дата>|all] [gz]")
+        return
+    # The CSV is streamed to a temp file off the event loop, then sent as a document.
+    # The export scans the snapshot, so new leads keep being written meanwhile.
+    await asyncio.to_thread(SNAPSHOT.refresh)
+    path, count, last_id = await asyncio.to_thread(
+        export.export_to_file, DB_PATH, "guest_requests", since, compress, SNAPSHOT.path
+    )
+    try:
+        if not count:
+            await update.message.reply_text("Новых заявок нет.")
+            return
+        with open(path, "rb") as f:
+            await update.message.reply_document(
+                f,
+                filename=os.path.basename(path),
+                caption=f"Заявок: {count}, последняя №{last_id}",
+            )
+        if since == "last":
+            await asyncio.to_thread(export.commit_cursor, DB_PATH, "guest_requests", last_id)
+    finally:
+        os.unlink(path)
+
+async def inline_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    snapshot = SCHEDULE.snapshot
+    lessons = snapshot.search(query.query, datetime.now(TIMEZONE).date())
+    offset = int(query.offset or 0)
+    page = lessons[offset:offset + 50]  # Telegram's limit per answer
+    results = [
+        InlineQueryResultArticle(
+            id=f"{snapshot.version}:{offset + i}",
+            title=f"{format_day_header(lesson.day)} {lesson.time} {lesson.title}",
+            description=" · ".join(v for v in (lesson.coach, lesson.hall, lesson.notes) if v),
+            input_message_content=InputTextMessageContent(f"{format_day_header(lesson.day)}\n{format_lesson(lesson)}"),
+        )
+        for i, lesson in enumerate(page)
+    ]
+    more = offset + len(page) < len(lessons)
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, next_offset=str(offset + len(page)) if more else "")
+
+async def nearest_branches(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    location = update.message.location
+    routes = BRANCHES.nearest(location.latitude, location.longitude, BRANCHES_NEAREST)
+    if not routes:
+        await update.message.reply_text("Адреса клубов пока не настроены.", reply_markup=MENU.keyboard)
+        return
+    lines, buttons = ["📍 Ближайшие клубы:" if len(routes) > 1 else "📍 Ближайший клуб:"], []
+    for i, route in enumerate(routes, 1):
+        branch = route.branch
+        lines.append(f"\n{i}. {branch.name} — {format_distance(route.km)}")
+        lines.extend(f"   {value}" for value in (branch.address, branch.phone, branch.hours) if value)
+        prefix = f"{i} · " if len(routes) > 1 else ""
+        buttons.append([InlineKeyboardButton(prefix + service, url=url) for service, url in route.links.items()])
+    await update.message.reply_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(buttons))
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not ADMIN_TG_ID or not update.effective_user or update.effective_user.id != ADMIN_TG_ID:
+        await update.message.reply_text("Команда доступна только администратору.")
+        return
+    # /stats — leads; /stats tech — handler and I/O metrics
+    if context.args and context.args[0] == "tech":
+        await update.message.reply_text(METRICS.summary())
+        return
+    await update.message.reply_text(await asyncio.to_thread(LEAD_STATS.summary))
+
+async def _run_broadcast(bot, admin_chat_id: int, broadcast_id: int):
+    try:
+        result = await BROADCASTER.run(bot, broadcast_id)
+    except AlreadyRunning:
+        if admin_chat_id:
+            await bot.send_message(admin_chat_id, f"Рассылка №{broadcast_id} уже идёт.")
+        return
+    except Exception:
+        logger.exception("Broadcast #%s failed", broadcast_id)
+        if admin_chat_id:
+            await bot.send_message(
+                admin_chat_id,
+                f"Рассылка №{broadcast_id} прервана с ошибкой, её можно продолжить: /broadcast resume {broadcast_id}",
+            )
+        return
+    summary = ", ".join(f"{status}: {count}" for status, count in sorted(result.items())) or "получателей нет"
+    if admin_chat_id:
+        await bot.send_message(admin_chat_id, f"Рассылка №{broadcast_id} завершена ({summary}).")
+
+async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not ADMIN_TG_ID or not update.effective_user or update.effective_user.id != ADMIN_TG_ID:
+        await update.message.reply_text("Команда доступна только администратору.")
+        return
+    if context.args and context.args[0] == "resume" and len(context.args) == 2 and context.args[1].isdigit():
+        broadcast_id = int(context.args[1])
+        if BROADCASTER.is_running(broadcast_id):
+            await update.message.reply_text(f"Рассылка №{broadcast_id} уже идёт.")
+            return
+    else:
+        # Keep the text as typed (line breaks included), minus the command itself, which
+        # may be followed by a newline or tab rather than a space.
+        parts = (update.message.text or "").split(maxsplit=1)
+        text = parts[1].strip() if len(parts) > 1 else ""
+        if not text:
+            await update.message.reply_text("Формат: /broadcast <текст> или /broadcast resume <№>")
+            return
+        broadcast_id = await BROADCASTER.create(text)
+    await update.message.reply_text(f"Рассылка №{broadcast_id} запущена.")
+    context.application.create_task(_run_broadcast(context.bot, update.effective_chat.id, broadcast_id))
+
 # ---- Guest visit flow ----
+CANCEL_KEYBOARD = ReplyKeyboardMarkup([["Отмена"]], resize_keyboard=True, one_time_keyboard=True)
+
 def cancel_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup([["Отмена"]], resize_keyboard=True, one_time_keyboard=True)
+    return CANCEL_KEYBOARD
 
 async def guest_visit_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -144,6 +427,14 @@ async def guest_visit_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ASK_PHONE
 
+async def _reply_existing(update: Update, context: ContextTypes.DEFAULT_TYPE, req_id: int):
+    context.user_data.pop("guest_name", None)
+    await update.message.reply_text(
+        f"Ваша заявка №{req_id} уже принята. С вами свяжутся в ближайшее время.",
+        reply_markup=main_menu(),
+    )
+    return ConversationHandler.END
+
 async def guest_visit_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (update.message.text or "").strip()
     if text.lower() == "отмена":
@@ -156,12 +447,25 @@ async def guest_visit_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ASK_PHONE
 
-    name = context.user_data.get("guest_name", "").strip()
-    phone = text
+    # Only well-formed numbers spend a token: typos don't lock the user out.
     tg_user_id = update.effective_user.id if update.effective_user else None
+    if tg_user_id is not None and not THROTTLE.allow(tg_user_id):
+        existing = await LEADS.find(tg_user_id)
+        if existing is not None:
+            return await _reply_existing(update, context, existing)
+        await update.message.reply_text("Слишком много попыток. Попробуйте через минуту.")
+        return ASK_PHONE
+
+    name = context.user_data.get("guest_name", "").strip()
+    phone = normalize_phone(text) or text
+
+    existing = await LEADS.find(tg_user_id, phone)
+    if existing is not None:
+        return await _reply_existing(update, context, existing)
 
     # Save to DB -> get sequential ID
-    req_id = insert_request(tg_user_id, name, phone)
+    req_id = await insert_request(tg_user_id, name, phone)
+    LEADS.remember(tg_user_id, phone, req_id)
 
     # Email
     subject = f"Заявка из бота №{req_id}"
@@ -175,8 +479,11 @@ async def guest_visit_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Время: {datetime.utcnow().isoformat()}Z"
     )
     try:
-        send_email(subject, body)
-        email_status = "Заявка отправлена на почту и сохранена."
+        if DIGEST.immediate(name):
+            await send_email(subject, body)
+            email_status = "Заявка отправлена на почту и сохранена."
+        else:
+            email_status = "Заявка сохранена и будет отправлена на почту в ближайшей сводке."
     except Exception as e:
         email_status = f"Заявка сохранена, но отправка на почту не удалась: {e}"
 
@@ -186,24 +493,22 @@ async def guest_visit_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ConversationHandler.END
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = (update.message.text or "").strip()
+# Dynamic menu sections (menu.json "action") -> handler
+# (guest_visit is the conversation's entry point: its state only holds when started there.)
+MENU_ACTIONS = {
+    "schedule": schedule_week,
+}
 
-    if text == "📆 Расписание":
-        msg = "📆 Расписание:\nПн–Пт: 6:00–23:00\nСб–Вс: 7:00–22:00"
-    elif text == "🧑‍🏫 Тренеры":
-        msg = "🧑‍🏫 Тренеры:\n- Али — силовые, функциональные\n- Дилшод — бокс, кроссфит\n- Сабина — стретчинг, пилатес"
-    elif text == "💳 Абонементы":
-        msg = "💳 Абонементы:\n1 мес — 400 сомони\n3 мес — 1050 сомони\n(пример — подставим ваши цены позже)"
-    elif text == "📞 Контакты":
-        msg = "📞 Контакты:\n📍 Душанбе, ул. Мухаммадиева, 24/2\n📱 +992 48 8888 555"
-    elif text == "✍ Жалобы и предложения":
-        msg = f"✍ Оставьте жалобу/предложение по ссылке:\n{FEEDBACK_FORM_URL}"
-    elif text == "🎟️ Гостевой визит":
-        return await guest_visit_entry(update, context)
-    else:
-        msg = "Выберите пункт меню ниже:"
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    item = MENU.lookup((update.message.text or "").strip())
+    action = MENU_ACTIONS.get(item.action) if item is not None and item.action else None
+    if action is not None:
+        return await action(update, context)
+    if item is not None and item.file is not None \
+            and await MEDIA.reply_file(update.message, item.file, item.text, reply_markup=main_menu()):
+        return
 
+    msg = item.text if item is not None and item.text is not None else "Выберите пункт меню ниже:"
     await update.message.reply_text(msg, reply_markup=main_menu())
 
 def build_app() -> Application:
@@ -212,34 +517,80 @@ def build_app() -> Application:
 
     init_db()
 
-    app = Application.builder().token(TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .application_class(
+            ScheduledApplication,
+            kwargs={"concurrency": UPDATE_CONCURRENCY, "max_pending": UPDATE_QUEUE_MAX, "metrics": METRICS},
+        )
+        # Bounded, so a full scheduler holds back getUpdates instead of buffering without limit.
+        .update_queue(asyncio.Queue(maxsize=UPDATE_CONCURRENCY))
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .persistence(PERSISTENCE)
+        .get_updates_request(shared.updates_request())
+    )
+    if TG_API_BASE_URL:
+        builder = builder.base_url(TG_API_BASE_URL)
+    if BOT_MODE == "webhook":
+        # Replies can ride back in the webhook response instead of a separate API call.
+        builder = builder.request(InlineReplyRequest(shared.bot_request())).updater(None)
+    else:
+        builder = builder.request(shared.bot_request())
+    app = builder.build()
 
     # Commands
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("menu", menu))
     app.add_handler(CommandHandler("feedback", feedback))
+    app.add_handler(CommandHandler("today", schedule_today))
+    app.add_handler(CommandHandler("week", schedule_week))
+    app.add_handler(CommandHandler("export", export_leads))
+    app.add_handler(CommandHandler("broadcast", broadcast_cmd))
+    app.add_handler(CommandHandler("stats", stats_cmd))
 
     # Guest visit conversation
     conv = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex("^🎟️ Гостевой визит$"), guest_visit_entry)],
+        # Every label and alias of the menu's guest_visit items, as currently loaded.
+        entry_points=[MessageHandler(MENU.action_filter("guest_visit"), guest_visit_entry)],
         states={
             ASK_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, guest_visit_name)],
             ASK_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, guest_visit_phone)],
         },
         fallbacks=[MessageHandler(filters.Regex("^Отмена$"), guest_visit_entry)],
         allow_reentry=True,
+        name="guest_visit",
+        persistent=True,
     )
     app.add_handler(conv)
 
+    app.add_handler(MessageHandler(filters.LOCATION, nearest_branches))
+    app.add_handler(InlineQueryHandler(inline_schedule))
+
     # Fallback text handler
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
+    # Wraps every callback above, conversation states included.
+    METRICS.instrument(app)
     return app
 
 def main():
+    if "--profile-startup" in sys.argv[1:]:
+        # Measured in a fresh interpreter; this one has already imported everything.
+        import startup
+        sys.exit(startup.main([__file__, "--db", DB_PATH]))
     app = build_app()
-    print(f"Бот {CLUB_NAME} запущен...")
-    app.run_polling()
+    logger.info("Бот %s запущен (%s)...", CLUB_NAME, BOT_MODE)
+    try:
+        if BOT_MODE == "webhook":
+            if not WEBHOOK_URL:
+                raise RuntimeError("Переменная WEBHOOK_URL не задана")
+            run_webhook(app, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_LISTEN, WEBHOOK_PORT)
+        else:
+            app.run_polling()
+    finally:
+        logpipe.shutdown()
 
 if __name__ == "__main__":
     main()
@@ -1,19 +1,21 @@
 
 # requirements: python-telegram-bot==20.0
+import asyncio
 import logging
 import os
-import re
-import smtplib
-import sqlite3
+import sys
 from datetime import datetime
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 from typing import Optional
+from zoneinfo import ZoneInfo
 
 from telegram import (
     Update,
     ReplyKeyboardMarkup,
     KeyboardButton,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
     ReplyKeyboardRemove,
     Contact,
 )
@@ -23,9 +25,29 @@ from telegram.ext import (
     MessageHandler,
     ConversationHandler,
     ContextTypes,
+    InlineQueryHandler,
     filters,
 )
 
+import logpipe
+import shared
+from archive import Archiver
+from branches import DEFAULT_PATH as DEFAULT_BRANCHES_PATH, Branch, BranchRegistry, format_distance
+from broadcast import AlreadyRunning, Broadcaster
+from db import Database
+from digest import LeadDigest
+from leads import LeadGuard, TokenBucketThrottle, normalize_phone
+from media import Asset, MediaCache
+from menu import DEFAULT_PATH as DEFAULT_MENU_PATH, MenuRegistry
+from metrics import Metrics
+from outbox import Outbox
+from persistence import SQLitePersistence
+from schedule import ScheduleCache, ScheduleSource, format_day_header, format_lesson
+from scheduler import ScheduledApplication
+from snapshot import Snapshot
+from stats import LeadStats
+from webhook import InlineReplyRequest, run_webhook
+
 # === Config via ENV ===
 TOKEN = os.getenv("TG_BOT_TOKEN")
 CLUB_NAME = os.getenv("CLUB_NAME", "X-fit Premium Dushanbe")
@@ -35,8 +57,63 @@ SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASS = os.getenv("SMTP_PASS")
 SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "1") == "1"
+# "starttls", "ssl" or "none" (plain SMTP, e.g. a local test server)
+SMTP_SECURITY = os.getenv("SMTP_SECURITY", "starttls" if SMTP_USE_TLS else "ssl")
 
 DB_PATH = os.getenv("DB_PATH", "guest_visits.sqlite3")
+ADMIN_TG_ID = int(os.getenv("ADMIN_TG_ID", "0") or 0)
+# Published Google Sheets CSV (or a local file path) with the class schedule
+SCHEDULE_CSV_URL = os.getenv("SCHEDULE_CSV_URL", "")
+SCHEDULE_TTL = float(os.getenv("SCHEDULE_TTL", "300"))
+# Week schedule as an HTML document ("0" = a text message, as /today)
+SCHEDULE_DOCUMENT = os.getenv("SCHEDULE_DOCUMENT", "1") == "1"
+# Inline search ("@bot бокс завтра"): how long Telegram may cache an answer, in seconds
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+TIMEZONE = ZoneInfo(os.getenv("TIMEZONE", "Asia/Dushanbe"))
+
+# Serving mode: "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # public https URL Telegram posts updates to
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+TG_API_BASE_URL = os.getenv("TG_API_BASE_URL", "")  # e.g. a local fake Bot API
+
+# --- Sales e-mail: one digest per DIGEST_INTERVAL_MIN (0 = a message per lead); leads
+# containing one of DIGEST_PRIORITY_WORDS are still e-mailed right away ---
+DIGEST_INTERVAL_MIN = float(os.getenv("DIGEST_INTERVAL_MIN", "0"))
+DIGEST_PRIORITY_WORDS = os.getenv("DIGEST_PRIORITY_WORDS", "срочно").split(",")
+
+# --- Exports read a copy of the DB, built and caught up on /export; SNAPSHOT_INTERVAL_MIN > 0
+# also refreshes it in the background every that many minutes ---
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH") or None
+SNAPSHOT_INTERVAL_MIN = float(os.getenv("SNAPSHOT_INTERVAL_MIN", "0"))
+
+# --- Retention: leads older than ARCHIVE_AFTER_DAYS (0 = keep forever) move to monthly
+# gzip CSV files in ARCHIVE_DIR once a day ---
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+# --- Nearest branch for a shared location: BRANCHES_CONFIG (see branches.example.json),
+# or just this club at CLUB_LAT/CLUB_LON when there is no such file ---
+BRANCHES_CONFIG = os.getenv("BRANCHES_CONFIG", DEFAULT_BRANCHES_PATH)
+BRANCHES_NEAREST = int(os.getenv("BRANCHES_NEAREST", "3"))
+CLUB_LAT = os.getenv("CLUB_LAT", "")
+CLUB_LON = os.getenv("CLUB_LON", "")
+
+# --- Prometheus /metrics endpoint (0 = off; /stats works either way) ---
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+
+# --- Logging: JSON lines ("text" = classic lines) written by a background thread;
+# LOG_SAMPLE keeps a share of noisy INFO records, e.g. "httpx=0.01,updates=0.1" ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+
+# --- Update processing: chats in parallel (each one in order), bounded backlog ---
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+UPDATE_QUEUE_MAX = int(os.getenv("UPDATE_QUEUE_MAX", "1000"))
 # Public info (for "Режим работы и контакты")
 WORKING_HOURS = os.getenv("WORKING_HOURS", "Mon–Sun: 06:00–23:00")
 CLUB_MAP_URL = os.getenv("CLUB_MAP_URL", "")
@@ -49,17 +126,49 @@ CLUB_EMAIL = os.getenv("CLUB_EMAIL", "info@x-fit.tj")
 CLUB_ADDRESS = os.getenv("CLUB_ADDRESS", "Dushanbe, Muhammadieva St. 24/2")
 CLUB_WEBSITE = os.getenv("CLUB_WEBSITE", "https://x-fit.tj")
 CLUB_MAP_URL = os.getenv("CLUB_MAP_URL", "")
+FEEDBACK_FORM_URL = os.getenv("FEEDBACK_FORM_URL", "https://forms.gle/example")
+MENU_CONFIG = os.getenv("MENU_CONFIG", DEFAULT_MENU_PATH)
+# Duplicate-lead window and per-user submission throttle
+LEAD_DEDUPE_HOURS = float(os.getenv("LEAD_DEDUPE_HOURS", "24"))
+LEAD_THROTTLE_BURST = int(os.getenv("LEAD_THROTTLE_BURST", "3"))
+LEAD_THROTTLE_PER_MIN = float(os.getenv("LEAD_THROTTLE_PER_MIN", "1"))
 
 # === Logging ===
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+logpipe.setup(LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE)
 logger = logging.getLogger(__name__)
 
+METRICS = Metrics()
+DB = Database(DB_PATH, writer=shared.db_writer())
+OUTBOX = Outbox(
+    DB,
+    shared.smtp_pool(SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, SMTP_SECURITY),
+    sender=SMTP_USER or "",
+    metrics=METRICS,
+)
+# Conversation state and user_data survive restarts; written behind every PERSISTENCE_INTERVAL s
+PERSISTENCE = SQLitePersistence(DB, update_interval=float(os.getenv("PERSISTENCE_INTERVAL", "5")))
+LEADS = LeadGuard(DB, "guest_visits", window=LEAD_DEDUPE_HOURS * 3600)
+THROTTLE = TokenBucketThrottle(rate=LEAD_THROTTLE_PER_MIN / 60, burst=LEAD_THROTTLE_BURST)
+BROADCASTER = Broadcaster(DB, "guest_visits", rate=float(os.getenv("BROADCAST_RATE", "25")))
+DIGEST = LeadDigest(
+    DB, OUTBOX, "guest_visits", EMAIL_TO,
+    interval=DIGEST_INTERVAL_MIN * 60, priority_words=DIGEST_PRIORITY_WORDS, club_name=CLUB_NAME,
+)
+SNAPSHOT = Snapshot(DB_PATH, SNAPSHOT_PATH, ["guest_visits"], interval=SNAPSHOT_INTERVAL_MIN * 60)
+ARCHIVER = Archiver(DB_PATH, "guest_visits", ARCHIVE_DIR, keep_days=ARCHIVE_AFTER_DAYS)
+BRANCHES = BranchRegistry(
+    BRANCHES_CONFIG,
+    fallback=[Branch(CLUB_NAME, CLUB_ADDRESS, float(CLUB_LAT), float(CLUB_LON), CLUB_PHONE, WORKING_HOURS)] if CLUB_LAT and CLUB_LON else [],
+)
+# Lead counts per day/week, kept up to date by a trigger; read by /stats
+LEAD_STATS = LeadStats(DB, "guest_visits", TIMEZONE)
+SCHEDULE = ScheduleCache(ScheduleSource(SCHEDULE_CSV_URL) if SCHEDULE_CSV_URL else None, ttl=SCHEDULE_TTL)
+# Schedule document, price list and map: uploaded once, then re-sent by file_id
+MEDIA = MediaCache(DB)
+
 # === DB init ===
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute(
+    DB.executescript(
         '''
         CREATE TABLE IF NOT EXISTS guest_visits (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -68,43 +177,32 @@ def init_db():
             tg_user_id INTEGER,
             tg_username TEXT,
             created_at TEXT
-        )
+        );
+        CREATE INDEX IF NOT EXISTS idx_guest_visits_tg_user_id ON guest_visits (tg_user_id);
+        CREATE INDEX IF NOT EXISTS idx_guest_visits_phone ON guest_visits (phone);
+        CREATE INDEX IF NOT EXISTS idx_guest_visits_created_at ON guest_visits (created_at);
         '''
     )
-    conn.commit()
-    conn.close()
-
-def _db_connect():
-    return sqlite3.connect(DB_PATH)
+    LEAD_STATS.init_db()
+    MEDIA.init_db()
 
-def _db_execute(query: str, params: tuple = ()):
-    with _db_connect() as conn:
-        cur = conn.execute(query, params)
-        conn.commit()
-        return cur
-
-def insert_guest(name: str, phone: str, tg_user_id: int, tg_username: Optional[str]) -> int:
-    cur = _db_execute(
+@METRICS.timed("insert_guest")
+async def insert_guest(name: str, phone: str, tg_user_id: int, tg_username: Optional[str]) -> int:
+    # Group-committed by the writer thread; resolves to the row id shown to the user.
+    row_id = await DB.execute(
         "INSERT INTO guest_visits (name, phone, tg_user_id, tg_username, created_at) VALUES (?,?,?,?,?)",
         (name, phone, tg_user_id, tg_username, datetime.utcnow().isoformat() + "Z"),
     )
-    return int(cur.lastrowid)
-
-def normalize_phone(text: str) -> Optional[str]:
-    if not text:
-        return None
-    digits = re.sub(r"[^\d+]", "", text)
-    only_digits = re.sub(r"\D", "", digits)
-    if len(only_digits) < 7:
-        return None
-    if digits and not digits.startswith("+") and len(only_digits) >= 10:
-        digits = "+" + only_digits
-    return digits
-
-def send_email(application_id: int, name: str, phone: str, update: Update):
+    return int(row_id)
+
+@METRICS.timed("send_email")
+async def send_email(application_id: int, name: str, phone: str, update: Update):
     if not SMTP_HOST or not SMTP_USER or not SMTP_PASS:
         logger.warning("SMTP not configured; skipping email send.")
         return False
+    if not DIGEST.immediate(name):
+        # Goes out with the next digest.
+        return True
 
     subject = f"Заявка с ТГ бота №{application_id}"
     body = (
@@ -117,57 +215,40 @@ def send_email(application_id: int, name: str, phone: str, update: Update):
         f"Дата (UTC): {datetime.utcnow().isoformat()}Z\n"
     )
 
-    msg = MIMEMultipart()
-    msg["From"] = SMTP_USER
-    msg["To"] = EMAIL_TO
-    msg["Subject"] = subject
-    msg.attach(MIMEText(body, "plain", "utf-8"))
-
+    # Queued in the DB; the outbox worker does the SMTP round-trip off the handler path.
     try:
-        if SMTP_USE_TLS:
-            with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-                server.starttls()
-                server.login(SMTP_USER, SMTP_PASS)
-                server.sendmail(SMTP_USER, [EMAIL_TO], msg.as_string())
-        else:
-            with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT) as server:
-                server.login(SMTP_USER, SMTP_PASS)
-                server.sendmail(SMTP_USER, [EMAIL_TO], msg.as_string())
+        await OUTBOX.enqueue(EMAIL_TO, subject, body)
         return True
     except Exception:
-        logger.exception("Email send failed")
+        logger.exception("Email enqueue failed")
         return False
 
-    subject = f"Заявка с ТГ бота №{application_id}"
-    body = (
-        f"Новая заявка на гостевой визит в {CLUB_NAME}\n\n"
-        f"ID заявки: {application_id}\n"
-        f"Имя: {name}\n"
-        f"Телефон: {phone}\n"
-        f"TG user: @{(update.effective_user.username or '')}\n"
-        f"TG user id: {update.effective_user.id}\n"
-        f"Дата (UTC): {datetime.utcnow().isoformat()}Z\n"
-    )
-
-    msg = MIMEMultipart()
-    msg["From"] = SMTP_USER
-    msg["To"] = EMAIL_TO
-    msg["Subject"] = subject
-    msg.attach(MIMEText(body, "plain", "utf-8"))
-
-    try:
-        if SMTP_USE_TLS:
-            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
-            server.starttls()
-        else:
-            server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT)
-        server.login(SMTP_USER, SMTP_PASS)
-        server.sendmail(SMTP_USER, [EMAIL_TO], msg.as_string())
-        server.quit()
-        return True
-    except Exception as e:
-        logger.error(f"Email send failed: {e}")
-        return False
+async def _post_init(app: Application):
+    await OUTBOX.start()
+    await DIGEST.start()
+    await SNAPSHOT.start()
+    await ARCHIVER.start()
+    await LEADS.warm()
+    await MEDIA.warm()
+    await asyncio.to_thread(BROADCASTER.init_db)
+    # Broadcasts interrupted by a restart continue where they stopped.
+    for broadcast_id in await asyncio.to_thread(BROADCASTER.unfinished):
+        app.create_task(_run_broadcast(app.bot, ADMIN_TG_ID, broadcast_id))
+    await SCHEDULE.start()
+    await MENU.start()
+    await BRANCHES.start()
+    await METRICS.start(METRICS_LISTEN, METRICS_PORT)
+
+async def _post_shutdown(app: Application):
+    await METRICS.stop()
+    await BRANCHES.stop()
+    await MENU.stop()
+    await SCHEDULE.stop()
+    await ARCHIVER.stop()
+    await SNAPSHOT.stop()
+    await DIGEST.stop()
+    await OUTBOX.stop()
+    DB.close()
 
 
 # === Public info text ===
@@ -189,6 +270,15 @@ def contacts_text():
         lines.extend(["", "🗺️ Карта:", CLUB_MAP_URL])
     return "\n".join(lines)
 
+def schedule_text(week: bool = True) -> str:
+    # Served from the in-memory snapshot only; refreshes happen in the background.
+    today = datetime.now(TIMEZONE).date()
+    if not SCHEDULE.snapshot:
+        return "📆 Расписание пока недоступно. Попробуйте позже."
+    if week:
+        return "📆 Расписание на неделю:\n\n" + (SCHEDULE.week(today) or "Занятий нет")
+    return "📆 Расписание на сегодня:\n\n" + SCHEDULE.today(today)
+
 # === States ===
 (
     MAIN_MENU,
@@ -196,27 +286,29 @@ def contacts_text():
     GUEST_PHONE_WAIT,
 ) = range(3)
 
+# === Menu (menu.json, shared with bot-2.py; hot-reloaded) ===
+MENU = MenuRegistry(
+    MENU_CONFIG,
+    variables={"club_name": CLUB_NAME, "feedback_url": FEEDBACK_FORM_URL, "contacts": contacts_text()},
+)
+
 def main_menu_keyboard():
-    return ReplyKeyboardMarkup(
-        [
-            ["📆 Расписание", "🧑‍🏫 Тренеры"],
-            ["💬 Жалобы и предложения", "🎟️ Гостевой визит"],
-        ],
-        resize_keyboard=True,
-    )
+    return MENU.keyboard
 
 async def _reply_menu(update: Update, text: str):
     await update.message.reply_text(text, reply_markup=main_menu_keyboard())
 
+GUEST_PHONE_KEYBOARD = ReplyKeyboardMarkup(
+    [
+        [KeyboardButton("📲 Отправить мой номер из Telegram", request_contact=True)],
+        ["↩️ Назад в меню"],
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=True,
+)
+
 def guest_phone_keyboard():
-    return ReplyKeyboardMarkup(
-        [
-            [KeyboardButton("📲 Отправить мой номер из Telegram", request_contact=True)],
-            ["↩️ Назад в меню"],
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=True,
-    )
+    return GUEST_PHONE_KEYBOARD
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _reply_menu(update, f"Добро пожаловать в {CLUB_NAME}! Выберите раздел:")
@@ -226,25 +318,28 @@ async def to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _reply_menu(update, "Главное меню:")
     return MAIN_MENU
 
+async def guest_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Start guest visit flow: first ask name
+    await update.message.reply_text(
+        "🎟️ Гостевой визит.\n\nВведите, пожалуйста, ваше имя (как к вам обращаться)?",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    return GUEST_NAME
+
 async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = (update.message.text or "").strip().lower()
-    if "гостевой" in text:
-        # Start guest visit flow: first ask name
-        await update.message.reply_text(
-            "🎟️ Гостевой визит.\n\nВведите, пожалуйста, ваше имя (как к вам обращаться)?",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-        return GUEST_NAME
-    elif "жалобы" in text:
-        await _reply_menu(update, "Оставить жалобу/предложение: заполните форму 👉 https://forms.gle/example")
-        return MAIN_MENU
-    elif "режим работы" in text or "контакты" in text:
-        await _reply_menu(update, contacts_text())
+    item = MENU.lookup((update.message.text or "").strip())
+    action = MENU_ACTIONS.get(item.action) if item is not None and item.action else None
+    if action is not None:
+        state = await action(update, context)
+        return MAIN_MENU if state is None else state
+    if item is not None and item.file is not None \
+            and await MEDIA.reply_file(update.message, item.file, item.text, reply_markup=main_menu_keyboard()):
         return MAIN_MENU
-
+    if item is not None and item.text is not None:
+        await _reply_menu(update, item.text)
     else:
         await _reply_menu(update, "Раздел в разработке. Выберите другой пункт.")
-        return MAIN_MENU
+    return MAIN_MENU
 
 async def guest_get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     name = (update.message.text or "").strip()
@@ -261,7 +356,16 @@ async def guest_get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return GUEST_PHONE_WAIT
 
+async def _reply_existing(update: Update, context: ContextTypes.DEFAULT_TYPE, application_id: int):
+    context.user_data.pop("guest_name", None)
+    await _reply_menu(
+        update,
+        f"Ваша заявка №{application_id} уже принята. Мы свяжемся с вами для подтверждения гостевого визита.",
+    )
+    return MAIN_MENU
+
 async def guest_get_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
     phone = None
     if update.message.contact and isinstance(update.message.contact, Contact):
         phone = normalize_phone(update.message.contact.phone_number)
@@ -275,19 +379,31 @@ async def guest_get_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return GUEST_PHONE_WAIT
 
+    # Only well-formed numbers spend a token: typos don't lock the user out.
+    if not THROTTLE.allow(user.id):
+        existing = await LEADS.find(user.id)
+        if existing is not None:
+            return await _reply_existing(update, context, existing)
+        await update.message.reply_text("Слишком много попыток. Попробуйте через минуту.")
+        return GUEST_PHONE_WAIT
+
+    existing = await LEADS.find(user.id, phone)
+    if existing is not None:
+        return await _reply_existing(update, context, existing)
+
     name = context.user_data.get("guest_name", "").strip() or "—"
-    user = update.effective_user
 
     # Save to DB
     try:
-        application_id = insert_guest(name, phone, user.id, user.username)
+        application_id = await insert_guest(name, phone, user.id, user.username)
     except Exception as e:
         logger.exception("DB insert failed")
         await _reply_menu(update, "Произошла ошибка при сохранении заявки. Попробуйте позже.")
         return MAIN_MENU
+    LEADS.remember(user.id, phone, application_id)
 
     # Send email
-    email_ok = send_email(application_id, name, phone, update)
+    email_ok = await send_email(application_id, name, phone, update)
 
     confirm = (
         f"Спасибо! Заявка №{application_id} принята.\n"
@@ -301,6 +417,144 @@ async def guest_get_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.pop("guest_name", None)
     return MAIN_MENU
 
+async def schedule_today(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _reply_menu(update, schedule_text(week=False))
+
+async def schedule_week(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if SCHEDULE_DOCUMENT and SCHEDULE.snapshot:
+        # Rendered once per schedule version and day, uploaded once per content.
+        today = datetime.now(TIMEZONE).date()
+        doc = SCHEDULE.snapshot.render_html(today, 7, f"{CLUB_NAME}: расписание")
+        await MEDIA.reply(
+            update.message,
+            Asset.make("document", f"raspisanie-{today:%Y-%m-%d}.html", doc),
+            f"📆 Расписание на неделю с {today:%d.%m}",
+            reply_markup=main_menu_keyboard(),
+        )
+        return
+    await _reply_menu(update, schedule_text())
+
+async def export_leads(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not ADMIN_TG_ID or not update.effective_user or update.effective_user.id != ADMIN_TG_ID:
+        await update.message.reply_text("Команда доступна только администратору.")
+        return
+    import export  # admin-only and rare: loaded on first use, not at startup
+
+    try:
+        since, compress = export.parse_args(context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(f"{e}\nФормат: /export [since=<№|дата>|all] [gz]")
+        return
+    # The CSV is streamed to a temp file off the event loop, then sent as a document.
+    # The export scans the snapshot, so new leads keep being written meanwhile.
+    await asyncio.to_thread(SNAPSHOT.refresh)
+    path, count, last_id = await asyncio.to_thread(
+        export.export_to_file, DB_PATH, "guest_visits", since, compress, SNAPSHOT.path
+    )
+    try:
+        if not count:
+            await update.message.reply_text("Новых заявок нет.")
+            return
+        with open(path, "rb") as f:
+            await update.message.reply_document(
+                f,
+                filename=os.path.basename(path),
+                caption=f"Заявок: {count}, последняя №{last_id}",
+            )
+        if since == "last":
+            await asyncio.to_thread(export.commit_cursor, DB_PATH, "guest_visits", last_id)
+    finally:
+        os.unlink(path)
+
+# Dynamic menu sections (menu.json "action") -> handler
+MENU_ACTIONS = {
+    "schedule": schedule_week,
+    "guest_visit": guest_start,
+}
+
+async def inline_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    snapshot = SCHEDULE.snapshot
+    lessons = snapshot.search(query.query, datetime.now(TIMEZONE).date())
+    offset = int(query.offset or 0)
+    page = lessons[offset:offset + 50]  # Telegram's limit per answer
+    results = [
+        InlineQueryResultArticle(
+            id=f"{snapshot.version}:{offset + i}",
+            title=f"{format_day_header(lesson.day)} {lesson.time} {lesson.title}",
+            description=" · ".join(v for v in (lesson.coach, lesson.hall, lesson.notes) if v),
+            input_message_content=InputTextMessageContent(f"{format_day_header(lesson.day)}\n{format_lesson(lesson)}"),
+        )
+        for i, lesson in enumerate(page)
+    ]
+    more = offset + len(page) < len(lessons)
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, next_offset=str(offset + len(page)) if more else "")
+
+async def nearest_branches(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    location = update.message.location
+    routes = BRANCHES.nearest(location.latitude, location.longitude, BRANCHES_NEAREST)
+    if not routes:
+        await update.message.reply_text("Адреса клубов пока не настроены.", reply_markup=MENU.keyboard)
+        return
+    lines, buttons = ["📍 Ближайшие клубы:" if len(routes) > 1 else "📍 Ближайший клуб:"], []
+    for i, route in enumerate(routes, 1):
+        branch = route.branch
+        lines.append(f"\n{i}. {branch.name} — {format_distance(route.km)}")
+        lines.extend(f"   {value}" for value in (branch.address, branch.phone, branch.hours) if value)
+        prefix = f"{i} · " if len(routes) > 1 else ""
+        buttons.append([InlineKeyboardButton(prefix + service, url=url) for service, url in route.links.items()])
+    await update.message.reply_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(buttons))
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not ADMIN_TG_ID or not update.effective_user or update.effective_user.id != ADMIN_TG_ID:
+        await update.message.reply_text("Команда доступна только администратору.")
+        return
+    # /stats — leads; /stats tech — handler and I/O metrics
+    if context.args and context.args[0] == "tech":
+        await update.message.reply_text(METRICS.summary())
+        return
+    await update.message.reply_text(await asyncio.to_thread(LEAD_STATS.summary))
+
+async def _run_broadcast(bot, admin_chat_id: int, broadcast_id: int):
+    try:
+        result = await BROADCASTER.run(bot, broadcast_id)
+    except AlreadyRunning:
+        if admin_chat_id:
+            await bot.send_message(admin_chat_id, f"Рассылка №{broadcast_id} уже идёт.")
+        return
+    except Exception:
+        logger.exception("Broadcast #%s failed", broadcast_id)
+        if admin_chat_id:
+            await bot.send_message(
+                admin_chat_id,
+                f"Рассылка №{broadcast_id} прервана с ошибкой, её можно продолжить: /broadcast resume {broadcast_id}",
+            )
+        return
+    summary = ", ".join(f"{status}: {count}" for status, count in sorted(result.items())) or "получателей нет"
+    if admin_chat_id:
+        await bot.send_message(admin_chat_id, f"Рассылка №{broadcast_id} завершена ({summary}).")
+
+async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not ADMIN_TG_ID or not update.effective_user or update.effective_user.id != ADMIN_TG_ID:
+        await update.message.reply_text("Команда доступна только администратору.")
+        return
+    if context.args and context.args[0] == "resume" and len(context.args) == 2 and context.args[1].isdigit():
+        broadcast_id = int(context.args[1])
+        if BROADCASTER.is_running(broadcast_id):
+            await update.message.reply_text(f"Рассылка №{broadcast_id} уже идёт.")
+            return
+    else:
+        # Keep the text as typed (line breaks included), minus the command itself, which
+        # may be followed by a newline or tab rather than a space.
+        parts = (update.message.text or "").split(maxsplit=1)
+        text = parts[1].strip() if len(parts) > 1 else ""
+        if not text:
+            await update.message.reply_text("Формат: /broadcast <текст> или /broadcast resume <№>")
+            return
+        broadcast_id = await BROADCASTER.create(text)
+    await update.message.reply_text(f"Рассылка №{broadcast_id} запущена.")
+    context.application.create_task(_run_broadcast(context.bot, update.effective_chat.id, broadcast_id))
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
     await _reply_menu(update, "Отменено.")
@@ -309,11 +563,32 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 def build_application() -> Application:
     if not TOKEN:
         raise RuntimeError("TG_BOT_TOKEN is not set")
-    app = Application.builder().token(TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .application_class(
+            ScheduledApplication,
+            kwargs={"concurrency": UPDATE_CONCURRENCY, "max_pending": UPDATE_QUEUE_MAX, "metrics": METRICS},
+        )
+        # Bounded, so a full scheduler holds back getUpdates instead of buffering without limit.
+        .update_queue(asyncio.Queue(maxsize=UPDATE_CONCURRENCY))
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .persistence(PERSISTENCE)
+        .get_updates_request(shared.updates_request())
+    )
+    if TG_API_BASE_URL:
+        builder = builder.base_url(TG_API_BASE_URL)
+    if BOT_MODE == "webhook":
+        # Replies can ride back in the webhook response instead of a separate API call.
+        builder = builder.request(InlineReplyRequest(shared.bot_request())).updater(None)
+    else:
+        builder = builder.request(shared.bot_request())
+    app = builder.build()
 
     # Conversation for guest visit
     conv = ConversationHandler(
-        entry_points=[CommandHandler("start", start), MessageHandler(filters.Regex("(?i)гостевой"), handle_main_menu)],
+        entry_points=[CommandHandler("start", start), MessageHandler(filters.Regex("(?i)гостевой") | MENU.action_filter("guest_visit"), guest_start)],
         states={
             MAIN_MENU: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_main_menu),
@@ -330,18 +605,41 @@ def build_application() -> Application:
         },
         fallbacks=[CommandHandler("cancel", cancel), CommandHandler("menu", to_menu)],
         allow_reentry=True,
+        name="guest_visit",
+        persistent=True,
     )
 
     app.add_handler(conv)
     # Quick /menu command
     app.add_handler(CommandHandler("menu", to_menu))
+    app.add_handler(CommandHandler("today", schedule_today))
+    app.add_handler(CommandHandler("week", schedule_week))
+    app.add_handler(CommandHandler("export", export_leads))
+    app.add_handler(CommandHandler("broadcast", broadcast_cmd))
+    app.add_handler(CommandHandler("stats", stats_cmd))
+    app.add_handler(MessageHandler(filters.LOCATION, nearest_branches))
+    app.add_handler(InlineQueryHandler(inline_schedule))
+    # Wraps every callback above, conversation states included.
+    METRICS.instrument(app)
     return app
 
 def main():
+    if "--profile-startup" in sys.argv[1:]:
+        # Measured in a fresh interpreter; this one has already imported everything.
+        import startup
+        sys.exit(startup.main([__file__, "--db", DB_PATH]))
     init_db()
     app = build_application()
-    logger.info("Bot is starting...")
-    app.run_polling()
+    logger.info("Bot is starting (%s)...", BOT_MODE)
+    try:
+        if BOT_MODE == "webhook":
+            if not WEBHOOK_URL:
+                raise RuntimeError("WEBHOOK_URL is not set")
+            run_webhook(app, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_LISTEN, WEBHOOK_PORT)
+        else:
+            app.run_polling()
+    finally:
+        logpipe.shutdown()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,210 @@
+# Club branches: nearest-branch lookup over a grid index, route links, hot-reloaded config.
+import asyncio
+import json
+import logging
+import math
+import os
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "branches.json")
+
+EARTH_KM = 6371.0088
+KM_PER_DEG = math.pi * EARTH_KM / 180
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle (haversine) distance."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def format_distance(km: float) -> str:
+    if km < 1:
+        return f"{round(km * 1000 / 10) * 10:.0f} м"
+    if km < 10:
+        return f"{km:.1f} км".replace(".", ",")
+    return f"{km:.0f} км"
+
+
+class Branch(NamedTuple):
+    name: str
+    address: str
+    lat: float
+    lon: float
+    phone: str = ""
+    hours: str = ""
+
+
+class Route(NamedTuple):
+    branch: Branch
+    km: float
+    links: Dict[str, str]  # service -> URL with the user's location as origin
+
+
+class _Links(NamedTuple):
+    # Destination parts are built once per branch; only the origin is filled in per request.
+    google: str
+    yandex: str
+    apple: str
+
+    @classmethod
+    def build(cls, b: Branch) -> "_Links":
+        dest = f"{b.lat:.6f},{b.lon:.6f}"
+        return cls(
+            google=f"https://www.google.com/maps/dir/?api=1&destination={dest}&origin=",
+            yandex=f"~{dest}&rtt=auto",
+            apple=f"https://maps.apple.com/?daddr={dest}&saddr=",
+        )
+
+    def with_origin(self, lat: float, lon: float) -> Dict[str, str]:
+        origin = f"{lat:.6f},{lon:.6f}"
+        return {
+            "Google": self.google + origin,
+            "Яндекс": f"https://yandex.ru/maps/?rtext={origin}{self.yandex}",
+            "Apple": self.apple + origin,
+        }
+
+
+class BranchIndex:
+    """Branches bucketed into a ``cell``-degree grid for nearest-N queries.
+
+    A query scans rings of cells around the user's cell and stops once the
+    N-th best distance is closer than anything the next ring could hold, so
+    its cost depends on how many branches are nearby, not on the total. A
+    point far from every branch falls back to checking each occupied cell.
+    """
+
+    def __init__(self, branches: Sequence[Branch], cell: float = 0.25):
+        self.branches = list(branches)
+        self.cell = cell
+        self._grid: Dict[Tuple[int, int], List[Tuple[Branch, _Links]]] = {}
+        for b in self.branches:
+            self._grid.setdefault(self._key(b.lat, b.lon), []).append((b, _Links.build(b)))
+        if self._grid:
+            rows = [k[0] for k in self._grid]
+            cols = [k[1] for k in self._grid]
+            self._bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    def __len__(self) -> int:
+        return len(self.branches)
+
+    def _key(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell), math.floor(lon / self.cell)
+
+    def _ring(self, ci: int, cj: int, r: int):
+        if r == 0:
+            yield ci, cj
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield ci - r, j
+            yield ci + r, j
+        for i in range(ci - r + 1, ci + r):
+            yield i, cj - r
+            yield i, cj + r
+
+    def nearest(self, lat: float, lon: float, n: int = 3) -> List[Route]:
+        if not self._grid:
+            return []
+        ci, cj = self._key(lat, lon)
+        lo_i, hi_i, lo_j, hi_j = self._bounds
+        # Rings needed to have covered every occupied cell.
+        last = max(abs(ci - lo_i), abs(ci - hi_i), abs(cj - lo_j), abs(cj - hi_j))
+        found: List[Tuple[float, Branch, _Links]] = []
+        r = 0
+        while True:
+            if (2 * r + 1) ** 2 > len(self._grid):
+                # Far from everything: visiting the occupied cells is cheaper than more empty rings.
+                found = [
+                    (distance_km(lat, lon, b.lat, b.lon), b, links)
+                    for bucket in self._grid.values()
+                    for b, links in bucket
+                ]
+                break
+            for key in self._ring(ci, cj, r):
+                for b, links in self._grid.get(key, ()):
+                    found.append((distance_km(lat, lon, b.lat, b.lon), b, links))
+            if r >= last:
+                break
+            if len(found) >= n:
+                found.sort(key=lambda f: f[0])
+                # Anything outside ring r is at least r cells away (east-west cells shrink with latitude).
+                shrink = math.cos(math.radians(min(89.9, abs(lat) + (r + 1) * self.cell)))
+                if found[n - 1][0] <= r * self.cell * KM_PER_DEG * shrink:
+                    break
+            r += 1
+        found.sort(key=lambda f: f[0])
+        return [Route(b, km, links.with_origin(lat, lon)) for km, b, links in found[:n]]
+
+
+def load(path: str) -> List[Branch]:
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    return [
+        Branch(
+            name=raw["name"],
+            address=raw.get("address", ""),
+            lat=float(raw["lat"]),
+            lon=float(raw["lon"]),
+            phone=raw.get("phone", ""),
+            hours=raw.get("hours", ""),
+        )
+        for raw in config["branches"]
+    ]
+
+
+class BranchRegistry:
+    """Holds the current :class:`BranchIndex` and rebuilds it when the config file changes.
+
+    Without a config file the index holds just ``fallback`` (e.g. the club
+    from ``CLUB_LAT``/``CLUB_LON``).
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, fallback: Sequence[Branch] = (), poll_interval: float = 5.0):
+        self.path = path
+        self.fallback = list(fallback)
+        self.poll_interval = poll_interval
+        self._mtime: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self.index = BranchIndex(self.fallback)
+        self.reload_if_changed()
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            self.index = BranchIndex(load(self.path))
+        except Exception:
+            # An invalid file keeps the previous branches in service until it is saved again.
+            logger.exception("Branch reload from %s failed; keeping the current list", self.path)
+            return False
+        logger.info("Loaded %s branches from %s", len(self.index), self.path)
+        return True
+
+    def nearest(self, lat: float, lon: float, n: int = 3) -> List[Route]:
+        return self.index.nearest(lat, lon, n)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await asyncio.to_thread(self.reload_if_changed)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,253 @@
+# Broadcast engine: announcements to every known tg_user_id, rate-limited and resumable.
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running',
+    created_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    broadcast_id INTEGER NOT NULL,
+    tg_user_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (broadcast_id, tg_user_id)
+);
+'''
+
+# Telegram allows roughly 30 messages per second to different chats.
+DEFAULT_RATE = 25.0
+
+
+class AlreadyRunning(Exception):
+    """The broadcast is being sent by another task of this process."""
+
+
+class AsyncTokenBucket:
+    """Global send limiter shared by all workers; ``pause`` honours RetryAfter for everyone."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+class Broadcaster:
+    """Sends a stored broadcast to all ``tg_user_id`` values of ``table``.
+
+    Recipients are streamed from the DB by keyset over the ``tg_user_id``
+    index, skipping everyone already recorded in ``broadcast_recipients``,
+    so re-running an interrupted broadcast continues where it stopped.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        table: str,
+        rate: float = DEFAULT_RATE,
+        concurrency: int = 8,
+        chunk_size: int = 500,
+        max_attempts: int = 3,
+    ):
+        self.db = db
+        self.table = table
+        self.limiter = AsyncTokenBucket(rate)
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self._running: Set[int] = set()
+
+    def init_db(self):
+        self.db.executescript(BROADCAST_SCHEMA)
+
+    async def create(self, text: str) -> int:
+        return await self.db.execute("INSERT INTO broadcasts (text, created_at) VALUES (?, ?)", (text, _now()))
+
+    def _read(self, sql: str, params: tuple) -> List[tuple]:
+        conn = self.db.connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def is_running(self, broadcast_id: int) -> bool:
+        return broadcast_id in self._running
+
+    def unfinished(self) -> List[int]:
+        return [row[0] for row in self._read("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id", ())]
+
+    def progress(self, broadcast_id: int) -> Dict[str, int]:
+        rows = self._read(
+            "SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status",
+            (broadcast_id,),
+        )
+        return dict(rows)
+
+    async def recipients(self, broadcast_id: int) -> AsyncIterator[int]:
+        after = -1
+        while True:
+            rows = await asyncio.to_thread(
+                self._read,
+                f"SELECT DISTINCT t.tg_user_id FROM {self.table} t "
+                "LEFT JOIN broadcast_recipients r ON r.broadcast_id = ? AND r.tg_user_id = t.tg_user_id "
+                "WHERE t.tg_user_id IS NOT NULL AND t.tg_user_id > ? AND r.tg_user_id IS NULL "
+                "ORDER BY t.tg_user_id LIMIT ?",
+                (broadcast_id, after, self.chunk_size),
+            )
+            if not rows:
+                return
+            for (tg_user_id,) in rows:
+                yield tg_user_id
+            after = rows[-1][0]
+
+    async def _deliver(self, bot: Bot, text: str, chat_id: int):
+        attempts = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                await bot.send_message(chat_id, text)
+                return "sent", None
+            except RetryAfter as e:
+                # Flood control applies to the whole bot: stop every worker, then retry this one.
+                logger.warning("Broadcast flood control: pausing %ss", e.retry_after)
+                self.limiter.pause(float(e.retry_after))
+            except Forbidden as e:
+                return "blocked", str(e)
+            except BadRequest as e:
+                return "failed", str(e)
+            except NetworkError as e:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    return "failed", str(e)
+                await asyncio.sleep(2 ** attempts)
+
+    async def run(self, bot: Bot, broadcast_id: int) -> Dict[str, int]:
+        """Send ``broadcast_id`` to everyone not reached yet; one run per broadcast at a time.
+
+        A second run of the same broadcast (e.g. ``resume`` while the restart
+        already resumed it) would send to the same pending recipients, so it
+        raises :class:`AlreadyRunning` instead.
+        """
+        if broadcast_id in self._running:
+            raise AlreadyRunning(f"broadcast #{broadcast_id} is already running")
+        self._running.add(broadcast_id)
+        try:
+            return await self._run(bot, broadcast_id)
+        finally:
+            self._running.discard(broadcast_id)
+
+    async def _run(self, bot: Bot, broadcast_id: int) -> Dict[str, int]:
+        rows = await asyncio.to_thread(self._read, "SELECT text FROM broadcasts WHERE id = ?", (broadcast_id,))
+        if not rows:
+            raise ValueError(f"broadcast #{broadcast_id} not found")
+        text = rows[0][0]
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 4)
+
+        async def worker():
+            while True:
+                chat_id = await queue.get()
+                try:
+                    if chat_id is None:
+                        return
+                    status, error = await self._deliver(bot, text, chat_id)
+                    await self.db.execute(
+                        "INSERT OR REPLACE INTO broadcast_recipients (broadcast_id, tg_user_id, status, error, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (broadcast_id, chat_id, status, error, _now()),
+                    )
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            async for chat_id in self.recipients(broadcast_id):
+                await queue.put(chat_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        except BaseException:
+            for task in workers:
+                task.cancel()
+            raise
+        await self.db.execute(
+            "UPDATE broadcasts SET status = 'done', finished_at = ? WHERE id = ?", (_now(), broadcast_id)
+        )
+        return await asyncio.to_thread(self.progress, broadcast_id)
+
+
+async def _cli(opts):
+    db = Database(opts.db_path)
+    base_url = os.getenv("TG_API_BASE_URL") or "https://api.telegram.org/bot"
+    bot = Bot(os.environ["TG_BOT_TOKEN"], base_url=base_url)
+    engine = Broadcaster(db, opts.table, rate=opts.rate, concurrency=opts.concurrency)
+    engine.init_db()
+    try:
+        async with bot:
+            if opts.resume:
+                broadcast_id = opts.resume
+            else:
+                broadcast_id = await engine.create(opts.text)
+            print(f"broadcast #{broadcast_id} running...")
+            print(await engine.run(bot, broadcast_id))
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send an announcement to every user in the lead DB (TG_BOT_TOKEN from env).")
+    parser.add_argument("db_path")
+    parser.add_argument("table", choices=["guest_visits", "guest_requests"])
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--text", help="message text for a new broadcast")
+    group.add_argument("--resume", type=int, metavar="ID", help="continue an interrupted broadcast")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="messages per second")
+    parser.add_argument("--concurrency", type=int, default=8)
+    opts = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_cli(opts))
+
+
+if __name__ == "__main__":
+    main()
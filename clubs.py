@@ -0,0 +1,136 @@
+# Hosts several clubs' bots (one Telegram token each) in a single process and event loop.
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import signal
+from types import ModuleType
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from telegram import Update
+from telegram.ext import Application
+
+import logpipe
+from webhook import WebhookRouter, WebhookServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+
+def load_config(path: str) -> List[Dict[str, str]]:
+    """A JSON list of clubs, each a mapping of the bot's env variables to their values for that club."""
+    with open(path, encoding="utf-8") as f:
+        clubs = json.load(f)
+    if not isinstance(clubs, list) or not clubs:
+        raise ValueError(f"{path}: expected a non-empty list of clubs")
+    result = []
+    for i, club in enumerate(clubs):
+        if not club.get("TG_BOT_TOKEN"):
+            raise ValueError(f"{path}: club #{i + 1} has no TG_BOT_TOKEN")
+        result.append({key: str(value) for key, value in club.items()})
+    return result
+
+
+def load_club(bot_path: str, overrides: Dict[str, str], index: int) -> ModuleType:
+    """Import a fresh copy of the bot module with the club's settings in the environment.
+
+    The bots read their configuration at import time, so each copy keeps its
+    own config and module-level state while the library code is shared.
+    """
+    # A per-club metrics port must be explicit; the process-wide one would clash.
+    overrides = {"METRICS_PORT": "0", **overrides}
+    saved = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    try:
+        name = os.path.splitext(os.path.basename(bot_path))[0].replace("-", "_")
+        spec = importlib.util.spec_from_file_location(f"{name}_club{index}", bot_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def build_club_app(module: ModuleType) -> Application:
+    if hasattr(module, "init_db"):
+        module.init_db()
+    return (getattr(module, "build_app", None) or module.build_application)()
+
+
+async def serve_clubs(bot_path: str, clubs: List[Dict[str, str]], stop_event: Optional[asyncio.Event] = None):
+    """Run every club until ``stop_event`` is set (or SIGINT/SIGTERM).
+
+    ``BOT_MODE=webhook`` serves all bots from one listener (``WEBHOOK_LISTEN``/``PORT``);
+    each club needs its own ``WEBHOOK_URL`` path.
+    """
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    modules = [load_club(bot_path, club, i) for i, club in enumerate(clubs)]
+    apps = [build_club_app(module) for module in modules]
+    webhook = os.getenv("BOT_MODE", "polling") == "webhook"
+    router: Optional[WebhookRouter] = None
+    started: List[Application] = []
+    try:
+        for app in apps:
+            await app.initialize()
+            started.append(app)
+            if app.post_init:
+                await app.post_init(app)
+        if webhook:
+            servers = [
+                WebhookServer(app, urlparse(module.WEBHOOK_URL).path or "/", module.WEBHOOK_SECRET)
+                for module, app in zip(modules, apps)
+            ]
+            router = WebhookRouter(servers, os.getenv("WEBHOOK_LISTEN", "0.0.0.0"), int(os.getenv("PORT", "8443")))
+            await router.start()
+            for module, app in zip(modules, apps):
+                await app.bot.set_webhook(module.WEBHOOK_URL, secret_token=module.WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+        for module, app in zip(modules, apps):
+            if not webhook:
+                await app.updater.start_polling()
+            await app.start()
+            logger.info("Club %s is running", module.CLUB_NAME)
+        await stop_event.wait()
+    finally:
+        if router is not None:
+            await router.stop()
+        for app in reversed(started):
+            if app.updater is not None and app.updater.running:
+                await app.updater.stop()
+            if app.running:
+                await app.stop()
+            await app.shutdown()
+            if app.post_shutdown:
+                await app.post_shutdown(app)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the bots of several clubs in one process.")
+    parser.add_argument("config", help="JSON list of per-club env settings, see clubs.example.json")
+    parser.add_argument("--bot", default=DEFAULT_BOT, help="bot script to host (bot.py or bot-2.py)")
+    opts = parser.parse_args(argv)
+    clubs = load_config(opts.config)
+    logpipe.setup(os.getenv("LOG_LEVEL", "INFO"), os.getenv("LOG_FORMAT", "json"), os.getenv("LOG_SAMPLE", ""))
+    logger.info("Starting %d clubs...", len(clubs))
+    try:
+        asyncio.run(serve_clubs(opts.bot, clubs))
+    finally:
+        logpipe.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+# Shared SQLite layer: long-lived WAL connections owned by a writer thread.
+import asyncio
+import hashlib
+import logging
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+_CLOSE = object()
+
+# Schema scripts already applied to a file, by content; see Database.executescript.
+SCHEMA_VERSION_TABLE = '''
+CREATE TABLE IF NOT EXISTS schema_version (
+    digest TEXT PRIMARY KEY,  -- sha1 of the DDL script
+    applied_at TEXT NOT NULL
+);
+'''
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA busy_timeout = 30000")
+    return conn
+
+
+class Writer:
+    """Writer thread shared by any number of :class:`Database` files.
+
+    It holds one write connection per file. Whatever is queued (up to
+    ``batch_size``) is drained at once and committed as one transaction per
+    file, so a burst of inserts costs one fsync instead of one per lead.
+    The thread runs while at least one database is started.
+    """
+
+    def __init__(self, batch_size: int = 256, linger: float = 0.002):
+        self.batch_size = batch_size
+        self.linger = linger
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._users = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self._users += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def release(self, path: str):
+        self._queue.put((_CLOSE, path))
+        with self._lock:
+            self._users -= 1
+            thread = None
+            if self._users <= 0:
+                self._users = 0
+                thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def put(self, path: str, item: tuple):
+        self._queue.put((path, item))
+
+    @staticmethod
+    def _open(path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA busy_timeout = 30000")
+        return conn
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        try:
+            if self.linger:
+                batch.append(self._queue.get(timeout=self.linger))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        conns: Dict[str, sqlite3.Connection] = {}
+        try:
+            while True:
+                batch = self._collect(self._queue.get())
+                groups: Dict[str, list] = {}
+                closing = []
+                stop = False
+                for entry in batch:
+                    if entry is _STOP:
+                        stop = True
+                    elif entry[0] is _CLOSE:
+                        closing.append(entry[1])
+                    else:
+                        groups.setdefault(entry[0], []).append(entry[1])
+                for path, items in groups.items():
+                    try:
+                        conn = conns.get(path)
+                        if conn is None:
+                            conn = conns[path] = self._open(path)
+                        _commit(conn, items)
+                    except Exception as e:
+                        # Fail this file's writes but keep serving the other files (and later batches).
+                        logger.exception("Writes to %s failed", path)
+                        _fail(items, e)
+                        conn = conns.pop(path, None)
+                        if conn is not None:
+                            conn.close()
+                for path in closing:
+                    conn = conns.pop(path, None)
+                    if conn is not None:
+                        conn.close()
+                if stop:
+                    return
+        finally:
+            for conn in conns.values():
+                conn.close()
+
+
+def _fail(batch: list, error: Exception):
+    for fut, *_ in batch:
+        if not fut.done():
+            fut.set_exception(error)
+
+
+def _commit(conn: sqlite3.Connection, batch: list):
+    done = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for fut, sql, params, kind in batch:
+            if not fut.set_running_or_notify_cancel():
+                continue
+            # A savepoint per write keeps one bad statement from failing the whole group.
+            conn.execute("SAVEPOINT w")
+            try:
+                if kind == "many":
+                    result = conn.executemany(sql, params).rowcount
+                elif kind == "all":
+                    result = [conn.execute(stmt, stmt_params).lastrowid for stmt, stmt_params in params]
+                else:
+                    result = conn.execute(sql, params).lastrowid
+            except Exception as e:
+                conn.execute("ROLLBACK TO w")
+                conn.execute("RELEASE w")
+                fut.set_exception(e)
+                continue
+            conn.execute("RELEASE w")
+            done.append((fut, result))
+        conn.execute("COMMIT")
+    except Exception as e:
+        logger.exception("Group commit failed")
+        # Every write of the batch not resolved yet fails, including the ones never started.
+        _fail(batch, e)
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        return
+    for fut, result in done:
+        fut.set_result(result)
+
+
+class Database:
+    """Group-committed writes to a SQLite file.
+
+    Writes are queued to a :class:`Writer` thread that holds the only write
+    connection; each write still resolves to its own ``lastrowid``. Pass a
+    shared ``writer`` to serve several files from one thread.
+    Reads use short-lived connections from :meth:`connect`; with WAL they
+    never block the writer.
+    """
+
+    def __init__(self, path: str, batch_size: int = 256, linger: float = 0.002, writer: Optional[Writer] = None):
+        self.path = path
+        self.writer = writer or Writer(batch_size, linger)
+        self._started = False
+        self._lock = threading.Lock()
+        self._applied: Optional[Set[str]] = None
+
+    def connect(self) -> sqlite3.Connection:
+        return connect(self.path)
+
+    def _load_applied(self) -> Set[str]:
+        conn = self.connect()
+        try:
+            return {digest for (digest,) in conn.execute("SELECT digest FROM schema_version")}
+        except sqlite3.OperationalError:
+            # A new file, or one from before schema versions were recorded.
+            return set()
+        finally:
+            conn.close()
+
+    def executescript(self, script: str):
+        """Apply a DDL script once per file: a script recorded in ``schema_version`` is skipped.
+
+        Scripts are idempotent (``IF NOT EXISTS``), so restarts only need one
+        read of the applied digests instead of every component's DDL; a changed
+        script has a new digest and runs again.
+        """
+        digest = hashlib.sha1(script.encode("utf-8")).hexdigest()
+        with self._lock:
+            if self._applied is None:
+                self._applied = self._load_applied()
+            if digest in self._applied:
+                return
+        # Schema setup runs before the writer starts, on its own connection.
+        conn = self.connect()
+        try:
+            # Only takes effect on a new, empty file: lets archive.py free pages without a VACUUM.
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.executescript(script + ";" + SCHEMA_VERSION_TABLE)
+            conn.execute(
+                "INSERT OR IGNORE INTO schema_version (digest, applied_at) VALUES (?, ?)",
+                (digest, datetime.utcnow().isoformat() + "Z"),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._applied.add(digest)
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                self.writer.acquire()
+                self._started = True
+
+    def close(self):
+        with self._lock:
+            started, self._started = self._started, False
+        if started:
+            self.writer.release(self.path)
+
+    # --- public API ---
+    def submit(self, sql: str, params: Sequence = ()) -> Future:
+        self.start()
+        fut: Future = Future()
+        self.writer.put(self.path, (fut, sql, tuple(params), "one"))
+        return fut
+
+    def submit_many(self, sql: str, rows: Iterable[Tuple]) -> Future:
+        self.start()
+        fut: Future = Future()
+        self.writer.put(self.path, (fut, sql, list(rows), "many"))
+        return fut
+
+    def submit_all(self, statements: Iterable[Tuple[str, Sequence]]) -> Future:
+        self.start()
+        fut: Future = Future()
+        self.writer.put(self.path, (fut, None, [(sql, tuple(params)) for sql, params in statements], "all"))
+        return fut
+
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        """Queue a write and wait for its group commit; returns ``lastrowid``."""
+        return await asyncio.wrap_future(self.submit(sql, params))
+
+    async def executemany(self, sql: str, rows: Iterable[Tuple]) -> int:
+        return await asyncio.wrap_future(self.submit_many(sql, rows))
+
+    async def execute_all(self, statements: Iterable[Tuple[str, Sequence]]) -> List[int]:
+        """Run several writes atomically (all or none); returns each ``lastrowid``."""
+        return await asyncio.wrap_future(self.submit_all(statements))
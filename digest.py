@@ -0,0 +1,253 @@
+# Lead digest: one e-mail (plus CSV) per window instead of one message per lead.
+import asyncio
+import csv
+import io
+import logging
+import sqlite3
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from db import Database
+from leads import parse_created_at
+from outbox import Outbox
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS lead_digests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    first_lead_id INTEGER NOT NULL,
+    last_lead_id INTEGER NOT NULL,
+    lead_count INTEGER NOT NULL,
+    outbox_id INTEGER,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_lead_digests_table ON lead_digests (table_name, last_lead_id);
+CREATE TABLE IF NOT EXISTS lead_digest_mode (
+    table_name TEXT PRIMARY KEY,
+    enabled INTEGER NOT NULL,  -- the mode of the last start: 1 digest, 0 a message per lead
+    changed_at TEXT NOT NULL
+);
+'''
+
+# Leads listed in the message body; the CSV always has all of them.
+BODY_LINES = 30
+
+
+class LeadDigest:
+    """Collects new leads of ``table`` into one e-mail every ``interval`` seconds.
+
+    Each digest is recorded in ``lead_digests`` with the id range it covers,
+    in the same transaction that queues the e-mail in the outbox, so a lead
+    is digested exactly once across restarts. With ``interval`` 0 the digest
+    is off and every lead is e-mailed on its own, as before.
+
+    Leads with a priority word were already e-mailed on their own and are
+    left out of the digest. Switching the mode off sends a last digest of
+    what was still pending; switching it back on starts after the newest
+    lead, since everything in between went out one by one.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        outbox: Outbox,
+        table: str,
+        recipient: str,
+        interval: float = 0.0,
+        priority_words: Iterable[str] = (),
+        club_name: str = "",
+        max_leads: int = 5000,
+    ):
+        self.db = db
+        self.outbox = outbox
+        self.table = table
+        self.recipient = recipient
+        self.interval = interval
+        self.priority_words = [w.strip().lower() for w in priority_words if w.strip()]
+        self.club_name = club_name
+        self.max_leads = max_leads
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def _priority(self, *texts: Optional[str]) -> bool:
+        joined = " ".join(t for t in texts if t).lower()
+        return any(word in joined for word in self.priority_words)
+
+    def immediate(self, *texts: Optional[str]) -> bool:
+        """Whether a lead should still get its own e-mail right away."""
+        return not self.enabled or self._priority(*texts)
+
+    def _mode(self, conn) -> Optional[bool]:
+        """Mode of the previous start; ``None`` if digest mode was never used."""
+        try:
+            row = conn.execute("SELECT enabled FROM lead_digest_mode WHERE table_name = ?", (self.table,)).fetchone()
+        except sqlite3.OperationalError:
+            return None  # no digest tables yet
+        return bool(row[0]) if row is not None else None
+
+    def _set_mode(self, conn, enabled: bool):
+        conn.execute(
+            "INSERT INTO lead_digest_mode (table_name, enabled, changed_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (table_name) DO UPDATE SET enabled = excluded.enabled, changed_at = excluded.changed_at "
+            "WHERE enabled != excluded.enabled",
+            (self.table, int(enabled), datetime.utcnow().isoformat() + "Z"),
+        )
+
+    def init_db(self):
+        self.db.executescript(DIGEST_SCHEMA)
+        conn = self.db.connect()
+        try:
+            first = conn.execute("SELECT 1 FROM lead_digests WHERE table_name = ? LIMIT 1", (self.table,)).fetchone() is None
+            if first or self._mode(conn) is False:
+                # First start in digest mode, or the first since it was switched off:
+                # the leads up to now were already e-mailed one by one.
+                last_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {self.table}").fetchone()[0]
+                conn.execute(
+                    "INSERT INTO lead_digests (table_name, first_lead_id, last_lead_id, lead_count, created_at) "
+                    "VALUES (?, ?, ?, 0, ?)",
+                    (self.table, last_id, last_id, datetime.utcnow().isoformat() + "Z"),
+                )
+            self._set_mode(conn, True)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _was_enabled(self) -> bool:
+        conn = self.db.connect()
+        try:
+            return bool(self._mode(conn))
+        finally:
+            conn.close()
+
+    async def _switch_off(self):
+        """Digest mode was on at the previous start: send what it still owed, then record the switch."""
+        if not await asyncio.to_thread(self._was_enabled):
+            return
+        while await self.send_due() >= self.max_leads:
+            pass
+        await self.db.execute(
+            "UPDATE lead_digest_mode SET enabled = 0, changed_at = ? WHERE table_name = ?",
+            (datetime.utcnow().isoformat() + "Z", self.table),
+        )
+        logger.info("Lead digest switched off; leads are e-mailed one by one from now on")
+
+    def _last_digest(self, conn) -> Tuple[int, Optional[str]]:
+        return conn.execute(
+            "SELECT last_lead_id, created_at FROM lead_digests WHERE table_name = ? ORDER BY last_lead_id DESC LIMIT 1",
+            (self.table,),
+        ).fetchone() or (0, None)
+
+    def _last_sent_at(self) -> Optional[str]:
+        conn = self.db.connect()
+        try:
+            return self._last_digest(conn)[1]
+        finally:
+            conn.close()
+
+    def _pending(self) -> Tuple[List[str], list, int, int]:
+        """Columns, the leads after the last digest (up to ``max_leads``) and the id range scanned.
+
+        Priority leads in that range are skipped: they were e-mailed right away.
+        """
+        from export import iter_chunks  # loaded with the first digest, not at bot startup
+
+        conn = self.db.connect()
+        try:
+            last_id, _ = self._last_digest(conn)
+            columns = [r[1] for r in conn.execute(f"PRAGMA table_info({self.table})")]
+            name = columns.index("name") if "name" in columns else None
+            rows: list = []
+            scanned = last_id
+            for chunk in iter_chunks(conn, self.table, last_id):
+                for row in chunk:
+                    scanned = row[0]
+                    if name is None or not self._priority(row[name]):
+                        rows.append(row)
+                        if len(rows) >= self.max_leads:
+                            return columns, rows, last_id + 1, scanned
+            return columns, rows, last_id + 1, scanned
+        finally:
+            conn.close()
+
+    def _render(self, columns: List[str], rows: list) -> Tuple[str, str, bytes]:
+        leads = [dict(zip(columns, row)) for row in rows]
+        subject = f"Заявки из бота №{leads[0]['id']}–{leads[-1]['id']} ({len(leads)})"
+        lines = [f"Новые заявки на гостевой визит{' в ' + self.club_name if self.club_name else ''}: {len(leads)}", ""]
+        for lead in leads[:BODY_LINES]:
+            lines.append(f"№{lead['id']} · {lead.get('name') or '—'} · {lead.get('phone') or '—'} · {lead.get('created_at') or ''}")
+        if len(leads) > BODY_LINES:
+            lines.append(f"…и ещё {len(leads) - BODY_LINES} — во вложении.")
+        lines.extend(["", "Полный список — во вложенном CSV."])
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(columns)
+        writer.writerows(rows)
+        return subject, "\n".join(lines), buf.getvalue().encode("utf-8-sig")
+
+    async def send_due(self) -> int:
+        """Queue one digest with every lead since the previous one; returns how many leads it covers."""
+        columns, rows, first_id, last_id = await asyncio.to_thread(self._pending)
+        if not rows:
+            if last_id >= first_id:
+                # Only priority leads since the last digest: mark them covered, nothing to send.
+                await self.db.execute(
+                    "INSERT INTO lead_digests (table_name, first_lead_id, last_lead_id, lead_count, created_at) "
+                    "VALUES (?, ?, ?, 0, ?)",
+                    (self.table, first_id, last_id, datetime.utcnow().isoformat() + "Z"),
+                )
+            return 0
+        subject, body, data = self._render(columns, rows)
+        filename = f"{self.table}_{rows[0][0]}-{rows[-1][0]}.csv"
+        await self.outbox.enqueue(
+            self.recipient,
+            subject,
+            body,
+            attachment=(filename, data),
+            also=[(
+                "INSERT INTO lead_digests (table_name, first_lead_id, last_lead_id, lead_count, outbox_id, created_at) "
+                "VALUES (?, ?, ?, ?, last_insert_rowid(), ?)",
+                (self.table, first_id, last_id, len(rows), datetime.utcnow().isoformat() + "Z"),
+            )],
+        )
+        logger.info("Lead digest queued: %s leads (#%s-#%s)", len(rows), rows[0][0], rows[-1][0])
+        return len(rows)
+
+    async def _run(self):
+        last_at = await asyncio.to_thread(self._last_sent_at)
+        # Resume the window across restarts instead of starting a fresh one.
+        since_last = time.time() - parse_created_at(last_at) if last_at else self.interval
+        delay = max(0.0, self.interval - since_last)
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                while await self.send_due() >= self.max_leads:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lead digest failed")
+            delay = self.interval
+
+    async def start(self):
+        if self._task is not None:
+            return
+        if not self.enabled:
+            await self._switch_off()
+            return
+        await asyncio.to_thread(self.init_db)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
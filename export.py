@@ -0,0 +1,176 @@
+# Streaming CSV export of leads: keyset-paged reads, optional on-the-fly gzip.
+import argparse
+import csv
+import gzip
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from db import connect
+from schedule import parse_date
+from snapshot import reading
+
+CHUNK_SIZE = 1000
+
+CURSOR_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS export_cursor (
+    table_name TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL,
+    exported_at TEXT NOT NULL
+)
+'''
+
+
+def init_cursor_table(conn: sqlite3.Connection):
+    conn.execute(CURSOR_SCHEMA)
+    conn.commit()
+
+
+def last_cursor(conn: sqlite3.Connection, table: str) -> int:
+    init_cursor_table(conn)
+    row = conn.execute("SELECT last_id FROM export_cursor WHERE table_name = ?", (table,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def save_cursor(conn: sqlite3.Connection, table: str, last_id: int):
+    init_cursor_table(conn)
+    conn.execute(
+        "INSERT INTO export_cursor (table_name, last_id, exported_at) VALUES (?,?,?) "
+        "ON CONFLICT(table_name) DO UPDATE SET last_id = excluded.last_id, exported_at = excluded.exported_at",
+        (table, last_id, datetime.utcnow().isoformat() + "Z"),
+    )
+    conn.commit()
+
+
+def resolve_since(conn: sqlite3.Connection, table: str, since: Optional[str]) -> int:
+    """Turn ``since`` (row id, ``YYYY-MM-DD``/``DD.MM.YYYY`` date, or ``last``) into an id to start after."""
+    if not since:
+        return 0
+    since = since.strip()
+    if since == "last":
+        return last_cursor(conn, table)
+    if since.isdigit():
+        return int(since)
+    day = parse_date(since)
+    if day is None:
+        raise ValueError(f"Не понимаю since={since!r}: нужен номер заявки или дата")
+    row = conn.execute(f"SELECT MIN(id) FROM {table} WHERE created_at >= ?", (day.isoformat(),)).fetchone()
+    if row[0] is None:
+        return conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+    return int(row[0]) - 1
+
+
+def iter_chunks(conn: sqlite3.Connection, table: str, after_id: int = 0, chunk_size: int = CHUNK_SIZE) -> Iterator[list]:
+    # Keyset paging on the primary key: no long-lived read transaction, no OFFSET scans.
+    while True:
+        rows = conn.execute(
+            f"SELECT * FROM {table} WHERE id > ? ORDER BY id LIMIT ?", (after_id, chunk_size)
+        ).fetchall()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1][0]
+
+
+def write_csv(
+    db_path: str,
+    table: str,
+    out: BinaryIO,
+    since: Optional[str] = None,
+    compress: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+    snapshot_path: Optional[str] = None,
+) -> Tuple[int, int]:
+    """Stream ``table`` rows after ``since`` into ``out``; returns ``(row_count, last_id)``.
+
+    Rows come from one point-in-time view of ``snapshot_path`` (a
+    :class:`snapshot.Snapshot` copy) if given, else of ``db_path`` itself.
+    """
+    conn = connect(db_path)
+    try:
+        after_id = resolve_since(conn, table, since)
+    finally:
+        conn.close()
+    with reading(snapshot_path or db_path) as conn:
+        columns = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+        raw = gzip.GzipFile(fileobj=out, mode="wb") if compress else out
+        text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+        writer = csv.writer(text)
+        writer.writerow(columns)
+        count, last_id = 0, after_id
+        for rows in iter_chunks(conn, table, after_id, chunk_size):
+            writer.writerows(rows)
+            count += len(rows)
+            last_id = rows[-1][0]
+        text.flush()
+        text.detach()
+        if compress:
+            raw.close()
+        return count, last_id
+
+
+def export_to_file(
+    db_path: str, table: str, since: Optional[str] = None, compress: bool = False, snapshot_path: Optional[str] = None
+) -> Tuple[str, int, int]:
+    """Export into a temp file (caller removes it); returns ``(path, row_count, last_id)``."""
+    fd, path = tempfile.mkstemp(prefix=f"{table}_", suffix=".csv.gz" if compress else ".csv")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            count, last_id = write_csv(db_path, table, f, since=since, compress=compress, snapshot_path=snapshot_path)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path, count, last_id
+
+
+def commit_cursor(db_path: str, table: str, last_id: int):
+    conn = connect(db_path)
+    try:
+        save_cursor(conn, table, last_id)
+    finally:
+        conn.close()
+
+
+def parse_args(args: list) -> Tuple[Optional[str], bool]:
+    """Parse ``/export`` arguments: ``since=<id|date|last>``, ``all``, ``gz``. Default is ``since=last``."""
+    since: Optional[str] = "last"
+    compress = False
+    for arg in args:
+        arg = arg.strip().lower()
+        if arg.startswith("since="):
+            since = arg[len("since="):]
+        elif arg == "all":
+            since = None
+        elif arg in ("gz", "gzip"):
+            compress = True
+        else:
+            raise ValueError(f"Неизвестный параметр: {arg}")
+    return since, compress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream leads from the bot DB as CSV.")
+    parser.add_argument("db_path")
+    parser.add_argument("table", choices=["guest_visits", "guest_requests"])
+    parser.add_argument("--since", help="row id, date (YYYY-MM-DD / DD.MM.YYYY) or 'last' export cursor")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--commit-cursor", action="store_true", help="advance the export cursor afterwards")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    opts = parser.parse_args(argv)
+
+    if opts.output:
+        with open(opts.output, "wb") as f:
+            count, last_id = write_csv(opts.db_path, opts.table, f, opts.since, opts.gzip)
+    else:
+        count, last_id = write_csv(opts.db_path, opts.table, sys.stdout.buffer, opts.since, opts.gzip)
+    if opts.commit_cursor and count:
+        commit_cursor(opts.db_path, opts.table, last_id)
+    print(f"exported {count} rows, last id {last_id}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+# Local fake Telegram: a stand-in Bot API server and a webhook client, for measuring without network.
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from email.parser import BytesParser
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlparse
+
+from webhook import SECRET_HEADER, read_request, write_response
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+def _parse_params(headers: Dict[str, str], body: bytes) -> dict:
+    ctype = headers.get("content-type", "")
+    if ctype.startswith("application/json"):
+        return json.loads(body or b"{}")
+    if ctype.startswith("multipart/form-data"):
+        msg = BytesParser().parsebytes(f"Content-Type: {ctype}\r\n\r\n".encode("latin-1") + body)
+        params = {}
+        for part in msg.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                params[name] = {"filename": part.get_filename(), "size": len(part.get_payload(decode=True))}
+            else:
+                params[name] = part.get_payload(decode=True).decode("utf-8")
+        return params
+    return dict(parse_qsl(body.decode("utf-8")))
+
+
+def _chat_id(params: dict) -> Optional[int]:
+    try:
+        return int(params.get("chat_id"))
+    except (TypeError, ValueError):
+        return None
+
+
+class FakeBotApi:
+    """Records every Bot API call and answers with plausible results.
+
+    Point a bot at it with ``Application.builder().base_url(api.base_url)``.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, flood_limit: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        # Simulated flood control: more than ``flood_limit`` sends per second get a 429 / retry_after.
+        self.flood_limit = flood_limit
+        self._window: List[float] = []
+        self.flood_hits = 0
+        self.calls: List[Tuple[float, str, dict]] = []
+        self._message_ids = itertools.count(1)
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
+        self._server: Optional[asyncio.base_events.Server] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def wait_for_chat(self, chat_id: int) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, []).append(fut)
+        return fut
+
+    def record(self, method: str, params: dict):
+        now = time.perf_counter()
+        self.calls.append((now, method, params))
+        chat_id = _chat_id(params)
+        for fut in self._waiters.pop(chat_id, []):
+            if not fut.done():
+                fut.set_result((now, method, params))
+
+    def _flooded(self, method: str) -> bool:
+        if self.flood_limit is None or not method.startswith("send"):
+            return False
+        now = time.monotonic()
+        self._window = [t for t in self._window if now - t < 1.0]
+        if len(self._window) >= self.flood_limit:
+            self.flood_hits += 1
+            return True
+        self._window.append(now)
+        return False
+
+    def result(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return []
+        if method.startswith("send") and method != "sendChatAction":
+            message = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": _chat_id(params), "type": "private"},
+                "from": BOT_USER,
+            }
+            if "text" in params:
+                message["text"] = params["text"]
+            for kind in ("document", "photo"):
+                if kind in params:
+                    file_id = params[kind] if isinstance(params[kind], str) else f"fake-{kind}-{message['message_id']}"
+                    media = {"file_id": file_id, "file_unique_id": file_id}
+                    message[kind] = [dict(media, width=1, height=1)] if kind == "photo" else media
+            return message
+        return True
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                _, path, headers, body = request
+                method = path.rsplit("/", 1)[-1]
+                params = _parse_params(headers, body)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                if self._flooded(method):
+                    write_response(writer, 429, json.dumps({
+                        "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                        "parameters": {"retry_after": 1},
+                    }).encode())
+                    await writer.drain()
+                    continue
+                self.record(method, params)
+                write_response(writer, 200, json.dumps({"ok": True, "result": self.result(method, params)}).encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+_update_ids = itertools.count(1)
+
+
+def message_update(user_id: int, text: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": text,
+            **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]}
+               if text.startswith("/") else {}),
+        },
+    }
+
+
+class WebhookClient:
+    """Posts updates to a webhook the way Telegram does, over one keep-alive connection."""
+
+    def __init__(self, url: str, secret: Optional[str] = None):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path or "/"
+        self.secret = secret
+        self._conn: Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = None
+
+    async def post(self, update: dict) -> Tuple[int, bytes]:
+        if self._conn is None:
+            self._conn = await asyncio.open_connection(self.host, self.port)
+        reader, writer = self._conn
+        body = json.dumps(update).encode("utf-8")
+        head = (
+            f"POST {self.path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        )
+        if self.secret:
+            head += f"{SECRET_HEADER}: {self.secret}\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        payload = await reader.readexactly(int(headers.get("content-length", "0")))
+        return int(status_line.split()[1]), payload
+
+    async def close(self):
+        if self._conn is not None:
+            self._conn[1].close()
+            self._conn = None
+
+
+async def timed_exchange(client: WebhookClient, api: FakeBotApi, user_id: int, text: str, timeout: float = 10.0) -> float:
+    """Send one message and return seconds until the bot's first reply (inline or via the API)."""
+    waiter = api.wait_for_chat(user_id)
+    start = time.perf_counter()
+    status, payload = await client.post(message_update(user_id, text))
+    if status != 200:
+        raise RuntimeError(f"webhook answered {status}")
+    if payload:
+        waiter.cancel()
+        return time.perf_counter() - start
+    try:
+        replied_at, _, _ = await asyncio.wait_for(waiter, timeout)
+    except asyncio.TimeoutError:
+        return float("nan")
+    return replied_at - start
+
+
+def load_bot(path: str):
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0].replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_bot_app(module):
+    if hasattr(module, "init_db"):
+        module.init_db()
+    return (getattr(module, "build_app", None) or module.build_application)()
+
+
+def summarize(latencies: List[float]) -> dict:
+    ok = sorted(x for x in latencies if x == x)
+    if not ok:
+        return {"count": 0, "timeouts": len(latencies)}
+    q = statistics.quantiles(ok, n=100, method="inclusive") if len(ok) > 1 else [ok[0]] * 99
+    return {
+        "count": len(ok),
+        "timeouts": len(latencies) - len(ok),
+        "p50_ms": q[49] * 1000,
+        "p95_ms": q[94] * 1000,
+        "p99_ms": q[98] * 1000,
+        "max_ms": ok[-1] * 1000,
+    }
+
+
+async def _measure(bot_path: str, users: int, texts: List[str]) -> dict:
+    from webhook import serve_webhook
+
+    api = FakeBotApi()
+    await api.start()
+    secret = "fake-secret"
+    os.environ.update(
+        TG_BOT_TOKEN="1:fake",
+        TG_API_BASE_URL=api.base_url,
+        BOT_MODE="webhook",
+        DB_PATH=os.path.join(tempfile.mkdtemp(prefix="fake_tg_"), "bot.sqlite3"),
+    )
+    module = load_bot(bot_path)
+    stop = asyncio.Event()
+    server = asyncio.create_task(serve_webhook(build_bot_app(module), "http://127.0.0.1:18443/tg", secret,
+                                              host="127.0.0.1", port=18443, stop_event=stop))
+    while not any(method == "setWebhook" for _, method, _ in api.calls):
+        await asyncio.sleep(0.01)
+
+    async def user(uid: int) -> List[float]:
+        client = WebhookClient("http://127.0.0.1:18443/tg", secret)
+        try:
+            return [await timed_exchange(client, api, uid, text) for text in texts]
+        finally:
+            await client.close()
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(user(100000 + i) for i in range(users)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await server
+    await api.stop()
+    latencies = [x for r in results for x in r]
+    return dict(summarize(latencies), users=users, seconds=elapsed, updates_per_sec=len(latencies) / elapsed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure update-to-reply latency of a bot in webhook mode, offline.")
+    parser.add_argument("bot", help="path to bot.py or bot-2.py")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--text", action="append", help="message to send (repeatable); default: /start, /menu")
+    opts = parser.parse_args(argv)
+    report = asyncio.run(_measure(opts.bot, opts.users, opts.text or ["/start", "/menu"]))
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
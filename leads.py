@@ -0,0 +1,141 @@
+# Lead hygiene: phone normalization, duplicate detection and per-user submission throttling.
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Hashable, Optional, Tuple
+
+from db import Database
+
+
+def normalize_phone(text: str) -> Optional[str]:
+    if not text:
+        return None
+    digits = re.sub(r"[^\d+]", "", text)
+    only_digits = re.sub(r"\D", "", digits)
+    if len(only_digits) < 7:
+        return None
+    if digits and not digits.startswith("+") and len(only_digits) >= 10:
+        digits = "+" + only_digits
+    return digits
+
+
+def parse_created_at(value: str) -> float:
+    return datetime.fromisoformat(value.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+
+
+class TokenBucketThrottle:
+    """Per-key token bucket: ``burst`` submissions at once, refilled at ``rate`` per second.
+
+    Buckets live in a bounded LRU; an evicted key simply starts with a full bucket.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+
+    def allow(self, key: Hashable, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        tokens, last = self._buckets.pop(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed
+
+
+class LeadGuard:
+    """Finds an existing lead for the same user or normalized phone within ``window`` seconds.
+
+    Recent leads are kept in a bounded LRU, warmed from the DB at startup.
+    While no in-window entry has been evicted, the LRU is authoritative and
+    a miss means "no duplicate" without touching the DB; otherwise the
+    indexed ``tg_user_id`` / ``phone`` / ``created_at`` lookup is used.
+    """
+
+    def __init__(self, db: Database, table: str, window: float = 24 * 3600, max_entries: int = 20000):
+        self.db = db
+        self.table = table
+        self.window = window
+        self.max_entries = max_entries
+        self._recent: "OrderedDict[Tuple[str, object], Tuple[int, float]]" = OrderedDict()
+        # The LRU cannot vouch for misses until this moment (wall clock).
+        self._incomplete_until = float("inf")
+
+    def _put(self, key: Tuple[str, object], lead_id: int, created: float):
+        self._recent[key] = (lead_id, created)
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_entries:
+            _, (_, evicted_at) = self._recent.popitem(last=False)
+            self._incomplete_until = max(self._incomplete_until, evicted_at + self.window)
+
+    def remember(self, tg_user_id: Optional[int], phone: Optional[str], lead_id: int, created: Optional[float] = None):
+        created = time.time() if created is None else created
+        if tg_user_id is not None:
+            self._put(("user", tg_user_id), lead_id, created)
+        if phone:
+            self._put(("phone", phone), lead_id, created)
+
+    def _cached(self, key: Tuple[str, object], now: float) -> Optional[int]:
+        hit = self._recent.get(key)
+        if hit is None or now - hit[1] > self.window:
+            return None
+        self._recent.move_to_end(key)
+        return hit[0]
+
+    def _query(self, tg_user_id: Optional[int], phone: Optional[str], since: float) -> Optional[Tuple[int, Optional[int], str, str]]:
+        cutoff = datetime.fromtimestamp(since, timezone.utc).replace(tzinfo=None).isoformat()
+        conn = self.db.connect()
+        try:
+            return conn.execute(
+                f"SELECT id, tg_user_id, phone, created_at FROM {self.table} "
+                "WHERE (tg_user_id = ? OR phone = ?) AND created_at >= ? ORDER BY id DESC LIMIT 1",
+                (tg_user_id, phone, cutoff),
+            ).fetchone()
+        finally:
+            conn.close()
+
+    async def find(self, tg_user_id: Optional[int], phone: Optional[str] = None) -> Optional[int]:
+        """Id of a lead from this user or phone inside the window, if any."""
+        now = time.time()
+        for key in (("user", tg_user_id), ("phone", phone)):
+            if key[1] is not None:
+                lead_id = self._cached(key, now)
+                if lead_id is not None:
+                    return lead_id
+        if now >= self._incomplete_until:
+            return None
+        row = await asyncio.to_thread(self._query, tg_user_id, phone, now - self.window)
+        if row is None:
+            return None
+        self.remember(row[1], row[2], row[0], parse_created_at(row[3]))
+        return row[0]
+
+    def _load_recent(self, since: float):
+        cutoff = datetime.fromtimestamp(since, timezone.utc).replace(tzinfo=None).isoformat()
+        conn = self.db.connect()
+        try:
+            return conn.execute(
+                f"SELECT id, tg_user_id, phone, created_at FROM {self.table} "
+                "WHERE created_at >= ? ORDER BY id DESC LIMIT ?",
+                (cutoff, self.max_entries // 2),
+            ).fetchall()
+        finally:
+            conn.close()
+
+    async def warm(self):
+        now = time.time()
+        rows = await asyncio.to_thread(self._load_recent, now - self.window)
+        for lead_id, tg_user_id, phone, created_at in reversed(rows):
+            self.remember(tg_user_id, phone, lead_id, parse_created_at(created_at))
+        if len(rows) < self.max_entries // 2:
+            self._incomplete_until = float("-inf")
+        else:
+            # Older in-window leads did not fit; the DB stays authoritative until they age out.
+            self._incomplete_until = parse_created_at(rows[-1][3]) + self.window
@@ -0,0 +1,197 @@
+# Logging for the bots: records are queued in memory and written as JSON lines by a background thread.
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Optional, TextIO
+
+# Fields of the update being handled (request_id, tg_user_id, handler, ...); one dict per update.
+_fields: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("log_fields", default=None)
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_UNSET = object()
+
+_lock = threading.Lock()
+_handler: Optional["_QueueHandler"] = None
+_listener: Optional["_Listener"] = None
+
+
+@contextmanager
+def context(**fields) -> Iterator[dict]:
+    """Attach ``fields`` to every record logged inside the block (and tasks started from it)."""
+    parent = _fields.get()
+    current = dict(parent, **fields) if parent else fields
+    token = _fields.set(current)
+    try:
+        yield current
+    finally:
+        _fields.reset(token)
+
+
+def annotate(**fields):
+    """Add fields to the current :func:`context`, visible to the code that opened it too."""
+    current = _fields.get()
+    if current is not None:
+        current.update(fields)
+
+
+def parse_sample(spec: str) -> Dict[str, float]:
+    """``"httpx=0.01,updates=0.1"`` -> share of INFO/DEBUG records kept per logger name."""
+    rates = {}
+    for part in (spec or "").split(","):
+        name, sep, rate = part.partition("=")
+        if sep and name.strip():
+            rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+class Sampler(logging.Filter):
+    """Keeps a random ``rate`` share of a noisy logger's records below WARNING.
+
+    A rate applies to the named logger and its children (``"telegram"``
+    covers ``telegram.ext``); the most specific name wins.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = dict(rates)
+        self._resolved: Dict[str, Optional[float]] = {}
+
+    def _rate(self, name: str) -> Optional[float]:
+        rate = self._resolved.get(name, _UNSET)
+        if rate is not _UNSET:
+            return rate
+        rate, probe = None, name
+        while probe:
+            if probe in self.rates:
+                rate = self.rates[probe]
+                break
+            probe = probe.rpartition(".")[0]
+        self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        return rate is None or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread; drops (and counts) them when the queue is full."""
+
+    def __init__(self, q: "queue.Queue"):
+        super().__init__(q)
+        self.dropped = 0
+        self._traceback = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only what must be captured in the caller: the message, the traceback and the update fields.
+        # Formatting into JSON and writing happen on the writer thread.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._traceback.formatException(record.exc_info)
+            record.exc_info = None
+        fields = _fields.get()
+        if fields:
+            record.fields = dict(fields)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    def __init__(self, q: "queue.Queue", handler: logging.Handler, owner: _QueueHandler):
+        super().__init__(q, handler)
+        self.owner = owner
+        self._reported = 0
+
+    def enqueue_sentinel(self):
+        # Waits for room: the records queued before it must still be written.
+        self.queue.put(self._sentinel)
+
+    def handle(self, record: logging.LogRecord):
+        super().handle(record)
+        dropped = self.owner.dropped
+        if dropped != self._reported:
+            # Reported from this thread once the queue has room again.
+            note = logging.LogRecord(__name__, logging.WARNING, __file__, 0, "Log queue full: %s records dropped", (dropped - self._reported,), None)
+            self._reported = dropped
+            super().handle(note)
+
+
+def setup(
+    level: str = "INFO",
+    fmt: str = "json",
+    sample: str = "",
+    max_queue: int = 10000,
+    stream: Optional[TextIO] = None,
+):
+    """Route all logging through one queue and a writer thread (once per process).
+
+    ``fmt`` is ``"json"`` (one object per line) or ``"text"``; ``sample``
+    is a :func:`parse_sample` spec. Logging calls only append to the queue,
+    so a slow stderr never stalls the event loop; :func:`shutdown` (also run
+    at exit) writes out whatever is still queued.
+    """
+    global _handler, _listener
+    with _lock:
+        if _handler is not None:
+            return
+        q: "queue.Queue" = queue.Queue(max_queue)
+        _handler = _QueueHandler(q)
+        _handler.addFilter(Sampler(parse_sample(sample)))
+        out = logging.StreamHandler(stream or sys.stderr)
+        out.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+        root = logging.getLogger()
+        for old in root.handlers[:]:
+            root.removeHandler(old)
+        root.addHandler(_handler)
+        root.setLevel(level.upper())
+        _listener = _Listener(q, out, _handler)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def shutdown():
+    """Write out the queued records and stop the writer; later records go straight to stderr."""
+    global _handler, _listener
+    with _lock:
+        if _handler is None:
+            return
+        handler, listener, _handler, _listener = _handler, _listener, None, None
+        root = logging.getLogger()
+        root.removeHandler(handler)
+        listener.stop()
+        for out in listener.handlers:
+            out.flush()
+            root.addHandler(out)
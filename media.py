@@ -0,0 +1,160 @@
+# Media replies (week schedule, price list, club map): uploaded once, then re-sent by Telegram file_id.
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from telegram import Message
+from telegram.error import BadRequest
+
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+MEDIA_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media_cache (
+    digest TEXT NOT NULL,  -- sha256 of the content
+    kind TEXT NOT NULL,  -- 'photo' or 'document'
+    file_id TEXT NOT NULL,
+    filename TEXT,
+    updated_at TEXT NOT NULL,  -- last upload or use, refreshed at most daily
+    PRIMARY KEY (digest, kind)
+) WITHOUT ROWID;
+'''
+
+PHOTO_EXTENSIONS = frozenset({".jpg", ".jpeg", ".png", ".webp"})
+# Telegram's limit for photo/document captions.
+CAPTION_LIMIT = 1024
+# file_ids of content not sent for this long are forgotten (e.g. old week schedules).
+KEEP_DAYS = 90
+
+
+class Asset(NamedTuple):
+    kind: str  # 'photo' or 'document'
+    filename: str
+    data: bytes
+    digest: str
+
+    @classmethod
+    def make(cls, kind: str, filename: str, data: bytes) -> "Asset":
+        return cls(kind, filename, data, hashlib.sha256(data).hexdigest())
+
+
+def _read_asset(path: str) -> Asset:
+    with open(path, "rb") as f:
+        data = f.read()
+    kind = "photo" if os.path.splitext(path)[1].lower() in PHOTO_EXTENSIONS else "document"
+    return Asset.make(kind, os.path.basename(path), data)
+
+
+class MediaCache:
+    """Telegram ``file_id`` per asset content, kept in ``media_cache``.
+
+    The first reply with an asset uploads it; later ones send the stored
+    ``file_id``, so the bytes cross the network once per content. Changed
+    content has a new digest and is uploaded once more: a new schedule
+    version renders a new document, an edited file (new mtime or size) is
+    read again. Concurrent first replies share one upload, and a ``file_id``
+    Telegram rejects is dropped and the asset uploaded again.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._ids: Dict[Tuple[str, str], str] = {}
+        # Day each file_id was last marked as used in the table.
+        self._used: Dict[Tuple[str, str], date] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._files: Dict[str, Tuple[float, int, Asset]] = {}
+
+    def init_db(self):
+        self.db.executescript(MEDIA_SCHEMA)
+
+    def _load(self, since: str) -> List[Tuple[str, str, str, str]]:
+        conn = self.db.connect()
+        try:
+            return conn.execute(
+                "SELECT digest, kind, file_id, updated_at FROM media_cache WHERE updated_at >= ?", (since,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+    async def warm(self):
+        since = (datetime.utcnow() - timedelta(days=KEEP_DAYS)).isoformat()
+        rows = await asyncio.to_thread(self._load, since)
+        self._ids = {(digest, kind): file_id for digest, kind, file_id, _ in rows}
+        self._used = {(digest, kind): date.fromisoformat(used[:10]) for digest, kind, _, used in rows}
+        await self.db.execute("DELETE FROM media_cache WHERE updated_at < ?", (since,))
+
+    async def file(self, path: str) -> Optional[Asset]:
+        """The file at ``path`` as an asset (photo by extension, else document); ``None`` if missing."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        cached = self._files.get(path)
+        if cached is not None and cached[:2] == (st.st_mtime, st.st_size):
+            return cached[2]
+        asset = await asyncio.to_thread(_read_asset, path)
+        self._files[path] = (st.st_mtime, st.st_size, asset)
+        return asset
+
+    @staticmethod
+    async def _send(message: Message, asset: Asset, media, caption: Optional[str], kwargs: dict) -> Message:
+        if asset.kind == "photo":
+            return await message.reply_photo(media, caption=caption, filename=asset.filename, **kwargs)
+        return await message.reply_document(media, caption=caption, filename=asset.filename, **kwargs)
+
+    async def reply(self, message: Message, asset: Asset, caption: Optional[str] = None, **kwargs) -> Message:
+        """Reply to ``message`` with ``asset``; extra arguments go to ``reply_photo``/``reply_document``."""
+        if caption and len(caption) > CAPTION_LIMIT:
+            await message.reply_text(caption, **kwargs)
+            caption = None
+        key = (asset.digest, asset.kind)
+        file_id = self._ids.get(key)
+        if file_id is not None:
+            try:
+                sent = await self._send(message, asset, file_id, caption, kwargs)
+            except BadRequest as e:
+                logger.warning("Cached %s for %s rejected (%s); uploading it again", asset.kind, asset.filename, e)
+                if self._ids.get(key) == file_id:
+                    del self._ids[key]
+            else:
+                await self._touch(key)
+                return sent
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            file_id = self._ids.get(key)
+            if file_id is not None:
+                # Uploaded by a concurrent reply while this one waited.
+                return await self._send(message, asset, file_id, caption, kwargs)
+            sent = await self._send(message, asset, asset.data, caption, kwargs)
+            file_id = sent.photo[-1].file_id if asset.kind == "photo" else sent.document.file_id
+            self._ids[key] = file_id
+            self._used[key] = datetime.utcnow().date()
+            logger.info("Uploaded %s %s (%s bytes)", asset.kind, asset.filename, len(asset.data))
+        await self.db.execute(
+            "INSERT INTO media_cache (digest, kind, file_id, filename, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (digest, kind) DO UPDATE SET file_id = excluded.file_id, "
+            "filename = excluded.filename, updated_at = excluded.updated_at",
+            (asset.digest, asset.kind, file_id, asset.filename, datetime.utcnow().isoformat()),
+        )
+        return sent
+
+    async def _touch(self, key: Tuple[str, str]):
+        # An asset in daily use must not age out after KEEP_DAYS; one write per asset and day.
+        today = datetime.utcnow().date()
+        if self._used.get(key) == today:
+            return
+        self._used[key] = today
+        await self.db.execute(
+            "UPDATE media_cache SET updated_at = ? WHERE digest = ? AND kind = ?",
+            (datetime.utcnow().isoformat(), *key),
+        )
+
+    async def reply_file(self, message: Message, path: str, caption: Optional[str] = None, **kwargs) -> Optional[Message]:
+        """Like :meth:`reply` for a file on disk; ``None`` (nothing sent) when it does not exist."""
+        asset = await self.file(path)
+        if asset is None:
+            return None
+        return await self.reply(message, asset, caption, **kwargs)
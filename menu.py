@@ -0,0 +1,138 @@
+# Menu/content registry shared by both bots: loaded from menu.json, hot-reloaded on change.
+import asyncio
+import json
+import logging
+import os
+import re
+from typing import Dict, Mapping, NamedTuple, Optional
+
+from telegram import KeyboardButton, Message, ReplyKeyboardMarkup
+from telegram.ext import filters
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "menu.json")
+
+_NON_WORD = re.compile(r"[^\w ]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """Lookup key for a button label or typed text: lowercase, no emoji/punctuation."""
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", (text or "").lower())).strip()
+
+
+class MenuItem(NamedTuple):
+    label: str
+    text: Optional[str]  # rendered reply for static sections
+    action: Optional[str]  # name of a bot-side handler for dynamic sections
+    file: Optional[str] = None  # photo/PDF sent instead, with ``text`` as its caption, while it exists
+
+
+class Menu:
+    """One immutable load of the config: keyboard and replies are built once."""
+
+    def __init__(self, config: dict, variables: Mapping[str, str], base_dir: str = ""):
+        # A button is its label, or an object such as {"text": ..., "request_location": true}.
+        rows = [[KeyboardButton(**b) if isinstance(b, dict) else b for b in row] for row in config["keyboard"]]
+        self.keyboard = ReplyKeyboardMarkup(rows, resize_keyboard=True)
+        self._by_key: Dict[str, MenuItem] = {}
+        for raw in config["items"]:
+            text = raw.get("text")
+            item = MenuItem(
+                label=raw["label"],
+                text=text.format_map(variables) if text is not None else None,
+                action=raw.get("action"),
+                # Relative paths are resolved against the directory of menu.json.
+                file=os.path.join(base_dir, raw["file"]) if raw.get("file") else None,
+            )
+            if item.text is None and item.action is None:
+                raise ValueError(f"menu item {item.label!r} needs either text or action")
+            self._by_key[raw["label"]] = item
+            for alias in [raw["label"], *raw.get("aliases", [])]:
+                self._by_key.setdefault(normalize(alias), item)
+
+    def lookup(self, text: str) -> Optional[MenuItem]:
+        # Exact button text first (the common case), then the normalized form of typed text.
+        item = self._by_key.get(text)
+        if item is None:
+            item = self._by_key.get(normalize(text))
+        return item
+
+
+class _ActionFilter(filters.MessageFilter):
+    """Text messages that the current menu maps to ``action``: labels and aliases, reloads included."""
+
+    def __init__(self, registry: "MenuRegistry", action: str):
+        super().__init__(name=f"MenuAction({action!r})")
+        self.registry = registry
+        self.action = action
+
+    def filter(self, message: Message) -> bool:
+        item = self.registry.lookup(message.text) if message.text else None
+        return item is not None and item.action == self.action
+
+
+class MenuRegistry:
+    """Holds the current :class:`Menu` and swaps it when the config file changes."""
+
+    def __init__(self, path: str = DEFAULT_PATH, variables: Optional[Mapping[str, str]] = None, poll_interval: float = 5.0):
+        self.path = path
+        self.variables = dict(variables or {})
+        self.poll_interval = poll_interval
+        self._mtime: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self.menu = self._load()
+
+    def _load(self) -> Menu:
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, encoding="utf-8") as f:
+            menu = Menu(json.load(f), self.variables, os.path.dirname(os.path.abspath(self.path)))
+        self._mtime = mtime
+        return menu
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            self.menu = self._load()
+        except Exception:
+            # An invalid file keeps the previous menu in service until it is saved again.
+            logger.exception("Menu reload from %s failed; keeping the current menu", self.path)
+            self._mtime = mtime
+            return False
+        logger.info("Menu reloaded from %s", self.path)
+        return True
+
+    @property
+    def keyboard(self) -> ReplyKeyboardMarkup:
+        return self.menu.keyboard
+
+    def lookup(self, text: str) -> Optional[MenuItem]:
+        return self.menu.lookup(text)
+
+    def action_filter(self, action: str) -> filters.MessageFilter:
+        """Handler filter for the items with ``action``, e.g. a conversation's entry point."""
+        return _ActionFilter(self, action)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await asyncio.to_thread(self.reload_if_changed)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,319 @@
+# In-process metrics: handler/I-O latency histograms, error counters, conversation gauges, loop lag.
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from telegram.ext import Application, ApplicationHandlerStop, BaseHandler, ConversationHandler
+
+import logpipe
+from webhook import read_request, write_response
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans a cached menu reply (sub-ms) up to a slow Bot API round trip.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _label_str(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_label_str(self.labels, key)} {value:g}")
+        return lines
+
+
+class Gauge:
+    """Set directly, or computed at scrape time by ``collect`` returning ``{labels: value}``."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), collect: Optional[Callable[[], Dict[Labels, float]]] = None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.values: Dict[Labels, float] = {}
+
+    def set(self, value: float, *labels: str):
+        self.values[labels] = value
+
+    def current(self) -> Dict[Labels, float]:
+        if self.collect is None:
+            return self.values
+        try:
+            return self.collect()
+        except Exception:
+            logger.exception("Gauge %s collection failed", self.name)
+            return {}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self.current().items()):
+            lines.append(f"{self.name}{_label_str(self.labels, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram; ``observe`` is a bisect and two additions."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self.series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *labels: str) -> int:
+        series = self.series.get(labels)
+        return series[2] if series else 0
+
+    def quantile(self, q: float, *labels: str) -> Optional[float]:
+        """Upper bound of the bucket holding the ``q`` quantile (like ``histogram_quantile``)."""
+        series = self.series.get(labels)
+        if not series or not series[2]:
+            return None
+        rank = q * series[2]
+        seen = 0
+        for i, n in enumerate(series[0]):
+            seen += n
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = _label_str(self.labels, key, 'le="%g"' % bound)
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _label_str(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {total:g}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, key)} {count}")
+        return lines
+
+
+def _iter_handlers(handlers: Iterable[BaseHandler]) -> Iterable[BaseHandler]:
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield handler
+            nested = list(handler.entry_points) + list(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                nested.extend(state_handlers)
+            yield from _iter_handlers(nested)
+        else:
+            yield handler
+
+
+class Metrics:
+    """Metric set for one bot process.
+
+    ``instrument(app)`` wraps the callback of every registered handler
+    (conversation states included), ``timed(op)`` decorates async DB/e-mail
+    helpers. ``start()`` runs the event-loop lag probe and, when a port is
+    given, serves ``/metrics`` in the Prometheus text format.
+    """
+
+    def __init__(self, prefix: str = "xfit", lag_interval: float = 0.5):
+        self.prefix = prefix
+        self.lag_interval = lag_interval
+        self.handler_latency = Histogram(f"{prefix}_handler_latency_seconds", "Handler callback duration.", ("handler",))
+        self.handler_errors = Counter(f"{prefix}_handler_errors_total", "Handler callbacks that raised.", ("handler",))
+        self.io_latency = Histogram(f"{prefix}_io_latency_seconds", "DB and e-mail call duration.", ("op",))
+        self.io_errors = Counter(f"{prefix}_io_errors_total", "DB and e-mail calls that raised.", ("op",))
+        self.loop_lag = Histogram(
+            f"{prefix}_event_loop_lag_seconds", "Event-loop wake-up delay.",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+        )
+        self.conversations = Gauge(
+            f"{prefix}_conversations", "Open conversations by state.", ("conversation", "state"), collect=self._collect_conversations,
+        )
+        self.update_wait = Histogram(f"{prefix}_update_wait_seconds", "Time an update waited behind its chat and the concurrency cap.")
+        self.update_queue_depth = Gauge(f"{prefix}_update_queue_depth", "Updates queued or running in the scheduler.")
+        self.active_chats = Gauge(f"{prefix}_active_chats", "Chats with queued or running updates.")
+        self.outbox_dead_letters = Counter(f"{prefix}_outbox_dead_letters_total", "E-mails given up after the last attempt.")
+        self._conversation_handlers: List[ConversationHandler] = []
+        self._tasks: List[asyncio.Task] = []
+        self._server: Optional[asyncio.base_events.Server] = None
+
+    # --- instrumentation ---
+    def _wrap(self, name: str, callback):
+        observe = self.handler_latency.observe
+        errors = self.handler_errors
+
+        @functools.wraps(callback)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            # Names the handler in the update's log records.
+            logpipe.annotate(handler=name)
+            try:
+                return await callback(*args, **kwargs)
+            except ApplicationHandlerStop:
+                raise
+            except Exception:
+                errors.inc(name)
+                raise
+            finally:
+                observe(time.perf_counter() - start, name)
+
+        wrapper.__metrics_wrapped__ = True
+        return wrapper
+
+    def instrument(self, app: Application):
+        for handlers in app.handlers.values():
+            for handler in _iter_handlers(handlers):
+                if isinstance(handler, ConversationHandler):
+                    self._conversation_handlers.append(handler)
+                    continue
+                callback = handler.callback
+                if getattr(callback, "__metrics_wrapped__", False):
+                    continue
+                handler.callback = self._wrap(getattr(callback, "__name__", type(handler).__name__), callback)
+
+    def timed(self, op: str):
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    self.io_errors.inc(op)
+                    raise
+                finally:
+                    self.io_latency.observe(time.perf_counter() - start, op)
+            return wrapper
+        return decorator
+
+    def _collect_conversations(self) -> Dict[Labels, float]:
+        counts: Dict[Labels, float] = {}
+        for handler in self._conversation_handlers:
+            # PTB keeps no public view of the open conversations.
+            for state in getattr(handler, "_conversations", {}).values():
+                key = (handler.name or "conversation", str(state))
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    # --- output ---
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in (
+            self.handler_latency, self.handler_errors, self.io_latency, self.io_errors, self.loop_lag,
+            self.update_wait, self.update_queue_depth, self.active_chats, self.conversations,
+            self.outbox_dead_letters,
+        ):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Short human-readable digest for the admin /stats command."""
+
+        def ms(value: Optional[float]) -> str:
+            if value is None:
+                return "—"
+            return "∞" if value == float("inf") else f"≤{value * 1000:g}мс"
+
+        lines = ["📊 Обработчики (вызовов, p50, p95, ошибок):"]
+        for (name,) in sorted(self.handler_latency.series):
+            lines.append(
+                f"• {name}: {self.handler_latency.count(name)}, {ms(self.handler_latency.quantile(0.5, name))}, "
+                f"{ms(self.handler_latency.quantile(0.95, name))}, {int(self.handler_errors.values.get((name,), 0))}"
+            )
+        if self.io_latency.series:
+            lines.append("")
+            lines.append("💾 БД и почта (вызовов, p95, ошибок):")
+            for (op,) in sorted(self.io_latency.series):
+                lines.append(
+                    f"• {op}: {self.io_latency.count(op)}, {ms(self.io_latency.quantile(0.95, op))}, "
+                    f"{int(self.io_errors.values.get((op,), 0))}"
+                )
+        lines.append("")
+        lines.append(f"⏱ Задержка event loop: p99 {ms(self.loop_lag.quantile(0.99))}")
+        lines.append(
+            f"📥 Очередь апдейтов: {int(self.update_queue_depth.values.get((), 0))}, "
+            f"ожидание p95 {ms(self.update_wait.quantile(0.95))}"
+        )
+        dead = int(self.outbox_dead_letters.values.get((), 0))
+        if dead:
+            lines.append(f"📮 Письма, не отправленные после всех попыток: {dead} (см. email_outbox.last_error)")
+        conversations = self._collect_conversations()
+        if conversations:
+            lines.append("💬 Открытые диалоги: " + ", ".join(f"{name}/{state}: {int(n)}" for (name, state), n in sorted(conversations.items())))
+        return "\n".join(lines)
+
+    # --- background work ---
+    async def _probe_lag(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag.observe(max(0.0, time.perf_counter() - start - self.lag_interval))
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await read_request(reader)
+            if request is None:
+                return
+            method, path, _, _ = request
+            if method == "GET" and path.split("?", 1)[0] == "/metrics":
+                write_response(writer, 200, self.render().encode("utf-8"), content_type=CONTENT_TYPE)
+            else:
+                write_response(writer, 404)
+            await writer.drain()
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        """Start the lag probe; also serve ``/metrics`` on ``host:port`` unless ``port`` is 0."""
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.create_task(self._probe_lag()))
+        if port:
+            self._server = await asyncio.start_server(self._serve, host, port)
+            logger.info("Metrics on http://%s:%s/metrics", host, port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
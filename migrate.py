@@ -0,0 +1,194 @@
+# One-off migration of legacy leads (e.g. bot-2.py's guest_requests) into another lead table.
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from db import connect
+from export import iter_chunks
+from leads import normalize_phone, parse_created_at
+from snapshot import Snapshot
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS migration_checkpoint (
+    source TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL,
+    copied INTEGER NOT NULL,
+    skipped INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+)
+'''
+
+# SQLite's default limit on bound parameters is 999 in older builds.
+IN_CHUNK = 500
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    columns = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+    if not columns:
+        raise ValueError(f"table {table} does not exist")
+    return columns
+
+
+class Migration:
+    """Copies ``source_table`` rows into ``target_table``, chunk by chunk, resumably.
+
+    Phones are normalized with :func:`leads.normalize_phone`. A row is a
+    duplicate when the target (or an earlier row of the same chunk) already
+    has a lead with that phone within ``window`` seconds. Each chunk is one
+    ``executemany`` plus the checkpoint update in a single short
+    transaction, so the live bot's writer only waits for one chunk at a time
+    and an interrupted run continues after the last committed chunk.
+    With ``snapshot`` (a file path) a live source is first copied there by
+    :class:`snapshot.Snapshot` and read from the copy.
+    """
+
+    def __init__(
+        self,
+        source_path: str,
+        target_path: str,
+        source_table: str = "guest_requests",
+        target_table: str = "guest_visits",
+        chunk_size: int = 5000,
+        window: float = 24 * 3600,
+        pause: float = 0.0,
+        snapshot: Optional[str] = None,
+    ):
+        self.source_path = source_path
+        self.target_path = target_path
+        self.source_table = source_table
+        self.target_table = target_table
+        self.chunk_size = chunk_size
+        self.window = window
+        self.pause = pause
+        self.snapshot = snapshot
+        self.key = f"{os.path.abspath(source_path)}:{source_table}->{target_table}"
+
+    def _open_target(self) -> sqlite3.Connection:
+        conn = connect(self.target_path)
+        conn.isolation_level = None
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(CHECKPOINT_SCHEMA)
+        return conn
+
+    def checkpoint(self, conn: sqlite3.Connection) -> Tuple[int, int, int]:
+        row = conn.execute(
+            "SELECT last_id, copied, skipped FROM migration_checkpoint WHERE source = ?", (self.key,)
+        ).fetchone()
+        return row or (0, 0, 0)
+
+    def _existing(self, conn: sqlite3.Connection, phones: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        for i in range(0, len(phones), IN_CHUNK):
+            part = phones[i:i + IN_CHUNK]
+            marks = ",".join("?" * len(part))
+            for phone, created_at in conn.execute(
+                f"SELECT phone, created_at FROM {self.target_table} WHERE phone IN ({marks})", part
+            ):
+                if created_at:
+                    found.setdefault(phone, []).append(parse_created_at(created_at))
+        return found
+
+    def _prepare(self, target: sqlite3.Connection, columns: List[str], insert_columns: List[str], rows: list) -> Tuple[list, int]:
+        src = {name: i for i, name in enumerate(columns)}
+        prepared = []
+        for row in rows:
+            values = {name: row[src[name]] for name in insert_columns}
+            values["phone"] = normalize_phone(values["phone"]) or values["phone"]
+            prepared.append(values)
+
+        seen = self._existing(target, sorted({v["phone"] for v in prepared if v["phone"]}))
+        out, skipped = [], 0
+        for values in prepared:
+            phone, created_at = values["phone"], values.get("created_at")
+            if phone and created_at:
+                ts = parse_created_at(created_at)
+                if any(abs(ts - other) <= self.window for other in seen.get(phone, ())):
+                    skipped += 1
+                    continue
+                seen.setdefault(phone, []).append(ts)
+            out.append(tuple(values[name] for name in insert_columns))
+        return out, skipped
+
+    def run(self, dry_run: bool = False) -> Tuple[int, int, int]:
+        """Migrate what is left; returns ``(last_id, copied, skipped)``."""
+        source_path = self.source_path
+        if self.snapshot:
+            snap = Snapshot(self.source_path, self.snapshot, [self.source_table])
+            snap.refresh()
+            source_path = snap.path
+        source = sqlite3.connect(f"file:{os.path.abspath(source_path)}?mode=ro", uri=True)
+        target = self._open_target()
+        try:
+            columns = _columns(source, self.source_table)
+            target_columns = _columns(target, self.target_table)
+            insert_columns = [c for c in target_columns if c != "id" and c in columns]
+            if "phone" not in insert_columns:
+                raise ValueError("both tables need a phone column")
+            insert_sql = (
+                f"INSERT INTO {self.target_table} ({', '.join(insert_columns)}) "
+                f"VALUES ({', '.join('?' * len(insert_columns))})"
+            )
+            last_id, copied, skipped = self.checkpoint(target)
+            started = time.monotonic()
+            for rows in iter_chunks(source, self.source_table, last_id, self.chunk_size):
+                target.execute("BEGIN IMMEDIATE")
+                try:
+                    batch, dupes = self._prepare(target, columns, insert_columns, rows)
+                    if not dry_run:
+                        target.executemany(insert_sql, batch)
+                    last_id = rows[-1][0]
+                    copied += len(batch)
+                    skipped += dupes
+                    target.execute(
+                        "INSERT INTO migration_checkpoint (source, last_id, copied, skipped, updated_at) VALUES (?,?,?,?,?) "
+                        "ON CONFLICT(source) DO UPDATE SET last_id = excluded.last_id, copied = excluded.copied, "
+                        "skipped = excluded.skipped, updated_at = excluded.updated_at",
+                        (self.key, last_id, copied, skipped, datetime.utcnow().isoformat() + "Z"),
+                    )
+                    target.execute("ROLLBACK" if dry_run else "COMMIT")
+                except BaseException:
+                    if target.in_transaction:
+                        target.execute("ROLLBACK")
+                    raise
+                elapsed = time.monotonic() - started
+                logger.info("up to #%s: %s copied, %s duplicates (%.0f rows/s)", last_id, copied, skipped, (copied + skipped) / max(elapsed, 1e-9))
+                if self.pause:
+                    time.sleep(self.pause)
+            return last_id, copied, skipped
+        finally:
+            source.close()
+            target.close()
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Move legacy leads into another lead table (resumable).")
+    parser.add_argument("source_db", help="e.g. guest_visits.db (bot-2.py)")
+    parser.add_argument("target_db", help="e.g. guest_visits.sqlite3 (bot.py), must already have the target table")
+    parser.add_argument("--source-table", default="guest_requests")
+    parser.add_argument("--target-table", default="guest_visits")
+    parser.add_argument("--chunk", type=int, default=5000, help="rows per transaction")
+    parser.add_argument("--window-hours", type=float, default=24, help="same phone within this window is a duplicate")
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between chunks")
+    parser.add_argument("--snapshot", help="copy a live source DB to this file first and read the copy")
+    parser.add_argument("--dry-run", action="store_true", help="count what would be copied, write nothing")
+    opts = parser.parse_args(argv)
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+
+    migration = Migration(
+        opts.source_db, opts.target_db, opts.source_table, opts.target_table,
+        chunk_size=opts.chunk, window=opts.window_hours * 3600, pause=opts.pause, snapshot=opts.snapshot,
+    )
+    last_id, copied, skipped = migration.run(dry_run=opts.dry_run)
+    print(f"{'would copy' if opts.dry_run else 'copied'} {copied}, duplicates {skipped}, source up to #{last_id}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+# Persistent e-mail outbox: handlers enqueue, a background worker sends.
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple
+
+from db import Database
+
+# smtplib, email and mimetypes are imported when the first message is built or sent:
+# a bot that never e-mails (or not right after a restart) doesn't load them at startup.
+if TYPE_CHECKING:
+    import smtplib
+    from email.message import EmailMessage
+
+    from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TEXT NOT NULL,
+    sent_at TEXT,
+    attachment_name TEXT,
+    attachment BLOB
+);
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (sent_at, next_attempt_at);
+'''
+
+
+class SmtpPool:
+    """A single authenticated SMTP connection, reused between messages.
+
+    ``security`` is one of ``"starttls"``, ``"ssl"`` or ``"none"`` (plain
+    SMTP, e.g. a local stand-in server such as ``aiosmtpd``). A reused
+    connection is checked with a NOOP before each message and replaced if
+    it is gone, so nothing has been sent yet when it reconnects. A failure
+    during the send itself is not retried here: the server may already
+    have accepted the message.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        security: str = "starttls",
+        timeout: float = 30.0,
+        idle_timeout: float = 120.0,
+    ):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.security = security
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._conn: Optional["smtplib.SMTP"] = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> "smtplib.SMTP":
+        import smtplib
+
+        if self.security == "ssl":
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.security == "starttls":
+                conn.starttls()
+        if self.user and self.password:
+            conn.login(self.user, self.password)
+        return conn
+
+    def _get(self) -> "smtplib.SMTP":
+        import smtplib
+
+        if self._conn is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            # Servers drop idle sessions; don't wait on a probe of a likely half-closed socket.
+            self._drop()
+        if self._conn is not None:
+            try:
+                if self._conn.noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected("NOOP failed")
+            except (smtplib.SMTPException, OSError):
+                self._drop()
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _drop(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def send(self, msg: "EmailMessage"):
+        import smtplib
+
+        with self._lock:
+            conn = self._get()
+            try:
+                conn.send_message(msg)
+            except (smtplib.SMTPException, OSError):
+                # No resend on a new connection: if DATA went through before the socket
+                # died, that would deliver the message twice. The outbox retries later.
+                self._drop()
+                raise
+            self._last_used = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.quit()
+                except Exception:
+                    pass
+                self._conn = None
+
+
+class Outbox:
+    """``email_outbox`` table in the bot's SQLite DB plus the asyncio worker draining it.
+
+    Failed sends are retried with backoff up to ``max_attempts``; a message
+    that still fails then is logged as an error, counted in
+    ``metrics.outbox_dead_letters`` and left in the table with its last
+    error. Delivery is at least once: a send that failed after the server
+    had taken the message is sent again.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        pool: SmtpPool,
+        sender: str,
+        max_attempts: int = 8,
+        base_delay: float = 5.0,
+        max_delay: float = 900.0,
+        poll_interval: float = 30.0,
+        batch_size: int = 20,
+        metrics: Optional["Metrics"] = None,
+    ):
+        self.db = db
+        self.pool = pool
+        self.sender = sender
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.metrics = metrics
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def init_db(self):
+        self.db.executescript(OUTBOX_SCHEMA)
+        conn = self.db.connect()
+        try:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(email_outbox)")}
+            # Outboxes created before attachments existed.
+            if "attachment" not in columns:
+                conn.execute("ALTER TABLE email_outbox ADD COLUMN attachment_name TEXT")
+                conn.execute("ALTER TABLE email_outbox ADD COLUMN attachment BLOB")
+                conn.commit()
+        finally:
+            conn.close()
+
+    async def enqueue(
+        self,
+        recipient: str,
+        subject: str,
+        body: str,
+        attachment: Optional[Tuple[str, bytes]] = None,
+        also: Sequence[Tuple[str, Sequence]] = (),
+    ) -> int:
+        """Queue a message; ``also`` are extra writes committed atomically with it."""
+        name, data = attachment or (None, None)
+        ids = await self.db.execute_all([
+            (
+                "INSERT INTO email_outbox (recipient, subject, body, attachment_name, attachment, created_at) "
+                "VALUES (?,?,?,?,?,?)",
+                (recipient, subject, body, name, data, datetime.utcnow().isoformat() + "Z"),
+            ),
+            *also,
+        ])
+        self.wake()
+        return int(ids[0])
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    # --- worker ---
+    def _due(self) -> List[tuple]:
+        conn = self.db.connect()
+        try:
+            return conn.execute(
+                "SELECT id, recipient, subject, body, attempts, attachment_name, attachment FROM email_outbox "
+                "WHERE sent_at IS NULL AND attempts < ? AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (self.max_attempts, time.time(), self.batch_size),
+            ).fetchall()
+        finally:
+            conn.close()
+
+    async def _mark(self, outbox_id: int, attempts: int, error: Optional[str]):
+        if error is None:
+            await self.db.execute(
+                "UPDATE email_outbox SET sent_at = ?, attempts = ?, last_error = NULL WHERE id = ?",
+                (datetime.utcnow().isoformat() + "Z", attempts, outbox_id),
+            )
+        else:
+            delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+            await self.db.execute(
+                "UPDATE email_outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, time.time() + delay, error[:500], outbox_id),
+            )
+
+    def _build(self, recipient: str, subject: str, body: str, attachment_name: Optional[str] = None, attachment: Optional[bytes] = None) -> "EmailMessage":
+        import mimetypes
+        from email.message import EmailMessage
+
+        msg = EmailMessage()
+        msg["From"] = self.sender
+        msg["To"] = recipient
+        msg["Subject"] = subject
+        msg.set_content(body)
+        if attachment_name:
+            maintype, _, subtype = (mimetypes.guess_type(attachment_name)[0] or "application/octet-stream").partition("/")
+            msg.add_attachment(attachment, maintype=maintype, subtype=subtype, filename=attachment_name)
+        return msg
+
+    async def drain(self) -> int:
+        """Send everything currently due; returns the number of messages sent."""
+        sent = 0
+        while True:
+            rows = await asyncio.to_thread(self._due)
+            if not rows:
+                return sent
+            for outbox_id, recipient, subject, body, attempts, attachment_name, attachment in rows:
+                try:
+                    msg = self._build(recipient, subject, body, attachment_name, attachment)
+                    await asyncio.to_thread(self.pool.send, msg)
+                except Exception as e:
+                    await self._mark(outbox_id, attempts + 1, str(e))
+                    if attempts + 1 >= self.max_attempts:
+                        logger.error(
+                            "Outbox #%s to %s (%r) given up after %s attempts: %s",
+                            outbox_id, recipient, subject, attempts + 1, e,
+                        )
+                        if self.metrics is not None:
+                            self.metrics.outbox_dead_letters.inc()
+                    else:
+                        logger.warning("Outbox #%s send failed (attempt %s): %s", outbox_id, attempts + 1, e)
+                    # The server is likely unhealthy; back off instead of hammering it.
+                    return sent
+                await self._mark(outbox_id, attempts + 1, None)
+                sent += 1
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                await self.drain()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Outbox worker iteration failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        self.init_db()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.pool.close)
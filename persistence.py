@@ -0,0 +1,213 @@
+# Conversation / user_data persistence in the bot's SQLite DB, written behind the handlers.
+import asyncio
+import json
+import logging
+from typing import Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS persistence_user_data (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS persistence_chat_data (
+    chat_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS persistence_bot_data (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS persistence_conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+);
+'''
+
+_DELETE = object()
+
+
+class SQLitePersistence(BasePersistence):
+    """``BasePersistence`` backed by tables in the existing lead DB.
+
+    The application hands changes over every ``update_interval`` seconds;
+    they are only serialized into in-memory buffers here. A background
+    flush then writes all buffered rows through the shared writer thread as
+    one group commit, so handlers never wait on disk. ``flush()`` at
+    shutdown writes whatever is still buffered. Data is stored as JSON.
+    """
+
+    def __init__(self, db: Database, update_interval: float = 5.0, flush_delay: float = 0.2):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self.flush_delay = flush_delay
+        self._loaded = False
+        self._conversations: Dict[str, Dict[Tuple, object]] = {}
+        self._written_bot_data: Optional[str] = None
+        # Pending writes: key -> serialized value or _DELETE
+        self._users: Dict[int, object] = {}
+        self._chats: Dict[int, object] = {}
+        self._bot_data: Optional[str] = None
+        self._states: Dict[Tuple[str, str], object] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _load_all(self):
+        if self._loaded:
+            return
+        self.db.executescript(PERSISTENCE_SCHEMA)
+        conn = self.db.connect()
+        try:
+            for name, key, state in conn.execute("SELECT name, key, state FROM persistence_conversations"):
+                self._conversations.setdefault(name, {})[tuple(json.loads(key))] = json.loads(state)
+            row = conn.execute("SELECT data FROM persistence_bot_data WHERE id = 1").fetchone()
+            self._written_bot_data = row[0] if row else None
+        finally:
+            conn.close()
+        self._loaded = True
+
+    def _read_table(self, table: str, key: str) -> dict:
+        self._load_all()
+        conn = self.db.connect()
+        try:
+            return {row[0]: json.loads(row[1]) for row in conn.execute(f"SELECT {key}, data FROM {table}")}
+        finally:
+            conn.close()
+
+    # --- loading (once, during Application.initialize) ---
+    async def get_user_data(self) -> Dict[int, dict]:
+        return await asyncio.to_thread(self._read_table, "persistence_user_data", "user_id")
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return await asyncio.to_thread(self._read_table, "persistence_chat_data", "chat_id")
+
+    async def get_bot_data(self) -> dict:
+        await asyncio.to_thread(self._load_all)
+        return json.loads(self._written_bot_data) if self._written_bot_data else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple, object]:
+        await asyncio.to_thread(self._load_all)
+        return dict(self._conversations.get(name, {}))
+
+    # --- buffering ---
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        self._states[(name, json.dumps(list(key)))] = _DELETE if new_state is None else json.dumps(new_state)
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._users[user_id] = json.dumps(data, ensure_ascii=False, default=str)
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._chats[chat_id] = json.dumps(data, ensure_ascii=False, default=str)
+        self._schedule_flush()
+
+    async def update_bot_data(self, data: dict) -> None:
+        serialized = json.dumps(data, ensure_ascii=False, default=str)
+        # bot_data is handed over on every run; skip the write when nothing changed.
+        if serialized != self._written_bot_data:
+            self._bot_data = serialized
+            self._schedule_flush()
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._users[user_id] = _DELETE
+        self._schedule_flush()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._chats[chat_id] = _DELETE
+        self._schedule_flush()
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    # --- writing ---
+    async def _write_pending(self):
+        users, self._users = self._users, {}
+        chats, self._chats = self._chats, {}
+        states, self._states = self._states, {}
+        bot_data, self._bot_data = self._bot_data, None
+
+        futures = []
+
+        def table_writes(table: str, key: str, pending: Dict[int, object]):
+            upserts = [(k, v) for k, v in pending.items() if v is not _DELETE]
+            deletes = [(k,) for k, v in pending.items() if v is _DELETE]
+            if upserts:
+                futures.append(self.db.submit_many(
+                    f"INSERT INTO {table} ({key}, data) VALUES (?, ?) "
+                    f"ON CONFLICT({key}) DO UPDATE SET data = excluded.data", upserts))
+            if deletes:
+                futures.append(self.db.submit_many(f"DELETE FROM {table} WHERE {key} = ?", deletes))
+
+        table_writes("persistence_user_data", "user_id", users)
+        table_writes("persistence_chat_data", "chat_id", chats)
+        state_upserts = [(n, k, v) for (n, k), v in states.items() if v is not _DELETE]
+        state_deletes = [(n, k) for (n, k), v in states.items() if v is _DELETE]
+        if state_upserts:
+            futures.append(self.db.submit_many(
+                "INSERT INTO persistence_conversations (name, key, state) VALUES (?, ?, ?) "
+                "ON CONFLICT(name, key) DO UPDATE SET state = excluded.state", state_upserts))
+        if state_deletes:
+            futures.append(self.db.submit_many(
+                "DELETE FROM persistence_conversations WHERE name = ? AND key = ?", state_deletes))
+        if bot_data is not None:
+            futures.append(self.db.submit(
+                "INSERT INTO persistence_bot_data (id, data) VALUES (1, ?) "
+                "ON CONFLICT(id) DO UPDATE SET data = excluded.data", (bot_data,)))
+        # Submitted back to back, these land in the same group commit.
+        try:
+            if futures:
+                await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        except BaseException:
+            # Put the batch back for the next flush; changes buffered meanwhile are newer and win.
+            self._users = {**users, **self._users}
+            self._chats = {**chats, **self._chats}
+            self._states = {**states, **self._states}
+            if self._bot_data is None:
+                self._bot_data = bot_data
+            raise
+        if bot_data is not None:
+            self._written_bot_data = bot_data
+
+    def _has_pending(self) -> bool:
+        return bool(self._users or self._chats or self._states or self._bot_data is not None)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        while self._has_pending():
+            try:
+                await self._write_pending()
+            except Exception:
+                logger.exception("Persistence flush failed")
+                return
+
+    async def flush(self) -> None:
+        if self._flush_task is not None:
+            await self._flush_task
+        while self._has_pending():
+            await self._write_pending()
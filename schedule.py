@@ -0,0 +1,402 @@
+# Schedule engine: background CSV refresh into an in-memory per-day index.
+import asyncio
+import bisect
+import csv
+import html
+import io
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Set, Tuple
+from urllib.parse import urlparse
+
+if TYPE_CHECKING:
+    import requests
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y")
+
+# --- search query words ---
+_TOKEN = re.compile(r"[\w:.-]+")
+_TIME = re.compile(r"^\d{1,2}(:\d{0,2})?$")
+_DAY_MONTH = re.compile(r"^(\d{1,2})\.(\d{1,2})\.?$")
+STOP_WORDS = frozenset({"в", "во", "на", "с", "со", "к", "у", "по", "и", "для", "что", "где", "когда", "есть"})
+RELATIVE_DAYS = {"сегодня": 0, "завтра": 1, "послезавтра": 2}
+WEEK_WORDS = frozenset({"неделя", "неделю", "неделе", "week"})
+WEEKDAY_WORDS = {
+    word: i
+    for i, words in enumerate([
+        ("пн", "пнд", "понедельник"),
+        ("вт", "вторник"),
+        ("ср", "среда", "среду"),
+        ("чт", "четверг"),
+        ("пт", "пятница", "пятницу"),
+        ("сб", "суббота", "субботу"),
+        ("вс", "воскресенье"),
+    ])
+    for word in words
+}
+# Days searched when the query names none.
+DEFAULT_SEARCH_DAYS = 7
+
+
+class Lesson(NamedTuple):
+    day: date
+    time: str
+    title: str
+    coach: str
+    hall: str
+    notes: str
+
+
+def parse_date(value: str) -> Optional[date]:
+    value = (value or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def time_key(value: str) -> Tuple[int, int, str]:
+    """Sort key for a lesson time: ``9:00`` before ``10:30``; unparseable times go last."""
+    hours, sep, minutes = value.replace(".", ":").partition(":")
+    if hours.strip().isdigit() and (not sep or minutes.strip()[:2].isdigit()):
+        return int(hours), int(minutes.strip()[:2] or 0), value
+    return 24, 0, value
+
+
+def parse_csv(text: str) -> Dict[date, Tuple[Lesson, ...]]:
+    """Parse the published sheet (``date, time, class, coach, hall, notes``) into a per-day index."""
+    reader = csv.DictReader(io.StringIO(text))
+    reader.fieldnames = [(name or "").strip().lower() for name in reader.fieldnames or []]
+    days: Dict[date, List[Lesson]] = {}
+    skipped = 0
+    for row in reader:
+        day = parse_date(row.get("date") or "")
+        if day is None:
+            skipped += 1
+            continue
+        days.setdefault(day, []).append(
+            Lesson(
+                day=day,
+                time=(row.get("time") or "").strip(),
+                title=(row.get("class") or "").strip(),
+                coach=(row.get("coach") or "").strip(),
+                hall=(row.get("hall") or "").strip(),
+                notes=(row.get("notes") or "").strip(),
+            )
+        )
+    if skipped:
+        logger.warning("Schedule: skipped %s rows with unparseable dates", skipped)
+    return {day: tuple(sorted(lessons, key=lambda l: time_key(l.time))) for day, lessons in days.items()}
+
+
+def format_lesson(lesson: Lesson) -> str:
+    line = f"{lesson.time} {lesson.title}"
+    if lesson.coach:
+        line += f" — {lesson.coach}"
+    if lesson.hall:
+        line += f" ({lesson.hall})"
+    if lesson.notes:
+        line += f". {lesson.notes}"
+    return line
+
+
+def format_day_header(day: date) -> str:
+    return f"{WEEKDAYS[day.weekday()]} {day.strftime('%d.%m')}"
+
+
+def format_html(title: str, days: Sequence[Tuple[date, Sequence[Lesson]]]) -> str:
+    """Self-contained HTML page with one table per day, for sending as a document."""
+    esc = html.escape
+    parts = [
+        '<!DOCTYPE html>\n<html lang="ru"><head><meta charset="utf-8">',
+        '<meta name="viewport" content="width=device-width, initial-scale=1">',
+        f"<title>{esc(title)}</title><style>",
+        "body{font-family:sans-serif;margin:16px;color:#222}h1{font-size:20px}",
+        "h2{font-size:16px;margin:20px 0 6px}table{border-collapse:collapse;width:100%}",
+        "td{border-top:1px solid #ddd;padding:6px;vertical-align:top}",
+        "td.time{white-space:nowrap;font-weight:bold;width:1%}.note{color:#666;font-size:90%}",
+        f"</style></head><body><h1>{esc(title)}</h1>",
+    ]
+    for day, lessons in days:
+        parts.append(f"<h2>{esc(format_day_header(day))}</h2><table>")
+        for l in lessons:
+            details = " · ".join(esc(v) for v in (l.coach, l.hall, l.notes) if v)
+            note = f'<br><span class="note">{details}</span>' if details else ""
+            parts.append(f'<tr><td class="time">{esc(l.time)}</td><td>{esc(l.title)}{note}</td></tr>')
+        parts.append("</table>")
+    if not days:
+        parts.append("<p>Занятий нет</p>")
+    parts.append("</body></html>\n")
+    return "\n".join(parts)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t.strip(".-") for t in _TOKEN.findall((text or "").lower().replace("ё", "е")) if t.strip(".-")]
+
+
+class ScheduleIndex:
+    """Inverted index over class, coach and hall words, plus per-day ranges.
+
+    Lessons are numbered in (day, time) order, so a day is a contiguous
+    range and sorted postings come out chronologically. Query words match
+    indexed words by prefix ("кросс" finds "кроссфит").
+    """
+
+    def __init__(self, days: Dict[date, Tuple[Lesson, ...]]):
+        self.lessons: List[Lesson] = []
+        self.day_ranges: Dict[date, Tuple[int, int]] = {}
+        postings: Dict[str, Set[int]] = {}
+        for day in sorted(days):
+            start = len(self.lessons)
+            for lesson in days[day]:
+                n = len(self.lessons)
+                self.lessons.append(lesson)
+                for token in tokenize(f"{lesson.title} {lesson.coach} {lesson.hall}"):
+                    postings.setdefault(token, set()).add(n)
+            self.day_ranges[day] = (start, len(self.lessons))
+        self.vocabulary = sorted(postings)
+        self.postings: Dict[str, FrozenSet[int]] = {t: frozenset(ids) for t, ids in postings.items()}
+
+    def matching(self, prefix: str) -> Set[int]:
+        found: Set[int] = set()
+        i = bisect.bisect_left(self.vocabulary, prefix)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(prefix):
+            found |= self.postings[self.vocabulary[i]]
+            i += 1
+        return found
+
+    def search(self, words: Sequence[str], days: Sequence[date], time_prefix: str = "") -> List[Lesson]:
+        ids: Optional[Set[int]] = None
+        for word in sorted(words, key=len, reverse=True):  # longer prefixes match less, so intersect them first
+            found = self.matching(word)
+            ids = found if ids is None else ids & found
+            if not ids:
+                return []
+        ordered = sorted(ids) if ids is not None else None
+        lessons: List[Lesson] = []
+        for day in sorted(set(days)):
+            start, end = self.day_ranges.get(day, (0, 0))
+            if ordered is None:
+                lessons.extend(self.lessons[start:end])
+            else:
+                lo, hi = bisect.bisect_left(ordered, start), bisect.bisect_left(ordered, end)
+                lessons.extend(self.lessons[n] for n in ordered[lo:hi])
+        if time_prefix:
+            lessons = [l for l in lessons if l.time.startswith(time_prefix) or l.time.zfill(5).startswith(time_prefix)]
+        return lessons
+
+
+def parse_query(query: str, today: date, index: Optional[ScheduleIndex] = None) -> Tuple[List[str], List[date], str]:
+    """Split a search query into index words, the days it names and an optional time prefix.
+
+    A bare number is a word if ``index`` has it (e.g. "зал 2"), else an hour.
+    """
+    words: List[str] = []
+    days: List[date] = []
+    time_prefix = ""
+    for token in tokenize(query):
+        if token in RELATIVE_DAYS:
+            days.append(today + timedelta(days=RELATIVE_DAYS[token]))
+        elif token in WEEKDAY_WORDS:
+            days.append(today + timedelta(days=(WEEKDAY_WORDS[token] - today.weekday()) % 7))
+        elif token in WEEK_WORDS:
+            days.extend(today + timedelta(days=i) for i in range(7))
+        elif _TIME.match(token) and not (index is not None and token in index.postings):
+            time_prefix = token if ":" in token else token.zfill(2)
+        elif _DAY_MONTH.match(token):
+            d, m = (int(x) for x in _DAY_MONTH.match(token).groups())
+            try:
+                day = date(today.year, m, d)
+            except ValueError:
+                continue
+            days.append(day if day >= today - timedelta(days=180) else date(today.year + 1, m, d))
+        elif parse_date(token) is not None:
+            days.append(parse_date(token))
+        elif token not in STOP_WORDS:
+            words.append(token)
+    if not days:
+        days = [today + timedelta(days=i) for i in range(DEFAULT_SEARCH_DAYS)]
+    return words, days, time_prefix
+
+
+class ScheduleSnapshot:
+    """Immutable parsed schedule; rendered day texts, documents and search results are memoized."""
+
+    def __init__(self, days: Dict[date, Tuple[Lesson, ...]], version: int = 0, search_cache: int = 1024):
+        self.days = days
+        self.version = version
+        self.loaded_at = time.time()
+        self.index = ScheduleIndex(days)
+        self.search_cache = search_cache
+        self._rendered: Dict[date, str] = {}
+        self._documents: Dict[Tuple[date, int, str], bytes] = {}
+        self._found: "OrderedDict[Tuple[date, str], Tuple[Lesson, ...]]" = OrderedDict()
+
+    def __bool__(self) -> bool:
+        return bool(self.days)
+
+    def lessons(self, day: date) -> Tuple[Lesson, ...]:
+        return self.days.get(day, ())
+
+    def render_day(self, day: date) -> str:
+        text = self._rendered.get(day)
+        if text is None:
+            lessons = self.lessons(day)
+            lines = [format_day_header(day)]
+            lines.extend(format_lesson(l) for l in lessons)
+            if not lessons:
+                lines.append("Занятий нет")
+            text = self._rendered[day] = "\n".join(lines)
+        return text
+
+    def render_range(self, start: date, days: int) -> str:
+        blocks = [self.render_day(start + timedelta(days=i)) for i in range(days)
+                  if self.lessons(start + timedelta(days=i))]
+        return "\n\n".join(blocks)
+
+    def render_html(self, start: date, days: int, title: str) -> bytes:
+        """:func:`format_html` of the days with lessons, UTF-8 encoded."""
+        key = (start, days, title)
+        doc = self._documents.get(key)
+        if doc is None:
+            dates = [start + timedelta(days=i) for i in range(days)]
+            doc = format_html(title, [(d, self.lessons(d)) for d in dates if self.lessons(d)]).encode("utf-8")
+            if len(self._documents) >= 8:
+                # Earlier days' weeks; a schedule that rarely changes must not pile them up.
+                self._documents.clear()
+            self._documents[key] = doc
+        return doc
+
+    def search(self, query: str, today: date) -> Tuple[Lesson, ...]:
+        """Lessons matching a free-text query such as "бокс завтра" or "Али пт 18"."""
+        key = (today, " ".join(tokenize(query)))
+        found = self._found.get(key)
+        if found is not None:
+            self._found.move_to_end(key)
+            return found
+        words, days, time_prefix = parse_query(query, today, self.index)
+        found = self._found[key] = tuple(self.index.search(words, days, time_prefix))
+        if len(self._found) > self.search_cache:
+            self._found.popitem(last=False)
+        return found
+
+
+class ScheduleSource:
+    """Fetches the CSV from an http(s) URL or a local path / ``file://`` URL.
+
+    HTTP uses ETag / If-Modified-Since; files use their mtime. ``fetch``
+    returns ``None`` when the source has not changed since the last call.
+    """
+
+    def __init__(self, url: str, timeout: float = 10.0, session: Optional["requests.Session"] = None):
+        self.url = url
+        self.timeout = timeout
+        self.session = session
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self._mtime: Optional[float] = None
+
+    @property
+    def is_http(self) -> bool:
+        return urlparse(self.url).scheme in ("http", "https")
+
+    def fetch(self) -> Optional[str]:
+        if self.is_http:
+            return self._fetch_http()
+        return self._fetch_file()
+
+    def _fetch_http(self) -> Optional[str]:
+        if self.session is None:
+            # Imported on first use (in the refresh thread): file sources and startup don't pay for it.
+            import requests
+
+            self.session = requests.Session()
+        headers = {}
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified:
+            headers["If-Modified-Since"] = self._last_modified
+        resp = self.session.get(self.url, headers=headers, timeout=self.timeout)
+        if resp.status_code == 304:
+            return None
+        resp.raise_for_status()
+        self._etag = resp.headers.get("ETag")
+        self._last_modified = resp.headers.get("Last-Modified")
+        return resp.content.decode("utf-8-sig")
+
+    def _fetch_file(self) -> Optional[str]:
+        parsed = urlparse(self.url)
+        path = parsed.path if parsed.scheme == "file" else self.url
+        mtime = os.stat(path).st_mtime
+        if mtime == self._mtime:
+            return None
+        with open(path, encoding="utf-8-sig") as f:
+            text = f.read()
+        self._mtime = mtime
+        return text
+
+
+class ScheduleCache:
+    """Serves the last good snapshot; refreshes it in the background every ``ttl`` seconds."""
+
+    def __init__(self, source: Optional[ScheduleSource], ttl: float = 300.0):
+        self.source = source
+        self.ttl = ttl
+        self.snapshot = ScheduleSnapshot({})
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> bool:
+        """Fetch and re-index if changed; returns ``True`` when a new snapshot was installed."""
+        if self.source is None:
+            return False
+        try:
+            text = await asyncio.to_thread(self.source.fetch)
+            if text is None:
+                return False
+            # Parsing and indexing happen off the event loop, once per change.
+            snapshot = await asyncio.to_thread(lambda: ScheduleSnapshot(parse_csv(text), self.snapshot.version + 1))
+        except Exception:
+            logger.exception("Schedule refresh failed; keeping snapshot v%s", self.snapshot.version)
+            return False
+        if not snapshot.days and self.snapshot.days:
+            # An empty sheet, a wrong tab or a header-only CSV: not a schedule to replace the last good one.
+            logger.warning("Schedule source returned no lessons; keeping snapshot v%s", self.snapshot.version)
+            return False
+        self.snapshot = snapshot
+        logger.info("Schedule updated: v%s, %s days", snapshot.version, len(snapshot.days))
+        return True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.ttl)
+            await self.refresh()
+
+    async def start(self):
+        await self.refresh()
+        if self.source is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # --- read path: memory only, never does I/O ---
+    def today(self, today: date) -> str:
+        return self.snapshot.render_day(today)
+
+    def week(self, today: date) -> str:
+        return self.snapshot.render_range(today, 7)
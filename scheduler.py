@@ -0,0 +1,150 @@
+# Update scheduler: different chats run concurrently, each chat's updates strictly in order.
+import asyncio
+import contextvars
+import logging
+import sys
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Awaitable, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.ext._application import _STOP_SIGNAL  # pinned to PTB 20.0, see requirements.txt
+
+import logpipe
+
+if TYPE_CHECKING:
+    from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+# One record per processed update; sample it with LOG_SAMPLE=updates=<share>.
+updates_logger = logging.getLogger("updates")
+
+
+def chat_key(update: object) -> Optional[Hashable]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class ChatScheduler:
+    """Runs ``process(update)`` for many chats at once, one update at a time per chat.
+
+    Each chat with pending updates has a FIFO and a single worker task, so a
+    chat's updates (and its ``ConversationHandler`` state) are handled in
+    arrival order. At most ``concurrency`` updates are processed at any moment.
+    ``submit`` blocks while ``max_pending`` updates are queued or running,
+    which pushes back on whoever feeds the scheduler.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[object], Awaitable[None]],
+        concurrency: int = 64,
+        max_pending: int = 1000,
+        metrics: Optional["Metrics"] = None,
+    ):
+        self.process = process
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.metrics = metrics
+        self.pending = 0
+        self._chats: Dict[Hashable, Deque[Tuple[object, float, asyncio.Future, contextvars.Context]]] = {}
+        self._slots = asyncio.Semaphore(concurrency)
+        self._room = asyncio.Condition()
+        self._workers = set()
+        self._no_chat = 0
+
+    def _report(self):
+        if self.metrics is not None:
+            self.metrics.update_queue_depth.set(self.pending)
+            self.metrics.active_chats.set(len(self._chats))
+
+    async def submit(self, update: object) -> asyncio.Future:
+        """Queue ``update``; the returned future resolves once it has been processed."""
+        if self.pending >= self.max_pending:
+            async with self._room:
+                await self._room.wait_for(lambda: self.pending < self.max_pending)
+        key = chat_key(update)
+        if key is None:
+            # Updates without a chat (polls, inline queries, ...) have nothing to stay ordered with.
+            self._no_chat += 1
+            key = ("no-chat", self._no_chat)
+        fut = asyncio.get_running_loop().create_future()
+        # The caller's context travels with the update (the webhook's inline-reply slot lives there).
+        item = (update, time.perf_counter(), fut, contextvars.copy_context())
+        self.pending += 1
+        queue = self._chats.get(key)
+        if queue is None:
+            queue = self._chats[key] = deque()
+            queue.append(item)
+            worker = asyncio.create_task(self._drain_chat(key, queue))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+        else:
+            queue.append(item)
+        self._report()
+        return fut
+
+    async def _run_one(self, update: object):
+        user = getattr(update, "effective_user", None)
+        with logpipe.context(request_id=getattr(update, "update_id", None), tg_user_id=user.id if user else None) as fields:
+            start = time.perf_counter()
+            try:
+                await self.process(update)
+            except Exception:
+                logger.exception("Update %s failed", getattr(update, "update_id", update))
+            fields["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            updates_logger.info("Update handled")
+
+    async def _drain_chat(self, key: Hashable, queue: Deque):
+        while queue:
+            update, queued_at, fut, context = queue[0]
+            async with self._slots:
+                if self.metrics is not None:
+                    self.metrics.update_wait.observe(time.perf_counter() - queued_at)
+                await _create_task(self._run_one(update), context)
+            queue.popleft()
+            self.pending -= 1
+            if not fut.done():
+                fut.set_result(None)
+            async with self._room:
+                self._room.notify_all()
+        del self._chats[key]
+        self._report()
+
+
+def _create_task(coro: Awaitable, context: contextvars.Context) -> asyncio.Task:
+    """A task running in ``context`` (the submitter's, so logs and metrics keep the update's fields)."""
+    if sys.version_info >= (3, 11):
+        return asyncio.create_task(coro, context=context)
+    # Before 3.11 a task copies the context current when it is created.
+    return context.run(asyncio.create_task, coro)
+
+
+class ScheduledApplication(Application):
+    """``Application`` whose fetched updates go through a :class:`ChatScheduler`.
+
+    Built via ``ApplicationBuilder.application_class(ScheduledApplication, kwargs=...)``;
+    pair it with a bounded ``update_queue`` so backpressure reaches the updater.
+    """
+
+    def __init__(self, *, concurrency: int = 64, max_pending: int = 1000, metrics: Optional["Metrics"] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.scheduler = ChatScheduler(self.process_update, concurrency, max_pending, metrics)
+
+    async def _update_fetcher(self) -> None:
+        while True:
+            update = await self.update_queue.get()
+            if update is _STOP_SIGNAL:
+                # stop() waits for the updates still in the scheduler via update_queue.join().
+                while not self.update_queue.empty():
+                    self.update_queue.task_done()
+                self.update_queue.task_done()
+                return
+            fut = await self.scheduler.submit(update)
+            fut.add_done_callback(lambda _: self.update_queue.task_done())
@@ -0,0 +1,95 @@
+# Process-wide resources, reused by every bot instance loaded in this interpreter (see clubs.py).
+import os
+import ssl
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+from db import Writer
+from outbox import SmtpPool
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "256"))
+
+_lock = threading.Lock()
+_writer: Optional[Writer] = None
+_smtp_pools: Dict[tuple, SmtpPool] = {}
+_request: Optional["SharedRequest"] = None
+_ssl_lock = threading.Lock()
+_ssl_context: Optional[ssl.SSLContext] = None
+
+
+def db_writer() -> Writer:
+    """The one SQLite writer thread; each club's file gets its own connection on it."""
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = Writer()
+        return _writer
+
+
+def smtp_pool(host: Optional[str], port: int, user: Optional[str], password: Optional[str], security: str) -> SmtpPool:
+    """One reused SMTP connection per distinct server/account."""
+    key = (host, port, user, password, security)
+    with _lock:
+        pool = _smtp_pools.get(key)
+        if pool is None:
+            pool = _smtp_pools[key] = SmtpPool(host, port, user, password, security=security)
+        return pool
+
+
+def ssl_context() -> ssl.SSLContext:
+    """One verified client context: loading the CA bundle takes ~30 ms, so do it once per process."""
+    global _ssl_context
+    with _ssl_lock:
+        if _ssl_context is None:
+            _ssl_context = httpx.create_ssl_context()
+        return _ssl_context
+
+
+class _HTTPXRequest(HTTPXRequest):
+    # PTB 20.0 creates (and after a shutdown re-creates) its client here.
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(**self._client_kwargs, verify=ssl_context())
+
+
+class SharedRequest(BaseRequest):
+    """One HTTP connection pool for the Bot API calls of several bots.
+
+    Each bot initializes and shuts down its transport; the wrapped client is
+    opened by the first and closed by the last.
+    """
+
+    def __init__(self, inner: BaseRequest):
+        self._inner = inner
+        self._users = 0
+
+    async def initialize(self) -> None:
+        self._users += 1
+        if self._users == 1:
+            await self._inner.initialize()
+
+    async def shutdown(self) -> None:
+        if self._users == 0:
+            return
+        self._users -= 1
+        if self._users == 0:
+            await self._inner.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data: RequestData = None, *args, **kwargs) -> Tuple[int, bytes]:
+        return await self._inner.do_request(url, method, request_data, *args, **kwargs)
+
+
+def bot_request() -> SharedRequest:
+    """Transport for regular Bot API calls; long-polling ``getUpdates`` keeps a connection per bot."""
+    global _request
+    with _lock:
+        if _request is None:
+            _request = SharedRequest(_HTTPXRequest(connection_pool_size=HTTP_POOL_SIZE))
+        return _request
+
+
+def updates_request() -> HTTPXRequest:
+    """Transport for one bot's ``getUpdates`` (PTB builds it even in webhook mode)."""
+    return _HTTPXRequest(connection_pool_size=1)
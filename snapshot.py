@@ -0,0 +1,165 @@
+# Point-in-time copies of the lead DB for exports, reports and migrations.
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+
+from db import connect
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def reading(path: str) -> Iterator[sqlite3.Connection]:
+    """A connection whose reads all see one point in time.
+
+    Holds a single WAL read transaction: the writer keeps committing, this
+    connection just doesn't see it. Keep it for minutes at most, since WAL
+    checkpoints cannot get past an open reader; for longer scans use a
+    :class:`Snapshot`.
+    """
+    conn = connect(path)
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN")
+        # The read transaction starts at the first read, not at BEGIN.
+        conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        yield conn
+    finally:
+        conn.close()
+
+
+class Snapshot:
+    """A separate SQLite file mirroring ``tables`` of ``source_path``.
+
+    Built once with the online backup API, then brought up to date by
+    :meth:`refresh`: rows with a higher ``id`` than the copy already has are
+    appended in one short read of the source, which (in WAL mode) never
+    blocks the bot's writer. A table whose row count still differs afterwards
+    (rows deleted, or its columns changed) triggers a full rebuild. Heavy
+    readers open the copy with :meth:`connect` and scan it at their own pace.
+    """
+
+    def __init__(self, source_path: str, path: Optional[str] = None, tables: Iterable[str] = (), interval: float = 0.0):
+        self.source_path = source_path
+        self.path = path or source_path + ".snapshot"
+        self.tables = list(tables)
+        self.interval = interval
+        self.refreshed_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _open(self) -> sqlite3.Connection:
+        # URI mode so that ATTACH below understands "file:...?mode=ro".
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.path)}", uri=True, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = OFF")  # a lost copy is simply rebuilt
+        return conn
+
+    def connect(self) -> sqlite3.Connection:
+        """Read-only connection to the copy (refresh it first if it must be current)."""
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.path)}?mode=ro", uri=True, timeout=30)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        return conn
+
+    def rebuild(self):
+        """Copy the whole source with the backup API (one step, i.e. one read transaction)."""
+        with self._lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        started = time.monotonic()
+        source = connect(self.source_path)
+        target = self._open()
+        try:
+            source.backup(target)
+            # Lead triggers (e.g. the stats rollups) must not fire on copied rows.
+            for (name,) in target.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+                target.execute(f"DROP TRIGGER {name}")
+        finally:
+            target.close()
+            source.close()
+        self.refreshed_at = time.time()
+        logger.info("Snapshot %s rebuilt in %.1fs", self.path, time.monotonic() - started)
+
+    def refresh(self) -> int:
+        """Bring the copy up to date; returns how many rows were appended."""
+        with self._lock:
+            if not os.path.exists(self.path):
+                self._rebuild()
+                return 0
+            conn = self._open()
+            try:
+                conn.execute("ATTACH DATABASE ? AS src", (f"file:{os.path.abspath(self.source_path)}?mode=ro",))
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    added, stale = 0, False
+                    for table in self.tables:
+                        added += conn.execute(
+                            f"INSERT INTO main.{table} SELECT * FROM src.{table} "
+                            f"WHERE id > (SELECT COALESCE(MAX(id), 0) FROM main.{table})"
+                        ).rowcount
+                        mine = conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+                        theirs = conn.execute(f"SELECT COUNT(*) FROM src.{table}").fetchone()[0]
+                        if mine != theirs:
+                            stale = True
+                            break
+                    conn.execute("COMMIT")
+                except sqlite3.OperationalError:
+                    # Missing table or changed columns.
+                    conn.execute("ROLLBACK")
+                    stale = True
+            finally:
+                conn.close()
+            if stale:
+                self._rebuild()
+                return 0
+            self.refreshed_at = time.time()
+            return added
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                added = await asyncio.to_thread(self.refresh)
+                logger.debug("Snapshot %s: %s new rows", self.path, added)
+            except Exception:
+                logger.exception("Snapshot refresh failed")
+
+    async def start(self):
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create or refresh a point-in-time copy of the lead DB.")
+    parser.add_argument("db_path")
+    parser.add_argument("tables", nargs="+", help="append-only tables to refresh incrementally, e.g. guest_visits")
+    parser.add_argument("-o", "--output", help="snapshot file (default: <db_path>.snapshot)")
+    parser.add_argument("--rebuild", action="store_true", help="copy everything again")
+    opts = parser.parse_args(argv)
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    snap = Snapshot(opts.db_path, opts.output, opts.tables)
+    if opts.rebuild:
+        snap.rebuild()
+    else:
+        print(f"appended {snap.refresh()} rows to {snap.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# Cold-start profile of a bot script: import time per module, then the time of each init step.
+import argparse
+import asyncio
+import functools
+import importlib.util
+import inspect
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+MARKER = "startup-profile:"
+# Per-component steps timed in the child: e.g. OUTBOX.start, LEAD_STATS.init_db, LEADS.warm.
+COMPONENT_METHODS = ("init_db", "start", "warm")
+# Background jobs that send mail, write archives or open a port: their start() is timed but does
+# not start the job (only the component's own init_db runs).
+BACKGROUND_JOBS = frozenset({"Outbox", "LeadDigest", "Snapshot", "Archiver", "Metrics"})
+
+
+def _timed(steps: List[Tuple[str, float]], name: str, func):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                steps.append((name, time.perf_counter() - start))
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                steps.append((name, time.perf_counter() - start))
+    return wrapper
+
+
+async def _init_only(component, *args, **kwargs):
+    if callable(getattr(component, "init_db", None)):
+        component.init_db()
+
+
+def _resume_none(unfinished):
+    unfinished()
+    return []
+
+
+def _child(script: str):
+    """Runs in a fresh interpreter started with ``-X importtime``; reports steps on stdout."""
+    steps: List[Tuple[str, float]] = []
+    started = time.perf_counter()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    spec = importlib.util.spec_from_file_location("bot_under_profile", script)
+    module = importlib.util.module_from_spec(spec)
+    _timed(steps, f"import {os.path.basename(script)}", spec.loader.exec_module)(module)
+
+    for name, obj in list(vars(module).items()):
+        if not name.isupper() or inspect.ismodule(obj) or isinstance(obj, type):
+            continue
+        for method in COMPONENT_METHODS:
+            func = getattr(obj, method, None)
+            if callable(func) and inspect.ismethod(func):
+                setattr(obj, method, _timed(steps, f"{name}.{method}", func))
+        if type(obj).__name__ in BACKGROUND_JOBS and hasattr(obj, "start"):
+            obj.start = _timed(steps, f"{name}.start (job not started)", functools.partial(_init_only, obj))
+        unfinished = getattr(obj, "unfinished", None)
+        if type(obj).__name__ == "Broadcaster" and callable(unfinished):
+            # Broadcasts are looked up as on a real start, but none is resumed.
+            obj.unfinished = _timed(steps, f"{name}.unfinished", functools.partial(_resume_none, unfinished))
+
+    if hasattr(module, "init_db"):
+        _timed(steps, "init_db()", module.init_db)()
+    build = getattr(module, "build_application", None) or getattr(module, "build_app")
+    app = _timed(steps, "build application", build)()
+
+    async def post_init():
+        # Everything the bot does before its first getUpdates/webhook request, minus the Bot API calls.
+        if app.post_init:
+            await _timed(steps, "post_init", app.post_init)(app)
+        steps.append(("time to first update", time.perf_counter() - started))
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+    asyncio.run(post_init())
+    print(MARKER + json.dumps(steps), flush=True)
+
+
+def parse_importtime(stderr: str) -> Dict[str, float]:
+    """Self time (seconds) per top-level package from ``-X importtime`` output."""
+    packages: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # the header line
+        top = name.strip().split(".")[0]
+        packages[top] = packages.get(top, 0.0) + int(self_us) / 1e6
+    return packages
+
+
+def _copy_db(source: str, target: str):
+    """Consistent copy of a live (WAL) database via the backup API; the source is only read."""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def profile(script: str, top: int = 15, db: str = "") -> str:
+    """Profile ``script`` against a throwaway copy of ``db`` (a new, empty file if there is none)."""
+    with tempfile.TemporaryDirectory(prefix="startup-profile-") as tmp:
+        env = dict(os.environ)
+        env.setdefault("TG_BOT_TOKEN", "0:profile-startup")
+        # Everything the bot writes goes to the temp directory, never to the production files.
+        env.update(
+            DB_PATH=os.path.join(tmp, "bot.sqlite3"),
+            SNAPSHOT_PATH=os.path.join(tmp, "snapshot.sqlite3"),
+            ARCHIVE_DIR=os.path.join(tmp, "archive"),
+            METRICS_PORT="0",
+        )
+        if db and os.path.exists(db):
+            _copy_db(db, env["DB_PATH"])
+            source = f"a copy of {db}"
+        else:
+            source = "a new database"
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", os.path.abspath(__file__), "--child", script],
+            capture_output=True, text=True, env=env,
+        )
+    lines = [l for l in proc.stdout.splitlines() if l.startswith(MARKER)]
+    if proc.returncode or not lines:
+        errors = [l for l in proc.stderr.splitlines() if not l.startswith("import time:")]
+        raise RuntimeError(f"profiled start of {script} failed:\n" + "\n".join(errors[-20:]))
+    steps = json.loads(lines[-1][len(MARKER):])
+    packages = parse_importtime(proc.stderr)
+
+    def ms(seconds: float) -> str:
+        return f"{seconds * 1000:8.1f} ms"
+
+    out = [
+        f"Startup of {script} in a fresh interpreter on {source} "
+        "(Bot API calls not included, background jobs not started)",
+        "",
+        "Steps:",
+    ]
+    out.extend(f"  {name:<32}{ms(seconds)}" for name, seconds in steps)
+    out.extend(["", f"Imports: {ms(sum(packages.values())).strip()} in total, slowest packages (self time):"])
+    for name, seconds in sorted(packages.items(), key=lambda p: -p[1])[:top]:
+        out.append(f"  {name:<32}{ms(seconds)}")
+    return "\n".join(out)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure a bot's cold start: imports per package and each init step.")
+    parser.add_argument("script", help="bot.py or bot-2.py")
+    parser.add_argument("--top", type=int, default=15, help="how many packages to list")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", ""), help="database to profile on (copied first; default $DB_PATH)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    opts = parser.parse_args(argv)
+    if opts.child:
+        _child(opts.script)
+        return 0
+    print(profile(opts.script, opts.top, opts.db))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+# Lead statistics kept as rollups by an insert trigger: per day, per week and all time.
+import argparse
+import logging
+import sqlite3
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from db import Database, connect
+
+logger = logging.getLogger(__name__)
+
+STATS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS lead_stats (
+    table_name TEXT NOT NULL,
+    period TEXT NOT NULL,  -- 'all', 'd:YYYY-MM-DD' or 'w:<monday>'
+    leads INTEGER NOT NULL,
+    unique_users INTEGER NOT NULL,
+    repeat_leads INTEGER NOT NULL,
+    PRIMARY KEY (table_name, period)
+);
+CREATE TABLE IF NOT EXISTS lead_stats_users (
+    table_name TEXT NOT NULL,
+    period TEXT NOT NULL,
+    user_key TEXT NOT NULL,
+    PRIMARY KEY (table_name, period, user_key)
+) WITHOUT ROWID;
+'''
+
+# Who was seen on a day/week is only needed while leads still arrive for it.
+USER_DAYS = 14
+
+
+def _exprs(prefix: str, offset_minutes: int) -> Tuple[str, str, str]:
+    """SQL for the user identity, local day and local week (Monday) of a lead row."""
+    # Leads without a Telegram id (e.g. migrated ones) are told apart by phone,
+    # and a lead with neither is a person of its own.
+    user = f"COALESCE('u' || {prefix}tg_user_id, 'p' || {prefix}phone, 'i' || {prefix}id)"
+    local = f"substr({prefix}created_at, 1, 19), '{offset_minutes:+d} minutes'"
+    return user, f"date({local})", f"date({local}, '-6 days', 'weekday 1')"
+
+
+class LeadStats:
+    """Daily/weekly/all-time lead counts, unique users and repeat leads for ``table``.
+
+    An ``AFTER INSERT`` trigger updates ``lead_stats`` in the same
+    transaction as the lead itself, so reads are a handful of primary-key
+    lookups however large the table grows. ``lead_stats_users`` remembers
+    who was already seen per period. Days follow ``timezone`` (its current
+    UTC offset; the triggers are rebuilt when it changes).
+    """
+
+    def __init__(self, db: Database, table: str, timezone: Optional[ZoneInfo] = None):
+        self.db = db
+        self.table = table
+        self.timezone = timezone or ZoneInfo("UTC")
+        offset = datetime.now(self.timezone).utcoffset() or timedelta(0)
+        self.offset_minutes = int(offset.total_seconds() // 60)
+        self.trigger = f"trg_{table}_lead_stats"
+
+    def _trigger_sql(self) -> str:
+        user, day, week = _exprs("NEW.", self.offset_minutes)
+        t = self.table
+        periods = f"SELECT 'all' AS period UNION ALL SELECT 'd:' || {day} UNION ALL SELECT 'w:' || {week}"
+        return f'''CREATE TRIGGER {self.trigger} AFTER INSERT ON {t}
+BEGIN
+    INSERT INTO lead_stats (table_name, period, leads, unique_users, repeat_leads)
+    SELECT '{t}', p.period, 1,
+        NOT EXISTS (SELECT 1 FROM lead_stats_users s WHERE s.table_name = '{t}' AND s.period = p.period AND s.user_key = {user}),
+        EXISTS (SELECT 1 FROM lead_stats_users s WHERE s.table_name = '{t}' AND s.period = 'all' AND s.user_key = {user})
+    FROM ({periods}) p WHERE p.period IS NOT NULL
+    ON CONFLICT (table_name, period) DO UPDATE SET
+        leads = leads + 1,
+        unique_users = unique_users + excluded.unique_users,
+        repeat_leads = repeat_leads + excluded.repeat_leads;
+    INSERT OR IGNORE INTO lead_stats_users (table_name, period, user_key)
+    SELECT '{t}', p.period, {user} FROM ({periods}) p WHERE p.period IS NOT NULL;
+    DELETE FROM lead_stats_users
+        WHERE table_name = '{t}' AND period > 'd:' AND period < 'd:' || date({day}, '-{USER_DAYS} days');
+    DELETE FROM lead_stats_users
+        WHERE table_name = '{t}' AND period > 'w:' AND period < 'w:' || date({day}, '-{USER_DAYS} days');
+END'''
+
+    def _archived(self, conn: sqlite3.Connection) -> bool:
+        """Whether archive.py has moved rows of ``table`` out; a backfill would no longer see them."""
+        try:
+            return conn.execute("SELECT 1 FROM lead_archive_batches WHERE table_name = ? LIMIT 1", (self.table,)).fetchone() is not None
+        except sqlite3.OperationalError:
+            return False  # never archived
+
+    def init_db(self):
+        """Create the rollups and the trigger; backfill when the trigger is new or changed.
+
+        Once leads have been archived, a changed trigger is only reinstalled:
+        the rollups already hold the archived leads, a backfill would drop them.
+        """
+        self.db.executescript(STATS_SCHEMA)
+        conn = self.db.connect()
+        try:
+            row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (self.trigger,)).fetchone()
+            if row is not None and row[0] == self._trigger_sql():
+                return
+            if row is not None and self._archived(conn):
+                logger.warning("%s has archived leads: reinstalling the stats trigger without a backfill", self.table)
+                conn.isolation_level = None
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(f"DROP TRIGGER IF EXISTS {self.trigger}")
+                conn.execute(self._trigger_sql())
+                conn.execute("COMMIT")
+                return
+        finally:
+            conn.close()
+        self.backfill()
+
+    def backfill(self):
+        """Recompute the rollups of ``table`` from scratch and (re)install the trigger.
+
+        Runs as one write transaction, so leads inserted meanwhile wait for it
+        and are then counted by the trigger; nothing is counted twice. Refuses
+        (``RuntimeError``) once rows have been archived: they are no longer in
+        the table, and their counts would be lost.
+        """
+        user, day, week = _exprs("", self.offset_minutes)
+        t = self.table
+        conn = connect(self.db.path)
+        conn.isolation_level = None
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if self._archived(conn):
+                raise RuntimeError(f"{t} has archived leads; a backfill from the table alone would drop their counts")
+            conn.execute(f"DROP TRIGGER IF EXISTS {self.trigger}")
+            conn.execute("DELETE FROM lead_stats WHERE table_name = ?", (t,))
+            conn.execute("DELETE FROM lead_stats_users WHERE table_name = ?", (t,))
+            conn.execute("DROP TABLE IF EXISTS temp.stats_leads")
+            conn.execute(
+                f"CREATE TEMP TABLE stats_leads AS SELECT {user} AS user_key, {day} AS day, {week} AS week, "
+                f"ROW_NUMBER() OVER (PARTITION BY {user} ORDER BY id) > 1 AS rep FROM {t}"
+            )
+            # Leads without created_at only count towards 'all'; user sets are kept for recent periods only.
+            recent = f"date('now', '{self.offset_minutes:+d} minutes', '-{USER_DAYS} days')"
+            for period, where, group, users in (
+                ("'all'", "", "", ""),
+                ("'d:' || day", "WHERE day IS NOT NULL", "GROUP BY day", f"WHERE day >= {recent}"),
+                ("'w:' || week", "WHERE week IS NOT NULL", "GROUP BY week", f"WHERE week >= {recent}"),
+            ):
+                conn.execute(
+                    f"INSERT INTO lead_stats (table_name, period, leads, unique_users, repeat_leads) "
+                    f"SELECT ?, {period}, COUNT(*), COUNT(DISTINCT user_key), COALESCE(SUM(rep), 0) "
+                    f"FROM stats_leads {where} {group} HAVING COUNT(*) > 0",
+                    (t,),
+                )
+                conn.execute(
+                    f"INSERT OR IGNORE INTO lead_stats_users (table_name, period, user_key) "
+                    f"SELECT DISTINCT ?, {period}, user_key FROM stats_leads {users}",
+                    (t,),
+                )
+            conn.execute("DROP TABLE temp.stats_leads")
+            conn.execute(self._trigger_sql())
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _periods(self, periods) -> Dict[str, Tuple[int, int, int]]:
+        conn = self.db.connect()
+        try:
+            marks = ",".join("?" * len(periods))
+            return {
+                period: (leads, users, repeat)
+                for period, leads, users, repeat in conn.execute(
+                    f"SELECT period, leads, unique_users, repeat_leads FROM lead_stats "
+                    f"WHERE table_name = ? AND period IN ({marks})",
+                    (self.table, *periods),
+                )
+            }
+        finally:
+            conn.close()
+
+    def summary(self, today: Optional[date] = None) -> str:
+        """Report for /stats: today, yesterday, this/last week, the last 7 days and all time."""
+        today = today or datetime.now(self.timezone).date()
+        monday = today - timedelta(days=today.weekday())
+        days = [today - timedelta(days=i) for i in range(7)]
+        rows = self._periods(
+            ["all", f"w:{monday}", f"w:{monday - timedelta(days=7)}"] + [f"d:{d}" for d in days]
+        )
+
+        def line(title: str, period: str) -> str:
+            leads, users, repeat = rows.get(period, (0, 0, 0))
+            share = f", повторные {repeat} ({repeat * 100 // leads}%)" if leads else ""
+            return f"{title}: {leads} заявок, {users} чел.{share}"
+
+        lines = [
+            "📈 Заявки на гостевой визит",
+            line("Сегодня", f"d:{today}"),
+            line("Вчера", f"d:{days[1]}"),
+            line("Эта неделя", f"w:{monday}"),
+            line("Прошлая неделя", f"w:{monday - timedelta(days=7)}"),
+            line("Всего", "all"),
+            "",
+            "По дням: " + ", ".join(f"{d:%d.%m} — {rows.get(f'd:{d}', (0,))[0]}" for d in reversed(days)),
+        ]
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lead statistics from the rollup tables.")
+    parser.add_argument("db_path")
+    parser.add_argument("table", choices=["guest_visits", "guest_requests"])
+    parser.add_argument("--backfill", action="store_true", help="recompute the rollups from all existing rows")
+    parser.add_argument("--tz", default="Asia/Dushanbe", help="timezone that defines a day")
+    opts = parser.parse_args(argv)
+    stats = LeadStats(Database(opts.db_path), opts.table, ZoneInfo(opts.tz))
+    if opts.backfill:
+        stats.db.executescript(STATS_SCHEMA)
+        try:
+            stats.backfill()
+        except RuntimeError as e:
+            parser.exit(1, f"{e}\n")
+    else:
+        stats.init_db()
+    print(stats.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# Webhook serving mode: embedded asyncio HTTP server + inline replies in the webhook response.
+import asyncio
+import contextvars
+import hmac
+import json
+import logging
+import signal
+import time
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+from scheduler import ChatScheduler
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+# Methods Telegram accepts as a webhook response body; their results are not needed by handlers.
+INLINE_METHODS = frozenset({"sendMessage", "sendLocation", "sendVenue", "sendChatAction",
+                            "answerCallbackQuery", "answerInlineQuery"})
+MAX_BODY = 1 << 20
+
+
+class _InlineSlot:
+    """At most one Bot API call per update that can ride back in the HTTP response."""
+
+    __slots__ = ("url", "request_data", "method", "closed")
+
+    def __init__(self):
+        self.url: Optional[str] = None
+        self.request_data: Optional[RequestData] = None
+        self.method: Optional[str] = None
+        self.closed = False
+
+    def payload(self) -> Optional[bytes]:
+        if self.method is None:
+            return None
+        return json.dumps({"method": self.method, **self.request_data.parameters}).encode("utf-8")
+
+
+_slot: contextvars.ContextVar[Optional[_InlineSlot]] = contextvars.ContextVar("webhook_inline_slot", default=None)
+
+
+def _fake_result(method: str, params: dict) -> dict:
+    if not method.startswith("send") or method == "sendChatAction":
+        return {"ok": True, "result": True}
+    return {
+        "ok": True,
+        "result": {
+            "message_id": 0,
+            "date": int(time.time()),
+            "chat": {"id": params.get("chat_id"), "type": "private"},
+            "text": params.get("text", ""),
+        },
+    }
+
+
+class InlineReplyRequest(BaseRequest):
+    """Bot transport that defers the first inline-able call of an update to the webhook response.
+
+    If the handler makes another call afterwards, the deferred one is sent
+    first over the wrapped transport, so chat ordering is preserved.
+    """
+
+    def __init__(self, inner: Optional[BaseRequest] = None):
+        self._inner = inner or HTTPXRequest(connection_pool_size=16)
+
+    async def initialize(self) -> None:
+        await self._inner.initialize()
+
+    async def shutdown(self) -> None:
+        await self._inner.shutdown()
+
+    async def _flush(self, slot: _InlineSlot):
+        url, data = slot.url, slot.request_data
+        slot.url = slot.request_data = slot.method = None
+        status, payload = await self._inner.do_request(url, "POST", data)
+        if status != 200:
+            logger.warning("Deferred %s failed: %s %s", url.rsplit("/", 1)[-1], status, payload[:200])
+
+    async def do_request(self, url: str, method: str, request_data: RequestData = None, *args, **kwargs) -> Tuple[int, bytes]:
+        slot = _slot.get()
+        if slot is not None and not slot.closed:
+            api_method = url.rsplit("/", 1)[-1]
+            if slot.method is None and api_method in INLINE_METHODS and request_data is not None \
+                    and not request_data.contains_files:
+                slot.url, slot.request_data, slot.method = url, request_data, api_method
+                return 200, json.dumps(_fake_result(api_method, request_data.parameters)).encode("utf-8")
+            slot.closed = True
+            if slot.method is not None:
+                await self._flush(slot)
+        return await self._inner.do_request(url, method, request_data, *args, **kwargs)
+
+
+# --- minimal HTTP/1.1 plumbing (shared with fake_telegram.py) ---
+async def read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode("latin-1").split(" ", 2)
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0"))
+    if length > MAX_BODY:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def write_response(writer: asyncio.StreamWriter, status: int, body: bytes = b"", content_type: str = "application/json"):
+    reason = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 429: "Too Many Requests",
+              500: "Internal Server Error"}
+    head = (
+        f"HTTP/1.1 {status} {reason.get(status, 'OK')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: keep-alive\r\n\r\n"
+    )
+    writer.write(head.encode("latin-1") + body)
+
+
+class WebhookServer:
+    """Receives Telegram updates over HTTP and feeds them to ``app.process_update``.
+
+    Updates go through the app's :class:`ChatScheduler` (or a private one): one
+    chat's updates are processed in arrival order, different chats concurrently.
+    """
+
+    def __init__(self, app: Application, path: str, secret: Optional[str], host: str = "0.0.0.0", port: int = 8443):
+        self.app = app
+        self.path = path
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.base_events.Server] = None
+        self.scheduler = getattr(app, "scheduler", None) or ChatScheduler(app.process_update if app is not None else None)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Webhook server listening on %s:%s%s", self.host, self.port, self.path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    write_response(writer, 400)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = await self._handle(method, path, headers, body)
+                write_response(writer, status, payload)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, bytes]:
+        if method != "POST" or path != self.path:
+            return 404, b""
+        if self.secret and not hmac.compare_digest(headers.get(SECRET_HEADER, ""), self.secret):
+            return 403, b""
+        try:
+            update = Update.de_json(json.loads(body), self.app.bot)
+        except Exception:
+            logger.warning("Malformed webhook payload")
+            return 400, b""
+        reply = await self.process(update)
+        return 200, reply or b""
+
+    async def process(self, update: Update) -> Optional[bytes]:
+        """Run the handlers for ``update``; returns the inline Bot API call, if any."""
+        slot = _InlineSlot()
+        token = _slot.set(slot)
+        try:
+            await (await self.scheduler.submit(update))
+        finally:
+            _slot.reset(token)
+            slot.closed = True
+        return slot.payload()
+
+
+class WebhookRouter(WebhookServer):
+    """One listener for several bots: each POST goes to the :class:`WebhookServer` owning its path."""
+
+    def __init__(self, servers: Iterable[WebhookServer], host: str = "0.0.0.0", port: int = 8443):
+        super().__init__(None, "", None, host, port)
+        self.routes: Dict[str, WebhookServer] = {}
+        for server in servers:
+            if server.path in self.routes:
+                raise ValueError(f"webhook path {server.path!r} is used by two bots")
+            self.routes[server.path] = server
+
+    async def _handle(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, bytes]:
+        server = self.routes.get(path)
+        if server is None:
+            return 404, b""
+        return await server._handle(method, path, headers, body)
+
+
+async def serve_webhook(
+    app: Application,
+    url: str,
+    secret: Optional[str],
+    host: str = "0.0.0.0",
+    port: int = 8443,
+    path: Optional[str] = None,
+    stop_event: Optional[asyncio.Event] = None,
+):
+    """Run ``app`` in webhook mode until ``stop_event`` is set (or SIGINT/SIGTERM)."""
+    path = path or urlparse(url).path or "/"
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    server = WebhookServer(app, path, secret, host, port)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    try:
+        await server.start()
+        await app.bot.set_webhook(url, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+        await app.start()
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def run_webhook(app: Application, url: str, secret: Optional[str], host: str = "0.0.0.0", port: int = 8443):
+    asyncio.run(serve_webhook(app, url, secret, host, port))